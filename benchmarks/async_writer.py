@@ -0,0 +1,122 @@
+# SPDX-FileCopyrightText: Copyright (c) 2023 NVIDIA CORPORATION & AFFILIATES.
+# SPDX-FileCopyrightText: All rights reserved.
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Benchmark the background output writer of ``run_ensembles``
+
+Runs a toy time loop whose steps cost roughly as much as writing their output
+and compares the wall time of synchronous writes (``--queue-depth 0``) with the
+background writer. With the writer enabled the total time should approach
+``max(step, write)`` per output step rather than ``step + write``.
+
+Usage::
+
+    python benchmarks/async_writer.py --steps 20 --nlat 181 --nlon 360
+"""
+import argparse
+import datetime
+import tempfile
+import time
+
+import netCDF4
+import torch
+
+import earth2mip.grid
+from earth2mip import weather_events
+from earth2mip.inference_ensemble import run_ensembles
+
+
+class ToyTimeLoop:
+    def __init__(self, grid, n_channels, device, flops):
+        self.grid = grid
+        self.in_channel_names = self.out_channel_names = [
+            f"c{i}" for i in range(n_channels)
+        ]
+        self.device = torch.device(device)
+        self.time_step = datetime.timedelta(hours=6)
+        self.dtype = torch.float32
+        self.weight = torch.randn(flops, flops, device=device)
+
+    def __call__(self, time, x, restart=None):
+        x = x[:, -1]
+        yield time, x, None
+        while True:
+            # burn some compute, similar in cost to a model step
+            self.weight @ self.weight
+            if self.device.type == "cuda":
+                torch.cuda.synchronize()
+            x = x + 1
+            time += self.time_step
+            yield time, x, None
+
+
+def run(model, n_steps, batch_size, queue_depth):
+    domain = weather_events.Window(
+        name="global",
+        diagnostics=[
+            weather_events.Diagnostic(type="raw", channels=model.out_channel_names)
+        ],
+    )
+    x = torch.zeros(1, 1, len(model.in_channel_names), *model.grid.shape)
+    x = x.to(model.device)
+    with tempfile.NamedTemporaryFile(suffix=".nc") as f:
+        with netCDF4.Dataset(f.name, "w") as nc:
+            start = time.perf_counter()
+            run_ensembles(
+                n_steps=n_steps,
+                weather_event=None,
+                model=model,
+                perturb=lambda x, *args: x,
+                x=x,
+                nc=nc,
+                domains=[domain],
+                n_ensemble=batch_size,
+                batch_size=batch_size,
+                rank=0,
+                output_frequency=1,
+                output_grid=None,
+                date_obj=datetime.datetime(2018, 1, 1),
+                restart_frequency=None,
+                output_path=f.name,
+                progress=False,
+                output_queue_depth=queue_depth,
+            )
+            return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--steps", type=int, default=20)
+    parser.add_argument("--batch-size", type=int, default=2)
+    parser.add_argument("--channels", type=int, default=8)
+    parser.add_argument("--nlat", type=int, default=181)
+    parser.add_argument("--nlon", type=int, default=360)
+    parser.add_argument("--flops", type=int, default=1024)
+    parser.add_argument("--queue-depth", type=int, nargs="+", default=[0, 1, 2, 4])
+    parser.add_argument(
+        "--device", default="cuda" if torch.cuda.is_available() else "cpu"
+    )
+    args = parser.parse_args()
+
+    grid = earth2mip.grid.equiangular_lat_lon_grid(args.nlat, args.nlon)
+    model = ToyTimeLoop(grid, args.channels, args.device, args.flops)
+
+    print("queue_depth,seconds,seconds_per_step")
+    for depth in args.queue_depth:
+        elapsed = run(model, args.steps, args.batch_size, depth)
+        print(f"{depth},{elapsed:.3f},{elapsed / (args.steps + 1):.4f}")
+
+
+if __name__ == "__main__":
+    main()
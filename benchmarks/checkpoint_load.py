@@ -0,0 +1,144 @@
+# SPDX-FileCopyrightText: Copyright (c) 2023 NVIDIA CORPORATION & AFFILIATES.
+# SPDX-FileCopyrightText: All rights reserved.
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Benchmark loading checkpoints with ``earth2mip.checkpoint``
+
+Writes a training checkpoint of a toy model (a state dict with ``module.``
+prefixes under "model_state", next to an optimizer state of the same size) and
+loads it into the model
+
+- torch.load: ``torch.load(map_location=device)``, then renaming the keys into a
+  new dict and ``load_state_dict``, as the loaders did before
+- mmap: ``checkpoint.load_state_dict`` and ``checkpoint.load_module``
+- converted: the same, from the output of ``checkpoint.convert``
+
+Every load runs in a new process, which reports the seconds and its peak
+resident memory. The checkpoints are evicted from the page cache before each
+load (``posix_fadvise``), so the times include reading from disk. On the CPU
+the memory mapped modes share the pages of the file, which are only read when
+the model first uses them.
+
+Usage::
+
+    python benchmarks/checkpoint_load.py --size-mb 1000 --device cuda
+"""
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import torch
+
+from earth2mip import checkpoint
+
+MODES = ["torch.load", "mmap", "converted"]
+
+
+def build(size_mb: int) -> torch.nn.Module:
+    width = 1024
+    n_layers = max(size_mb * 2**20 // (4 * width * width), 1)
+    return torch.nn.Sequential(
+        *[torch.nn.Linear(width, width, bias=False) for _ in range(n_layers)]
+    )
+
+
+def evict(path: str):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+
+
+def load(mode: str, path: str, size_mb: int, device: str):
+    with torch.device("meta"):
+        model = build(size_mb)
+    model = model.to_empty(device=device)
+    baseline_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    start = time.perf_counter()
+    if mode == "torch.load":
+        weights = torch.load(path, map_location=device)
+        fixed = {}
+        for key, value in weights["model_state"].items():
+            fixed[key.replace("module.", "")] = value
+        model.load_state_dict(fixed)
+    else:
+        if mode == "converted":
+            state_dict = checkpoint.load_state_dict(path)
+        else:
+            state_dict = checkpoint.load_state_dict(
+                path, key="model_state", strip_prefix="module."
+            )
+        checkpoint.load_module(model, state_dict)
+    if device.startswith("cuda"):
+        torch.cuda.synchronize()
+    seconds = time.perf_counter() - start
+
+    peak_mb = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline_kb) / 1024
+    print(f"{seconds},{peak_mb}")
+
+
+def run(mode: str, path: str, size_mb: int, device: str):
+    evict(path)
+    args = [sys.executable, __file__, "--load", mode, path]
+    args += ["--size-mb", str(size_mb), "--device", device]
+    proc = subprocess.run(args, capture_output=True, text=True)  # noqa: S603
+    proc.check_returncode()
+    seconds, peak_mb = proc.stdout.strip().splitlines()[-1].split(",")
+    return float(seconds), float(peak_mb)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size-mb", type=int, default=500)
+    parser.add_argument(
+        "--device", default="cuda" if torch.cuda.is_available() else "cpu"
+    )
+    parser.add_argument(
+        "--load", nargs=2, metavar=("MODE", "PATH"), help=argparse.SUPPRESS
+    )
+    args = parser.parse_args()
+
+    if args.load:
+        load(*args.load, args.size_mb, args.device)
+        return
+
+    with tempfile.TemporaryDirectory() as d:
+        model = build(args.size_mb)
+        state = {"module." + k: v for k, v in model.state_dict().items()}
+        optimizer_state = {k: torch.zeros_like(v) for k, v in state.items()}
+        path = os.path.join(d, "weights.tar")
+        torch.save({"model_state": state, "optimizer_state": optimizer_state}, path)
+        del model, state, optimizer_state
+        converted = checkpoint.convert(path, key="model_state", strip_prefix="module.")
+
+        print("mode,seconds,peak_rss_increase_mb")
+        for mode in MODES:
+            seconds, peak_mb = run(
+                mode,
+                converted if mode == "converted" else path,
+                args.size_mb,
+                args.device,
+            )
+            print(f"{mode},{seconds:.3f},{peak_mb:.0f}")
+
+
+if __name__ == "__main__":
+    main()
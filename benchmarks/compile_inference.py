@@ -0,0 +1,124 @@
+# SPDX-FileCopyrightText: Copyright (c) 2023 NVIDIA CORPORATION & AFFILIATES.
+# SPDX-FileCopyrightText: All rights reserved.
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Benchmark the compiled time steps of ``networks.Inference``
+
+Runs toy models with the channel counts of FCN (26 channels) and SFNO (73
+channels) on a coarsened grid, eagerly and with ``Inference.enable_compile``,
+and prints the mean time per step. The first step of the compiled run, which
+includes compiling, is reported separately.
+
+The toy model is a stack of pointwise MLPs and depthwise convolutions, so most
+of its time goes into elementwise ops that the compiler can fuse.
+
+Usage::
+
+    python benchmarks/compile_inference.py --steps 10 --nlat 181 --nlon 360
+"""
+import argparse
+import datetime
+import time
+
+import numpy as np
+import torch
+
+import earth2mip.grid
+from earth2mip import networks
+
+CONFIGS = {"fcn": 26, "sfno": 73}
+
+
+class ToyModel(torch.nn.Module):
+    def __init__(self, n_channels, embed_dim, depth):
+        super().__init__()
+        self.encoder = torch.nn.Conv2d(n_channels, embed_dim, 1)
+        self.blocks = torch.nn.ModuleList(
+            torch.nn.Sequential(
+                torch.nn.Conv2d(embed_dim, embed_dim, 3, padding=1, groups=embed_dim),
+                torch.nn.GroupNorm(1, embed_dim),
+                torch.nn.Conv2d(embed_dim, 2 * embed_dim, 1),
+                torch.nn.GELU(),
+                torch.nn.Conv2d(2 * embed_dim, embed_dim, 1),
+            )
+            for _ in range(depth)
+        )
+        self.decoder = torch.nn.Conv2d(embed_dim, n_channels, 1)
+
+    def forward(self, x):
+        y = self.encoder(x)
+        for block in self.blocks:
+            y = y + block(y)
+        return x + self.decoder(y)
+
+
+def build(n_channels, grid, embed_dim, depth, device):
+    model = networks.Inference(
+        ToyModel(n_channels, embed_dim, depth),
+        center=np.zeros(n_channels),
+        scale=np.ones(n_channels),
+        grid=grid,
+        channel_names=[f"c{i}" for i in range(n_channels)],
+    )
+    return model.to(device).eval()
+
+
+def run(model, x, n_steps):
+    """Return the seconds of the first step and the mean of the others"""
+    times = []
+    iterator = model(datetime.datetime(2018, 1, 1), x)
+    next(iterator)
+    for _ in range(n_steps + 1):
+        start = time.perf_counter()
+        next(iterator)
+        if x.device.type == "cuda":
+            torch.cuda.synchronize()
+        times.append(time.perf_counter() - start)
+    return times[0], sum(times[1:]) / n_steps
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--steps", type=int, default=10)
+    parser.add_argument("--batch-size", type=int, default=1)
+    parser.add_argument("--nlat", type=int, default=181)
+    parser.add_argument("--nlon", type=int, default=360)
+    parser.add_argument("--embed-dim", type=int, default=64)
+    parser.add_argument("--depth", type=int, default=4)
+    parser.add_argument("--config", nargs="+", default=list(CONFIGS))
+    parser.add_argument("--cuda-graphs", action="store_true")
+    parser.add_argument(
+        "--device", default="cuda" if torch.cuda.is_available() else "cpu"
+    )
+    args = parser.parse_args()
+
+    grid = earth2mip.grid.equiangular_lat_lon_grid(args.nlat, args.nlon)
+    print("config,mode,first_step_seconds,seconds_per_step")
+    for name in args.config:
+        n_channels = CONFIGS[name]
+        torch.manual_seed(0)
+        model = build(n_channels, grid, args.embed_dim, args.depth, args.device)
+        x = torch.randn(args.batch_size, 1, n_channels, *grid.shape)
+        x = x.to(args.device)
+
+        first, per_step = run(model, x, args.steps)
+        print(f"{name},eager,{first:.3f},{per_step:.4f}")
+
+        model.enable_compile(cuda_graphs=args.cuda_graphs)
+        first, per_step = run(model, x, args.steps)
+        print(f"{name},compiled,{first:.3f},{per_step:.4f}")
+
+
+if __name__ == "__main__":
+    main()
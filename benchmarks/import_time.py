@@ -0,0 +1,119 @@
+# SPDX-FileCopyrightText: Copyright (c) 2023 NVIDIA CORPORATION & AFFILIATES.
+# SPDX-FileCopyrightText: All rights reserved.
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Benchmark the import time of the earth2mip entry points
+
+Imports every module in a fresh interpreter with ``python -X importtime`` and
+prints the cumulative import time (the best of ``--repeat`` runs) and the
+optional backends that were imported along the way.
+
+Save a baseline and compare later runs against it::
+
+    python benchmarks/import_time.py --save import_time.json
+    python benchmarks/import_time.py --baseline import_time.json --tolerance 0.2
+
+The comparison exits with status 1 if a module got slower than the baseline by
+more than the tolerance.
+"""
+import argparse
+import json
+import subprocess
+import sys
+
+MODULES = [
+    "earth2mip",
+    "earth2mip.initial_conditions",
+    "earth2mip.networks",
+    "earth2mip.inference_ensemble",
+    "earth2mip.inference_medium_range",
+    "earth2mip.time_collection",
+]
+
+# backends which should only be imported when they are used
+OPTIONAL = [
+    "cdsapi",
+    "cfgrib",
+    "eccodes",
+    "haiku",
+    "jax",
+    "onnxruntime",
+    "torch_harmonics",
+]
+
+
+def import_time(module):
+    """Return the cumulative import time in seconds of ``module`` and the
+    optional backends it imports"""
+    code = (
+        f"import sys, {module}; "
+        f"print(','.join(m for m in {OPTIONAL!r} if m in sys.modules))"
+    )
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],  # noqa: S603
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    # lines look like "import time: self [us] | cumulative | imported package"
+    for line in proc.stderr.splitlines():
+        fields = line.split("|")
+        if len(fields) == 3 and fields[2].strip() == module:
+            seconds = int(fields[1]) / 1e6
+    backends = [m for m in proc.stdout.strip().split(",") if m]
+    return seconds, backends
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("modules", nargs="*", default=MODULES)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--save", help="write the results as json to this path")
+    parser.add_argument("--baseline", help="compare with the results at this path")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    results = {}
+    print("module,seconds,optional_backends")
+    for module in args.modules:
+        runs = [import_time(module) for _ in range(args.repeat)]
+        seconds = min(seconds for seconds, _ in runs)
+        backends = runs[0][1]
+        results[module] = seconds
+        print(f"{module},{seconds:.3f},{' '.join(backends)}")
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = [
+            module
+            for module, seconds in results.items()
+            if module in baseline and seconds > baseline[module] * (1 + args.tolerance)
+        ]
+        for module in regressions:
+            print(
+                f"{module} got slower: {results[module]:.3f}s, "
+                f"baseline {baseline[module]:.3f}s",
+                file=sys.stderr,
+            )
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -49,6 +49,10 @@ class Settings(BaseSettings):
     MODEL_REGISTRY: str = Field(default_factory=_default_model_registry)
     LOCAL_CACHE: str = Field(default_factory=_default_local_cache)
 
+    # memory budget in bytes of the models cached by networks.get_model. 0
+    # disables the cache.
+    MODEL_CACHE_BYTES: int = 0
+
     # used for scoring (score-ifs.py, inference-medium-range)
     TIME_MEAN: str = ""
 
@@ -0,0 +1,214 @@
+# SPDX-FileCopyrightText: Copyright (c) 2023 NVIDIA CORPORATION & AFFILIATES.
+# SPDX-FileCopyrightText: All rights reserved.
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Choose the ensemble batch size from a memory probe
+
+The probe runs one step of a :class:`earth2mip.time_loop.TimeLoop` at growing
+batch sizes (1, 2, 4, ...) and measures the peak memory and the throughput of
+each step. On CUDA devices the peak memory is taken from the allocator
+statistics. On the CPU it is the peak resident set size of the process, which
+also covers the tensors allocated by torch (``tracemalloc`` only sees Python
+allocations).
+
+Before trying the next batch size the peak memory is extrapolated linearly from
+the last measurement, so the probe stops before a batch size that would not fit.
+"""
+import dataclasses
+import datetime
+import logging
+import os
+import resource
+import sys
+import time
+from typing import List
+
+import torch
+
+from earth2mip.time_loop import TimeLoop
+
+__all__ = ["BatchSizeProbe", "Measurement", "probe_batch_size"]
+
+logger = logging.getLogger(__name__)
+
+
+@dataclasses.dataclass
+class Measurement:
+    """The memory and throughput of one step at ``batch_size``
+
+    Memory is in bytes. ``baseline`` is the memory in use before the step.
+    """
+
+    batch_size: int
+    baseline: int
+    peak: int
+    seconds: float
+
+    @property
+    def members_per_second(self) -> float:
+        return self.batch_size / self.seconds if self.seconds > 0 else float("inf")
+
+
+@dataclasses.dataclass
+class BatchSizeProbe:
+    """The result of :func:`probe_batch_size`
+
+    Attributes:
+        batch_size: the largest batch size whose peak memory fits into ``limit``
+        limit: the memory available to the run in bytes, after the headroom
+        device: the device type the measurements were taken on
+        measurements: one entry for every batch size that was tried
+    """
+
+    batch_size: int
+    limit: int
+    device: str
+    measurements: List[Measurement]
+
+    def to_dict(self) -> dict:
+        return {
+            "batch_size": self.batch_size,
+            "limit": self.limit,
+            "device": self.device,
+            "measurements": [dataclasses.asdict(m) for m in self.measurements],
+        }
+
+
+def _total_memory(device: torch.device) -> int:
+    if device.type == "cuda":
+        return torch.cuda.get_device_properties(device).total_memory
+    return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+
+
+def _current_memory(device: torch.device) -> int:
+    if device.type == "cuda":
+        return torch.cuda.memory_allocated(device)
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return _peak_memory(device)
+
+
+def _peak_memory(device: torch.device) -> int:
+    if device.type == "cuda":
+        return torch.cuda.max_memory_allocated(device)
+    # ru_maxrss can not be reset, but the probe only grows the batch, so the
+    # peak of the process is the peak of the largest batch tried so far
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+
+def _measure(
+    model: TimeLoop, initial_time: datetime.datetime, x: torch.Tensor
+) -> Measurement:
+    device = x.device
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+        torch.cuda.reset_peak_memory_stats(device)
+    baseline = _current_memory(device)
+
+    start = time.perf_counter()
+    iterator = model(initial_time, x)
+    try:
+        # the first item is the initial condition, the second one the step
+        next(iterator)
+        next(iterator)
+    finally:
+        iterator.close()
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+    seconds = time.perf_counter() - start
+
+    return Measurement(
+        batch_size=x.shape[0],
+        baseline=baseline,
+        peak=max(_peak_memory(device), baseline),
+        seconds=seconds,
+    )
+
+
+def probe_batch_size(
+    model: TimeLoop,
+    x: torch.Tensor,
+    time: datetime.datetime,
+    max_batch_size: int,
+    headroom: float = 0.2,
+    memory_limit: int = 0,
+) -> BatchSizeProbe:
+    """Find the largest batch size for which one step of ``model`` fits in memory
+
+    Args:
+        model: the time loop to probe
+        x: the initial condition of a single member, shape (1, history,
+            channel, lat, lon)
+        time: the initial time passed to ``model``
+        max_batch_size: the largest batch size to try, typically the number of
+            ensemble members of this rank
+        headroom: the fraction of memory to keep free for the outputs,
+            diagnostics and allocator fragmentation
+        memory_limit: the memory available in bytes. 0 = the total memory of
+            the device.
+
+    Returns:
+        the chosen batch size and the measurements. The batch size is at least
+        1, even if a single member does not fit.
+    """
+    if not 0 <= headroom < 1:
+        raise ValueError(f"headroom must be in [0, 1). Got {headroom}.")
+
+    device = x.device
+    limit = int((memory_limit or _total_memory(device)) * (1 - headroom))
+    measurements: List[Measurement] = []
+    batch_size = 1
+    chosen = 1
+
+    with torch.no_grad():
+        while batch_size <= max_batch_size:
+            if measurements:
+                last = measurements[-1]
+                per_member = max(last.peak - last.baseline, 0) / last.batch_size
+                predicted = last.baseline + per_member * batch_size
+                if predicted > limit:
+                    logger.info(
+                        f"Batch size {batch_size} needs about {predicted:.3g} bytes. "
+                        f"Limit is {limit}."
+                    )
+                    break
+
+            try:
+                m = _measure(model, time, x.repeat(batch_size, 1, 1, 1, 1))
+            except torch.cuda.OutOfMemoryError:
+                torch.cuda.empty_cache()
+                logger.info(f"Batch size {batch_size} ran out of memory.")
+                break
+
+            measurements.append(m)
+            logger.info(
+                f"Batch size {batch_size}: peak memory {m.peak} bytes, "
+                f"{m.members_per_second:.3g} members/s"
+            )
+            if m.peak > limit:
+                break
+            chosen = batch_size
+            if batch_size == max_batch_size:
+                break
+            batch_size = min(2 * batch_size, max_batch_size)
+
+    if device.type == "cuda":
+        torch.cuda.empty_cache()
+
+    return BatchSizeProbe(
+        batch_size=chosen, limit=limit, device=device.type, measurements=measurements
+    )
@@ -0,0 +1,194 @@
+# SPDX-FileCopyrightText: Copyright (c) 2023 NVIDIA CORPORATION & AFFILIATES.
+# SPDX-FileCopyrightText: All rights reserved.
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Memory mapped checkpoint loading
+
+Checkpoints are loaded with ``torch.load(mmap=True)`` onto the CPU, so the
+tensors are read from the file as they are copied into the model instead of
+being loaded into host memory first. Models on the CPU share the memory of the
+mapped file. Older versions of torch (< 2.1), which cannot memory map
+checkpoints, load them into memory.
+
+Training checkpoints often hold the optimizer state and keys with a
+``module.`` prefix. :func:`convert` writes only the state dict of the model,
+with fixed keys, to ``<name>.pt`` next to the checkpoint, which
+:func:`load_package_state_dict` prefers when it exists::
+
+    python -m earth2mip.checkpoint /path/to/fcnv2_sm --key model_state \\
+        --strip-prefix module.
+"""
+import argparse
+import inspect
+import logging
+import os
+from typing import Callable, Dict, Optional
+
+import torch
+
+from earth2mip.model_registry import Package
+
+__all__ = [
+    "convert",
+    "converted_name",
+    "load_module",
+    "load_package_state_dict",
+    "load_state_dict",
+    "rename_keys",
+]
+
+logger = logging.getLogger(__name__)
+
+StateDict = Dict[str, torch.Tensor]
+
+# added in torch 2.1
+_HAS_MMAP = "mmap" in inspect.signature(torch.load).parameters
+_HAS_ASSIGN = "assign" in inspect.signature(torch.nn.Module.load_state_dict).parameters
+
+
+def converted_name(filename: str) -> str:
+    """The name of the converted checkpoint of ``filename``"""
+    return os.path.splitext(filename)[0] + ".pt"
+
+
+def rename_keys(state_dict: StateDict, rename: Callable[[str], str]) -> StateDict:
+    """Rename the keys of ``state_dict`` in place
+
+    The tensors are moved to their new keys, not copied.
+    """
+    for key in list(state_dict):
+        new_key = rename(key)
+        if new_key != key:
+            state_dict[new_key] = state_dict.pop(key)
+    return state_dict
+
+
+def _strip(prefix: str) -> Callable[[str], str]:
+    return lambda key: key[len(prefix) :] if key.startswith(prefix) else key
+
+
+def load_state_dict(
+    path: str, key: Optional[str] = None, strip_prefix: Optional[str] = None
+) -> StateDict:
+    """Load a state dict memory mapped onto the CPU
+
+    Checkpoints in the legacy (non zip) format, or with torch < 2.1, are
+    loaded into memory.
+
+    Args:
+        path: the checkpoint
+        key: the item of the checkpoint holding the state dict, e.g.
+            "model_state". By default the checkpoint is the state dict.
+        strip_prefix: remove this prefix, e.g. "module.", from the keys
+    """
+    checkpoint = None
+    if _HAS_MMAP:
+        try:
+            checkpoint = torch.load(path, map_location="cpu", mmap=True)
+        except RuntimeError:
+            logger.warning(f"{path} cannot be memory mapped. Loading it into memory.")
+    if checkpoint is None:
+        checkpoint = torch.load(path, map_location="cpu")
+
+    state_dict = checkpoint if key is None else checkpoint[key]
+    if strip_prefix:
+        rename_keys(state_dict, _strip(strip_prefix))
+    return state_dict
+
+
+def load_package_state_dict(
+    package: Package,
+    filename: str,
+    key: Optional[str] = None,
+    strip_prefix: Optional[str] = None,
+) -> StateDict:
+    """Load the checkpoint ``filename`` of ``package``
+
+    The converted checkpoint (see :func:`convert`) is used if the package has
+    one. ``key`` and ``strip_prefix`` only apply to the original checkpoint.
+    """
+    try:
+        path = package.get(converted_name(filename))
+    except OSError:
+        path = None
+
+    if path is not None and os.path.exists(path):
+        return load_state_dict(path)
+    return load_state_dict(package.get(filename), key, strip_prefix)
+
+
+def load_module(module: torch.nn.Module, state_dict: StateDict):
+    """Load ``state_dict`` into ``module``
+
+    The tensors of a module on the CPU are replaced by the loaded ones, so they
+    share the memory of a memory mapped checkpoint. Otherwise, or with torch <
+    2.1, the tensors are copied to the device of the module.
+    """
+    on_cpu = all(t.device.type == "cpu" for t in module.state_dict().values())
+    if on_cpu and _HAS_ASSIGN:
+        module.load_state_dict(state_dict, assign=True)
+    else:
+        module.load_state_dict(state_dict)
+    return module
+
+
+def convert(
+    path: str,
+    out: Optional[str] = None,
+    key: Optional[str] = None,
+    strip_prefix: Optional[str] = None,
+) -> str:
+    """Save the model state dict of the checkpoint ``path`` for fast loading
+
+    Args:
+        path: the checkpoint
+        out: the output path. Defaults to ``converted_name(path)``.
+        key: the item of the checkpoint holding the state dict
+        strip_prefix: remove this prefix from the keys
+
+    Returns:
+        the output path
+    """
+    out = out or converted_name(path)
+    if os.path.abspath(out) == os.path.abspath(path):
+        raise ValueError(f"Cannot convert {path} in place.")
+    state_dict = load_state_dict(path, key, strip_prefix)
+    state_dict = {k: v.contiguous() for k, v in state_dict.items()}
+    tmp = out + ".tmp"
+    torch.save(state_dict, tmp)
+    os.replace(tmp, out)
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("path", help="a checkpoint or a local package directory")
+    parser.add_argument(
+        "--file",
+        default="weights.tar",
+        help="the checkpoint to convert if path is a package",
+    )
+    parser.add_argument("--key", help="the item of the checkpoint to convert")
+    parser.add_argument("--strip-prefix", help="remove this prefix from the keys")
+    args = parser.parse_args()
+
+    path = args.path
+    if os.path.isdir(path):
+        path = os.path.join(path, args.file)
+    out = convert(path, key=args.key, strip_prefix=args.strip_prefix)
+    print(out)
+
+
+if __name__ == "__main__":
+    main()
@@ -21,7 +21,7 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as F
 
-from earth2mip import config, grid
+from earth2mip import checkpoint, config, grid
 from earth2mip.diagnostic.base import DiagnosticBase
 from earth2mip.model_registry import ModelRegistry, Package
 
@@ -552,8 +552,8 @@ class ClimateNet(DiagnosticBase):
             channels=len(IN_CHANNELS),
             classes=len(OUT_CHANNELS),
         )
-        weights_path = package.get("weights.tar")
-        model.load_state_dict(torch.load(weights_path, map_location=device))
+        weights = checkpoint.load_package_state_dict(package, "weights.tar")
+        checkpoint.load_module(model, weights)
         model.eval()
 
         input_center = torch.Tensor(np.load(package.get("global_means.npy")))[
@@ -13,36 +13,142 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import concurrent.futures
+import dataclasses
 import datetime
-from typing import Any, Iterator, List, Optional, Tuple
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 
 import torch
 
+from earth2mip import grid, regrid, time_loop
 from earth2mip.diagnostic.base import DiagnosticBase
-from earth2mip.diagnostic.utils import filter_channels
+from earth2mip.diagnostic.utils import (
+    ChannelIndex,
+    get_channel_index,
+    select_channels,
+)
 from earth2mip.time_loop import TimeLoop
 
 
+@dataclasses.dataclass
+class _Stage:
+    """A diagnostic with the channel index and the regridders of its input and
+    output"""
+
+    function: DiagnosticBase
+    index: ChannelIndex
+    input_regridder: torch.nn.Module
+    output_regridder: torch.nn.Module
+
+    def to(self, device: torch.device) -> "_Stage":
+        index = self.index
+        if isinstance(index, torch.Tensor):
+            index = index.to(device)
+        return _Stage(
+            self.function,
+            index,
+            self.input_regridder.to(device),
+            self.output_regridder.to(device),
+        )
+
+    def __call__(self, data: torch.Tensor) -> torch.Tensor:
+        x = self.input_regridder(select_channels(data, self.index))
+        return self.output_regridder(self.function(x))
+
+
+class _RegridderCache:
+    """One regridder per pair of grids"""
+
+    def __init__(self):
+        self._regridders = []
+
+    def get(self, src: grid.LatLonGrid, dest: grid.LatLonGrid) -> torch.nn.Module:
+        # grids hold lists, so they can not be dictionary keys
+        for cached_src, cached_dest, regridder in self._regridders:
+            if cached_src == src and cached_dest == dest:
+                return regridder
+        regridder = regrid.get_regridder(src, dest)
+        self._regridders.append((src, dest, regridder))
+        return regridder
+
+
 class DiagnosticTimeLoop(TimeLoop):
     """Diagnostic Timeloop. This is an iterator that executes a list of diagnostic
      models on top of a model Timeloop.
 
     Note:
-        Presently, grids must be consistent between diagnostics and the model
+        The grids of the model and the diagnostics can differ. The input of each
+        diagnostic is regridded from the model grid to its ``in_grid``, and its
+        output from its ``out_grid`` to ``grid``. The regridders are built once
+        per pair of grids.
 
     Args:
         diagnostics (List[DiagnosticBase]): List of diagnostic functions to execute
         model (TimeLoop): Model inferencer iterator
         concat (bool, optional): Concatentate diagnostic outputs with model outputs.
         Defaults to True.
+        output_frequency (int, optional): Only run the diagnostics every
+        ``output_frequency`` steps. The output of the other steps is None.
+        Defaults to 1.
+        concurrent (bool, optional): Run the diagnostics concurrently, on one CUDA
+        stream per diagnostic or, on the CPU, one thread per diagnostic. The
+        threads are stopped when the iterator is closed. Defaults to False.
+        output_grid (LatLonGrid, optional): The grid of the outputs. Defaults to
+        the model grid if ``concat``, else the output grid of the first
+        diagnostic.
     """
 
     def __init__(
-        self, diagnostics: List[DiagnosticBase], model: TimeLoop, concat: bool = True
+        self,
+        diagnostics: List[DiagnosticBase],
+        model: TimeLoop,
+        concat: bool = True,
+        output_frequency: int = 1,
+        concurrent: bool = False,
+        output_grid: Optional[grid.LatLonGrid] = None,
     ):
+        if output_frequency < 1:
+            raise ValueError(
+                f"output_frequency must be at least 1. Got {output_frequency}."
+            )
         self.model = model
         self.diagnostics = diagnostics
         self.concat = concat
+        self.output_frequency = output_frequency
+        self.concurrent = concurrent and len(diagnostics) > 1
+        if output_grid is None:
+            output_grid = model.grid if concat else diagnostics[0].out_grid
+        self._grid = output_grid
+
+        regridders = _RegridderCache()
+        self._stages = [
+            _Stage(
+                function,
+                get_channel_index(model.out_channel_names, function.in_channel_names),
+                regridders.get(model.grid, function.in_grid),
+                regridders.get(function.out_grid, output_grid),
+            )
+            for function in diagnostics
+        ]
+        self._model_regridder = regridders.get(model.grid, output_grid)
+        self._device_stages: Dict[torch.device, List[_Stage]] = {}
+        self._streams: Dict[torch.device, List[torch.cuda.Stream]] = {}
+
+    def with_output_frequency(self, output_frequency: int) -> "DiagnosticTimeLoop":
+        """A copy of this loop running the diagnostics every ``output_frequency``
+        steps
+
+        The model is hinted with the same frequency, see
+        :func:`earth2mip.time_loop.with_output_frequency`.
+        """
+        return DiagnosticTimeLoop(
+            self.diagnostics,
+            time_loop.with_output_frequency(self.model, output_frequency),
+            concat=self.concat,
+            output_frequency=output_frequency,
+            concurrent=self.concurrent,
+            output_grid=self.grid,
+        )
 
     @property
     def in_channel_names(self):
@@ -60,13 +166,64 @@ class DiagnosticTimeLoop(TimeLoop):
 
     @property
     def grid(self):
-        # TODO: Need to generalize
-        return self.diagnostics[0].out_grid
+        return self._grid
 
     @property
     def device(self):
         return self.model.device
 
+    def _get_stages(self, device: torch.device) -> List[_Stage]:
+        if device not in self._device_stages:
+            self._device_stages[device] = [stage.to(device) for stage in self._stages]
+            self._model_regridder.to(device)
+        return self._device_stages[device]
+
+    def _run_sequential(self, data: torch.Tensor) -> List[torch.Tensor]:
+        return [stage(data) for stage in self._get_stages(data.device)]
+
+    def _run_streams(self, data: torch.Tensor) -> List[torch.Tensor]:
+        device = data.device
+        if device not in self._streams:
+            self._streams[device] = [
+                torch.cuda.Stream(device) for _ in self.diagnostics
+            ]
+        current = torch.cuda.current_stream(device)
+        out = []
+        for stage, stream in zip(self._get_stages(device), self._streams[device]):
+            stream.wait_stream(current)
+            with torch.cuda.stream(stream):
+                # keep the allocator from reusing ``data`` while the stream reads it
+                data.record_stream(stream)
+                y = stage(data)
+            y.record_stream(current)
+            out.append(y)
+        for stream in self._streams[device]:
+            current.wait_stream(stream)
+        return out
+
+    def _run_threads(
+        self, data: torch.Tensor, pool: concurrent.futures.Executor
+    ) -> List[torch.Tensor]:
+        # the grad mode is thread local
+        grad_enabled = torch.is_grad_enabled()
+
+        def run(stage):
+            with torch.set_grad_enabled(grad_enabled):
+                return stage(data)
+
+        futures = [pool.submit(run, stage) for stage in self._get_stages(data.device)]
+        return [future.result() for future in futures]
+
+    def _run_diagnostics(
+        self, data: torch.Tensor, pool: Optional[concurrent.futures.Executor]
+    ) -> List[torch.Tensor]:
+        if pool is None:
+            return self._run_sequential(data)
+        elif data.device.type == "cuda":
+            return self._run_streams(data)
+        else:
+            return self._run_threads(data, pool)
+
     def __call__(
         self,
         time: datetime.datetime,
@@ -85,20 +242,37 @@ class DiagnosticTimeLoop(TimeLoop):
         Yields:
             (time, output, restart) tuples. ``output`` is a tensor with
                 shape (B, len(out_channel_names), Y, X) which will be used for
-                diagnostics. Restart data should encode the state of the time
-                loop.
+                diagnostics, or None on steps that are not a multiple of
+                ``output_frequency``. Restart data should encode the state of
+                the time loop.
         """
+        # the step count is part of the restart, so that resumed loops keep
+        # running the diagnostics on the same steps
+        step = 0
+        if restart is not None:
+            step = restart["step"]
+            restart = restart["model"]
+
+        # one pool per iterator, whose threads only start on the CPU
+        pool = None
+        if self.concurrent:
+            pool = concurrent.futures.ThreadPoolExecutor(len(self.diagnostics))
+
         iterator = self.model(time, x, restart=restart)
-        for (time, data, restart) in iterator:
-            out = []
-            for function in self.diagnostics:
-                data0 = filter_channels(
-                    data, self.model.out_channel_names, function.in_channel_names
-                )
-                out.append(function(data0))
-
-            out = torch.cat(out, axis=1)
-            if self.concat:
-                out = torch.cat([data, out], axis=1)
-
-            yield time, out, restart
+        try:
+            for k, (time, data, restart) in enumerate(iterator, start=step):
+                if restart is not None:
+                    restart = dict(model=restart, step=k)
+
+                if k % self.output_frequency != 0:
+                    yield time, None, restart
+                    continue
+
+                out = torch.cat(self._run_diagnostics(data, pool), axis=1)
+                if self.concat:
+                    out = torch.cat([self._model_regridder(data), out], axis=1)
+
+                yield time, out, restart
+        finally:
+            if pool is not None:
+                pool.shutdown()
@@ -13,23 +13,23 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+from typing import List, Union
+
 import torch
 
+ChannelIndex = Union[slice, torch.Tensor]
 
-def filter_channels(
-    input: torch.Tensor, in_channels: list[str], out_channels: list[str]
-) -> torch.Tensor:
-    """Utility function used for selecting a sub set of channels
 
-    Note:
-        Right now this assumes that the channels are in the thirds to last axis.
+def get_channel_index(in_channels: List[str], out_channels: List[str]) -> ChannelIndex:
+    """The index of ``out_channels`` in ``in_channels``
+
+    Contiguous channels are selected with a slice, which returns a view rather
+    than a copy.
 
     Args:
-        input (torch.Tensor): Input tensor of shape [..., channels, lat, lon]
         in_channels (list[str]): Input channel list
         out_channels (list[str]): Output channel list
     """
-    indexes_list = []
     try:
         indexes_list = [in_channels.index(channel) for channel in out_channels]
     except ValueError as e:
@@ -37,5 +37,36 @@ def filter_channels(
             "Looks like theres a mismatch between input and "
             + f"requested channels. {e}"
         )
-    indexes = torch.IntTensor(indexes_list).to(input.device)
-    return torch.index_select(input, -3, indexes)
+    start = indexes_list[0] if indexes_list else 0
+    if indexes_list == list(range(start, start + len(indexes_list))):
+        return slice(start, start + len(indexes_list))
+    return torch.tensor(indexes_list)
+
+
+def select_channels(input: torch.Tensor, index: ChannelIndex) -> torch.Tensor:
+    """Select the channels ``index`` from the third to last axis of ``input``
+
+    A tensor ``index`` should already be on the device of ``input``.
+    """
+    if isinstance(index, slice):
+        return input[..., index, :, :]
+    return torch.index_select(input, -3, index)
+
+
+def filter_channels(
+    input: torch.Tensor, in_channels: list[str], out_channels: list[str]
+) -> torch.Tensor:
+    """Utility function used for selecting a sub set of channels
+
+    Note:
+        Right now this assumes that the channels are in the thirds to last axis.
+
+    Args:
+        input (torch.Tensor): Input tensor of shape [..., channels, lat, lon]
+        in_channels (list[str]): Input channel list
+        out_channels (list[str]): Output channel list
+    """
+    index = get_channel_index(in_channels, out_channels)
+    if isinstance(index, torch.Tensor):
+        index = index.to(input.device)
+    return select_channels(input, index)
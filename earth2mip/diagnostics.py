@@ -14,7 +14,23 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from typing import Union
+"""Diagnostics written for each domain of a weather event
+
+``raw`` writes every ensemble member. The other types keep running statistics
+on the model device across all ensemble batches and only write the reduced
+fields at the end of the run:
+
+- ``mean`` and ``variance``: Welford's algorithm, merged across batches with
+  the parallel update of Chan et al. The variance is unbiased (ddof=1).
+- ``histogram``: member counts in ``nbins`` fixed bins for every grid point.
+- ``quantile``: the ``quantiles`` interpolated linearly from a histogram with
+  ``nbins`` bins. Their accuracy is the bin width, so use enough bins.
+
+The statistics cost one ``(channel, *domain)`` buffer per output time for
+``mean`` and ``variance`` and ``nbins`` of them for ``histogram`` and
+``quantile``.
+"""
+from typing import Any, Dict, Tuple, Union
 
 import numpy as np
 import torch
@@ -26,6 +42,18 @@ from earth2mip.weather_events import CWBDomain, MultiPoint, Window
 
 
 class Diagnostics:
+    """
+    Args:
+        process_group: for reducing diagnostics, the ranks whose members are
+            combined into one set of statistics, e.g. when all ranks write to
+            one output store. Only rank 0 of the group writes them. If None,
+            each rank writes the statistics of its own members.
+    """
+
+    #: if True, ``update`` receives the outputs on the model device, on the main
+    #: thread, and the statistics are written by ``reduce`` and ``finalize``
+    reduces_ensemble: bool = False
+
     def __init__(
         self,
         group: Group,
@@ -35,6 +63,7 @@ class Diagnostics:
         lat: np.ndarray,
         lon: np.ndarray,
         device: torch.device,
+        process_group: Any = None,
     ):
         self.group, self.domain, self.grid, self.lat, self.lon = (
             group,
@@ -45,6 +74,7 @@ class Diagnostics:
         )
         self.diagnostic = diagnostic
         self.device = device
+        self.process_group = process_group
 
         self._init_subgroup()
         self._init_dimensions()
@@ -72,12 +102,12 @@ class Diagnostics:
         dims = self.get_dimensions()
         dtypes = self.get_dtype()
         for channel in self.diagnostic.channels:
-            if self.diagnostic.type == "histogram":
-                pass
-            else:
-                self.subgroup.createVariable(
-                    channel, dtypes[self.diagnostic.type], dims[self.diagnostic.type]
-                )
+            if channel in self.subgroup.variables:
+                # appending to an existing output
+                continue
+            self.subgroup.createVariable(
+                channel, dtypes[self.diagnostic.type], dims[self.diagnostic.type]
+            )
 
     def get_dimensions(
         self,
@@ -99,6 +129,24 @@ class Diagnostics:
     ):
         raise NotImplementedError
 
+    def state_dict(self) -> dict:
+        """The running statistics, saved with the checkpoints"""
+        return {}
+
+    def load_state_dict(self, state: dict):
+        pass
+
+    def reduce(self):
+        """Combine the statistics of ``process_group``
+
+        Called on the main thread after the last ensemble batch.
+        """
+        pass
+
+    def finalize(self):
+        """Write the statistics combined by ``reduce``"""
+        pass
+
 
 class Raw(Diagnostics):
     def __init__(
@@ -110,10 +158,21 @@ class Raw(Diagnostics):
         lat: np.ndarray,
         lon: np.ndarray,
         device: torch.device,
+        process_group: Any = None,
     ):
-        super().__init__(group, domain, grid, diagnostic, lat, lon, device)
+        super().__init__(
+            group, domain, grid, diagnostic, lat, lon, device, process_group
+        )
+
+    @property
+    def _station_major(self) -> bool:
+        # the time series of a station are read far more often than the
+        # stations of a time step
+        return self.domain.type == "MultiPoint"
 
     def get_dimensions(self):
+        if self._station_major:
+            return {"raw": self.domain_dims + ("ensemble", "time")}
         return {"raw": ("ensemble", "time") + self.domain_dims}
 
     def get_dtype(self):
@@ -122,12 +181,298 @@ class Raw(Diagnostics):
     def update(
         self, output: torch.Tensor, time_index: int, batch_id: int, batch_size: int
     ):
+        members = slice(batch_id, batch_id + batch_size)
         for c, channel in enumerate(self.diagnostic.channels):
-            self.subgroup[channel][batch_id : batch_id + batch_size, time_index] = (
-                output[:, c].cpu().numpy()
+            value = output[:, c].cpu().numpy()
+            if self._station_major:
+                self.subgroup[channel][:, members, time_index] = value.T
+            else:
+                self.subgroup[channel][members, time_index] = value
+
+
+def _all_reduce(x: torch.Tensor, process_group, op=None) -> torch.Tensor:
+    op = torch.distributed.ReduceOp.SUM if op is None else op
+    torch.distributed.all_reduce(x, op, group=process_group)
+    return x
+
+
+def _is_writer(process_group) -> bool:
+    return process_group is None or torch.distributed.get_rank(process_group) == 0
+
+
+def _merge_moments(n_a, mean_a, m2_a, n_b, mean_b, m2_b):
+    """Combine the count, mean and sum of squared deviations of two samples
+
+    This is the parallel form of Welford's algorithm by Chan et al.
+    """
+    n = n_a + n_b
+    delta = mean_b - mean_a
+    mean = mean_a + delta * (n_b / n)
+    m2 = m2_a + m2_b + delta.square() * (n_a * n_b / n)
+    return n, mean, m2
+
+
+class _Moments(Diagnostics):
+    reduces_ensemble = True
+
+    def __init__(self, *args, **kwargs):
+        # output time index -> (count, mean, sum of squared deviations)
+        self._stats: Dict[int, Tuple[int, torch.Tensor, torch.Tensor]] = {}
+        self._reduced: Dict[int, np.ndarray] = {}
+        super().__init__(*args, **kwargs)
+
+    def get_dimensions(self):
+        return {self.diagnostic.type: ("time",) + self.domain_dims}
+
+    def get_dtype(self):
+        return {self.diagnostic.type: np.float32}
+
+    def update(
+        self, output: torch.Tensor, time_index: int, batch_id: int, batch_size: int
+    ):
+        output = output.float()
+        n = output.shape[0]
+        mean = output.mean(dim=0)
+        m2 = (output - mean).square().sum(dim=0)
+        if time_index in self._stats:
+            n, mean, m2 = _merge_moments(*self._stats[time_index], n, mean, m2)
+        self._stats[time_index] = (n, mean, m2)
+
+    def state_dict(self) -> dict:
+        return {"stats": dict(self._stats)}
+
+    def load_state_dict(self, state: dict):
+        self._stats = {
+            time_index: (n, mean.to(self.device), m2.to(self.device))
+            for time_index, (n, mean, m2) in state["stats"].items()
+        }
+
+    def _statistic(self, n, mean: torch.Tensor, m2: torch.Tensor) -> torch.Tensor:
+        raise NotImplementedError
+
+    def reduce(self):
+        self._reduced = {}
+        for time_index in sorted(self._stats):
+            n, mean, m2 = self._stats[time_index]
+            if self.process_group is not None:
+                count = torch.tensor(float(n), device=mean.device)
+                count = _all_reduce(count, self.process_group)
+                total_mean = _all_reduce(mean * n, self.process_group) / count
+                m2 = m2 + (mean - total_mean).square() * n
+                m2 = _all_reduce(m2, self.process_group)
+                n, mean = count.item(), total_mean
+            self._reduced[time_index] = self._statistic(n, mean, m2).cpu().numpy()
+
+        if not _is_writer(self.process_group):
+            self._reduced = {}
+
+    def finalize(self):
+        for time_index, value in self._reduced.items():
+            for c, channel in enumerate(self.diagnostic.channels):
+                self.subgroup[channel][time_index] = value[c]
+
+
+class Mean(_Moments):
+    def _statistic(self, n, mean, m2):
+        return mean
+
+
+class Variance(_Moments):
+    def _statistic(self, n, mean, m2):
+        if n < 2:
+            return torch.full_like(m2, float("nan"))
+        return m2 / (n - 1)
+
+
+class _Binned(Diagnostics):
+    """Counts the members in ``nbins`` fixed bins at every grid point
+
+    Without a ``bin_range`` the bins of every output time are fixed by the
+    first batch of that time, since the spread of the ensemble grows with the
+    lead time.
+    """
+
+    reduces_ensemble = True
+
+    def __init__(self, *args, **kwargs):
+        # output time index -> counts of shape (channel, bin, *domain)
+        self._counts: Dict[int, torch.Tensor] = {}
+        # output time index -> edges of shape (channel, bin + 1)
+        self._edges: Dict[int, torch.Tensor] = {}
+        self._reduced: Dict[int, np.ndarray] = {}
+        super().__init__(*args, **kwargs)
+
+    def _init_edges(self, output: torch.Tensor) -> torch.Tensor:
+        nchannel = output.shape[1]
+        if self.diagnostic.bin_range is not None:
+            lo, hi = self.diagnostic.bin_range
+            lo = torch.full((nchannel,), lo, device=output.device)
+            hi = torch.full((nchannel,), hi, device=output.device)
+        else:
+            flat = output.transpose(0, 1).reshape(nchannel, -1)
+            finite = torch.isfinite(flat)
+            lo = torch.where(finite, flat, float("inf")).amin(dim=1)
+            hi = torch.where(finite, flat, float("-inf")).amax(dim=1)
+            if self.process_group is not None:
+                # all ranks must count into the same bins
+                lo = _all_reduce(lo, self.process_group, torch.distributed.ReduceOp.MIN)
+                hi = _all_reduce(hi, self.process_group, torch.distributed.ReduceOp.MAX)
+            span = torch.where(hi > lo, hi - lo, torch.ones_like(lo))
+            lo, hi = lo - span / 2, hi + span / 2
+
+        steps = torch.linspace(0, 1, self.diagnostic.nbins + 1, device=output.device)
+        return lo[:, None] + (hi - lo)[:, None] * steps
+
+    def update(
+        self, output: torch.Tensor, time_index: int, batch_id: int, batch_size: int
+    ):
+        output = output.float()
+        edges = self._edges.get(time_index)
+        if edges is None:
+            edges = self._edges[time_index] = self._init_edges(output)
+
+        nbins = self.diagnostic.nbins
+        shape = (-1,) + (1,) * (output.ndim - 2)
+        lo = edges[:, 0].view(shape)
+        hi = edges[:, -1].view(shape)
+        scaled = (output - lo) / (hi - lo) * nbins
+        valid = ~torch.isnan(scaled)
+        index = scaled.nan_to_num(0).floor().clamp(0, nbins - 1).long()
+
+        counts = self._counts.get(time_index)
+        if counts is None:
+            counts = torch.zeros(
+                (output.shape[1], nbins) + output.shape[2:],
+                dtype=torch.int32,
+                device=output.device,
             )
+            self._counts[time_index] = counts
+        counts.scatter_add_(
+            1, index.transpose(0, 1), valid.transpose(0, 1).to(torch.int32)
+        )
+
+    def state_dict(self) -> dict:
+        return {"counts": dict(self._counts), "edges": dict(self._edges)}
+
+    def load_state_dict(self, state: dict):
+        self._counts = {k: v.to(self.device) for k, v in state["counts"].items()}
+        self._edges = {k: v.to(self.device) for k, v in state["edges"].items()}
+
+    def _statistic(self, counts: torch.Tensor, edges: torch.Tensor) -> torch.Tensor:
+        raise NotImplementedError
+
+    def reduce(self):
+        self._reduced = {}
+        for time_index in sorted(self._counts):
+            counts = self._counts[time_index]
+            if self.process_group is not None:
+                counts = _all_reduce(counts.clone(), self.process_group)
+            statistic = self._statistic(counts, self._edges[time_index])
+            self._reduced[time_index] = statistic.cpu().numpy()
+
+        if not _is_writer(self.process_group):
+            self._reduced = {}
+
+    def finalize(self):
+        for time_index, value in self._reduced.items():
+            for c, channel in enumerate(self.diagnostic.channels):
+                self.subgroup[channel][time_index] = value[c]
+
+
+class Histogram(_Binned):
+    """Writes the counts and a ``{channel}_bin_edges`` variable per channel"""
+
+    def _init_dimensions(self):
+        super()._init_dimensions()
+        if "bin" not in self.subgroup.dimensions:
+            self.subgroup.createDimension("bin", self.diagnostic.nbins)
+            self.subgroup.createDimension("bin_edge", self.diagnostic.nbins + 1)
+
+    def _init_variables(self):
+        super()._init_variables()
+        for channel in self.diagnostic.channels:
+            name = f"{channel}_bin_edges"
+            if name not in self.subgroup.variables:
+                self.subgroup.createVariable(name, np.float32, ("time", "bin_edge"))
+
+    def get_dimensions(self):
+        return {"histogram": ("time", "bin") + self.domain_dims}
+
+    def get_dtype(self):
+        return {"histogram": np.int32}
+
+    def _statistic(self, counts, edges):
+        return counts
+
+    def finalize(self):
+        super().finalize()
+        if not self._reduced:
+            return
+        for time_index, edges in self._edges.items():
+            edges = edges.cpu().numpy()
+            for c, channel in enumerate(self.diagnostic.channels):
+                self.subgroup[f"{channel}_bin_edges"][time_index] = edges[c]
+
+
+def _quantiles_from_counts(
+    counts: torch.Tensor, edges: torch.Tensor, quantiles
+) -> torch.Tensor:
+    """Interpolate quantiles linearly within histogram bins
+
+    Args:
+        counts: (channel, bin, *domain)
+        edges: (channel, bin + 1), evenly spaced
+
+    Returns:
+        (channel, quantile, *domain). NaN where there are no counts.
+    """
+    nbins = counts.shape[1]
+    counts = counts.movedim(1, -1).double()
+    cumulative = counts.cumsum(-1)
+    total = cumulative[..., -1:]
+    q = torch.tensor(quantiles, dtype=counts.dtype, device=counts.device)
+    target = (total * q).contiguous()
+
+    # the first bin whose cumulative count reaches the target
+    k = torch.searchsorted(cumulative.contiguous(), target).clamp(max=nbins - 1)
+    in_bin = counts.gather(-1, k)
+    before = cumulative.gather(-1, k) - in_bin
+    fraction = ((target - before) / in_bin).nan_to_num(0).clamp(0, 1)
+
+    shape = (-1,) + (1,) * (counts.ndim - 1)
+    lo = edges[:, 0].view(shape).to(counts.dtype)
+    width = ((edges[:, -1] - edges[:, 0]) / nbins).view(shape).to(counts.dtype)
+    value = lo + (k + fraction) * width
+    value = torch.where(total > 0, value, float("nan"))
+    return value.movedim(-1, 1).float()
+
+
+class Quantile(_Binned):
+    def _init_dimensions(self):
+        super()._init_dimensions()
+        if "quantile" not in self.subgroup.dimensions:
+            self.subgroup.createDimension("quantile", len(self.diagnostic.quantiles))
+
+    def _init_variables(self):
+        super()._init_variables()
+        if "quantile" not in self.subgroup.variables:
+            v = self.subgroup.createVariable("quantile", np.float32, ("quantile",))
+            v[:] = np.array(self.diagnostic.quantiles)
+
+    def get_dimensions(self):
+        return {"quantile": ("time", "quantile") + self.domain_dims}
+
+    def get_dtype(self):
+        return {"quantile": np.float32}
+
+    def _statistic(self, counts, edges):
+        return _quantiles_from_counts(counts, edges, self.diagnostic.quantiles)
 
 
 DiagnosticTypes = {
     "raw": Raw,
+    "mean": Mean,
+    "variance": Variance,
+    "histogram": Histogram,
+    "quantile": Quantile,
 }
@@ -14,11 +14,11 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import functools
 from datetime import datetime
-from typing import Union
+from typing import Optional, Union
 
 import torch
-import torch_harmonics as th
 
 from earth2mip.time_loop import TimeLoop
 
@@ -33,6 +33,7 @@ class GaussianRandomFieldS2(torch.nn.Module):
         radius=1.0,
         grid="equiangular",
         dtype=torch.float32,
+        nlon=None,
     ):
         super().__init__()
         """A mean-zero Gaussian Random Field on the sphere with Matern covariance:
@@ -62,26 +63,39 @@ class GaussianRandomFieldS2(torch.nn.Module):
             "legendre-gauss".
         dtype : torch.dtype, default is torch.float32
             Numerical type for the calculations.
+        nlon : int, default is None
+            Number of longitudes of the output grid. If None, nlon = 2*nlat.
         """
 
         # Number of latitudinal modes.
         self.nlat = nlat
+        self.nlon = nlon or 2 * nlat
+        # Number of longitudinal modes, limited by the output grid.
+        self.mmax = min(self.nlat + 1, self.nlon // 2 + 1)
 
         # Default value of sigma if None is given.
         if sigma is None:
             assert alpha > 1.0, f"Alpha must be greater than one, got {alpha}."  # noqa
             sigma = tau ** (0.5 * (2 * alpha - 2.0))
 
-        # Inverse SHT
+        # Inverse SHT. torch_harmonics is imported here since it takes seconds
+        # to import and is only needed for this perturbation
+        import torch_harmonics as th
+
         self.isht = th.InverseRealSHT(
-            self.nlat, 2 * self.nlat, grid=grid, norm="backward"
+            self.nlat,
+            self.nlon,
+            lmax=self.nlat,
+            mmax=self.mmax,
+            grid=grid,
+            norm="backward",
         ).to(dtype=dtype)
 
         # Square root of the eigenvalues of C.
         sqrt_eig = (
             torch.tensor([j * (j + 1) for j in range(self.nlat)])
             .view(self.nlat, 1)
-            .repeat(1, self.nlat + 1)
+            .repeat(1, self.mmax)
         )
         sqrt_eig = torch.tril(
             sigma * (((sqrt_eig / radius**2) + tau**2) ** (-alpha / 2.0))
@@ -108,7 +122,7 @@ class GaussianRandomFieldS2(torch.nn.Module):
         N : int
             Number of functions to sample.
         xi : torch.Tensor, default is None
-            Noise is a complex tensor of size (N, nlat, nlat+1).
+            Noise is a complex tensor of size (N, nlat, mmax).
             If None, new Gaussian noise is sampled.
             If xi is provided, N is ignored.
 
@@ -116,13 +130,13 @@ class GaussianRandomFieldS2(torch.nn.Module):
         -------
         u : torch.Tensor
            N random samples from the GRF returned as a
-           tensor of size (N, nlat, 2*nlat) on a equiangular grid.
+           tensor of size (N, nlat, nlon) on a equiangular grid.
         """
         # Sample Gaussian noise.
         if xi is None:
             xi = self.gaussian_noise.sample(
-                torch.Size((N, self.nlat, self.nlat + 1, 2))
-            ).squeeze()
+                torch.Size((N, self.nlat, self.mmax, 2))
+            ).squeeze(-1)
             xi = torch.view_as_complex(xi)
 
         # Karhunen-Loeve expansion.
@@ -146,41 +160,128 @@ class GaussianRandomFieldS2(torch.nn.Module):
 
 
 def generate_noise_correlated(shape, *, reddening, device, noise_amplitude):
-    return noise_amplitude * brown_noise(shape, reddening).to(device)
+    return noise_amplitude * brown_noise(shape, reddening, device=device)
+
+
+@functools.lru_cache(maxsize=8)
+def _get_grf_sampler(
+    nlat: int,
+    nlon: int,
+    alpha: float,
+    tau: float,
+    sigma: float,
+    dtype: torch.dtype,
+    device: torch.device,
+) -> GaussianRandomFieldS2:
+    # building the inverse SHT is much more expensive than sampling, so
+    # samplers are shared across calls
+    return GaussianRandomFieldS2(
+        nlat=nlat, nlon=nlon, alpha=alpha, tau=tau, sigma=sigma, dtype=dtype
+    ).to(device)
+
+
+def generate_noise_grf(
+    shape,
+    grid,
+    alpha,
+    sigma,
+    tau,
+    device=None,
+    out: Optional[torch.Tensor] = None,
+    max_batch: int = 64,
+):
+    """Sample noise from a spherical Gaussian random field
+
+    The noise is sampled directly on ``grid``, so no padding or regridding is
+    needed.
+
+    Args:
+        shape: the shape of the noise. The last two dimensions must match
+            ``grid.shape``.
+        grid: the lat-lon grid of the model
+        alpha, sigma, tau: parameters of the GRF. See
+            :class:`GaussianRandomFieldS2`.
+        device: the device of the noise. Ignored if ``out`` is given.
+        out: if given, the noise is written into this tensor
+        max_batch: the maximum number of fields sampled at once. Limits the
+            size of the temporary spectral coefficients.
+
+    Returns:
+        the noise tensor (``out`` if given)
+    """
+    if tuple(shape[-2:]) != tuple(grid.shape):
+        raise ValueError(f"shape {shape} does not match grid {grid.shape}.")
+
+    if out is None:
+        out = torch.empty(shape, device=device)
+
+    nlat, nlon = grid.shape
+    sampler = _get_grf_sampler(
+        nlat,
+        nlon,
+        float(alpha),
+        float(tau),
+        float(sigma),
+        out.dtype,
+        out.device,
+    )
+    fields = out.view(-1, nlat, nlon)
+    for start in range(0, fields.shape[0], max_batch):
+        stop = min(start + max_batch, fields.shape[0])
+        fields[start:stop] = sampler(stop - start)
+    return out
 
 
-def generate_noise_grf(shape, grid, alpha, sigma, tau, device=None):
-    sampler = GaussianRandomFieldS2(nlat=720, alpha=alpha, tau=tau, sigma=sigma).to(
-        device
-    )
-    sample_noise = sampler(shape[0] * shape[1] * shape[2]).reshape(
-        shape[0], shape[1], shape[2], 720, 1440
-    )
-    if grid.shape == (721, 1440):
-        noise = torch.zeros(shape).to(device)
-        noise[:, :, :, :-1, :] = sample_noise
-        noise[:, :, :, -1:, :] = noise[:, :, :, -2:-1, :]
-    else:
-        noise = sample_noise
-    return noise
-
-
-def brown_noise(shape, reddening=2):
-    noise = torch.normal(torch.zeros(shape), torch.ones(shape))
-
-    x_white = torch.fft.fft2(noise)
-    S = (
-        torch.abs(torch.fft.fftfreq(noise.shape[-2]).reshape(-1, 1)) ** reddening
-        + torch.abs(torch.fft.fftfreq(noise.shape[-1])) ** reddening
-    )
+@functools.lru_cache(maxsize=8)
+def _brown_noise_filter(
+    nlat: int, nlon: int, reddening: float, dtype: torch.dtype, device: torch.device
+) -> torch.Tensor:
+    """The reddening filter for the half spectrum returned by ``rfft2``"""
+    freq_lat = torch.abs(torch.fft.fftfreq(nlat, dtype=torch.float64)).reshape(-1, 1)
+
+    def _filter(freq_lon):
+        S = freq_lat**reddening + freq_lon**reddening
+        return torch.where(S == 0, 0, 1 / S)
+
+    # normalize over the full spectrum, as if computed with fft2
+    S_full = _filter(torch.abs(torch.fft.fftfreq(nlon, dtype=torch.float64)))
+    S = _filter(torch.fft.rfftfreq(nlon, dtype=torch.float64))
+    S = S / torch.sqrt(torch.mean(S_full**2))
+    return S.to(dtype=dtype, device=device)
+
+
+def brown_noise(shape, reddening=2, device=None, dtype=torch.float32):
+    """White noise reddened in the spectral domain of the last two dimensions
+
+    The noise is sampled on ``device`` and the filter is cached per shape and
+    reddening. Since the filter is symmetric, the real-to-complex FFT gives the
+    same result as a full complex FFT at half the cost.
+    """
+    nlat, nlon = shape[-2:]
+    noise = torch.randn(shape, device=device, dtype=dtype)
+    S = _brown_noise_filter(nlat, nlon, float(reddening), dtype, noise.device)
+    x_shaped = torch.fft.rfft2(noise) * S
+    return torch.fft.irfft2(x_shaped, s=(nlat, nlon))
+
+
+def _step(model: TimeLoop, time: Optional[datetime], x: torch.Tensor) -> torch.Tensor:
+    """Advance ``x`` by a single time step of ``model``"""
+    iterator = model(time, x)
+    try:
+        next(iterator)  # the initial condition
+        _, out, _ = next(iterator)
+    finally:
+        iterator.close()
 
-    S = torch.where(S == 0, 0, 1 / S)
-    S = S / torch.sqrt(torch.mean(S**2))
+    # Unsqueeze if time has been collapsed.
+    if out.ndim != x.ndim:
+        out = out.unsqueeze(1)
+    return out
 
-    x_shaped = x_white * S
-    noise_shaped = torch.fft.ifft2(x_shaped).real
 
-    return noise_shaped
+def _member_norm(x: torch.Tensor) -> torch.Tensor:
+    norm = torch.linalg.vector_norm(x.flatten(1), dim=1)
+    return norm.view(-1, *[1] * (x.ndim - 1))
 
 
 def generate_bred_vector(
@@ -191,6 +292,15 @@ def generate_bred_vector(
     integration_steps: int = 40,
     inflate=False,
 ) -> torch.Tensor:
+    """Generate bred vectors for every member of ``x``
+
+    Each member of ``x`` breeds an independent vector. In every cycle all
+    members are advanced together in a single batched forward pass of
+    ``model``. The control forecast from ``x[:1]`` does not change between
+    cycles, so it is batched with the members of the first cycle and reused.
+    After every cycle the perturbations are rescaled to the norm of the initial
+    perturbations so they stay bounded.
+    """
     # Assume x has shape [ENSEMBLE, TIME, CHANNEL, LAT, LON]
 
     if isinstance(noise_amplitude, float):
@@ -199,34 +309,28 @@ def generate_bred_vector(
     assert (noise_amplitude.shape[0] == x.shape[2]) or (  # noqa
         torch.numel(noise_amplitude) == 1
     )
+    amplitude = noise_amplitude.to(device=x.device, dtype=x.dtype)[:, None, None]
 
     x0 = x[:1]
-
-    # Get control forecast
-    for _, data, _ in model(time, x0):
-        xd = data
-        break
-
-    # Unsqueeze if time has been collapsed.
-    if xd.ndim != x0.ndim:
-        xd = xd.unsqueeze(1)
-
-    dx = noise_amplitude[:, None, None] * torch.randn(
-        x.shape, device=x.device, dtype=x.dtype
-    )
-    for _ in range(integration_steps):
-        x1 = x + dx
-        for _, data, _ in model(time, x1):
-            x2 = data
-            break
-
-        # Unsqueeze if time has been collapsed.
-        if x2.ndim != x1.ndim:
-            x2 = x2.unsqueeze(1)
+    dx = amplitude * torch.randn(x.shape, device=x.device, dtype=x.dtype)
+    initial_norm = _member_norm(dx)
+
+    # Get control forecast batched with the first cycle
+    out = _step(model, time, torch.cat([x0, x + dx]))
+    xd, x2 = out[:1], out[1:]
+
+    # reused by every cycle
+    x1 = torch.empty_like(x)
+    for i in range(integration_steps):
+        if i > 0:
+            torch.add(x, dx, out=x1)
+            x2 = _step(model, time, x1)
         dx = x2 - xd
 
         if inflate:
-            dx += noise_amplitude * (dx - dx.mean(dim=0))
+            dx += amplitude * (dx - dx.mean(dim=0))
+
+        dx *= initial_norm / _member_norm(dx).clamp_min(torch.finfo(dx.dtype).tiny)
 
     gamma = torch.norm(x) / torch.norm(x + dx)
-    return noise_amplitude * dx * gamma
+    return amplitude * dx * gamma
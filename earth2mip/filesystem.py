@@ -23,7 +23,6 @@ from typing import List
 
 import fsspec
 import fsspec.implementations.cached
-import s3fs
 
 logger = logging.getLogger(__name__)
 
@@ -38,6 +37,9 @@ def _cache_fs(fs):
 
 def _get_fs(path):
     if path.startswith("s3://"):
+        # s3fs and its aiohttp/botocore dependencies are slow to import
+        import s3fs
+
         return s3fs.S3FileSystem(client_kwargs=dict(endpoint_url="https://pbss.s8k.io"))
     else:
         return fsspec.filesystem("file")
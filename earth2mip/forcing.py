@@ -0,0 +1,184 @@
+# SPDX-FileCopyrightText: Copyright (c) 2023 NVIDIA CORPORATION & AFFILIATES.
+# SPDX-FileCopyrightText: All rights reserved.
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Solar forcing fields computed on the device
+
+:class:`SolarForcing` computes the cosine of the solar zenith angle and the top
+of atmosphere incident solar radiation (TISR) with the formulas of
+``modulus.utils.zenith_angle``. The position of the sun is a handful of scalars
+per time, which are computed on the host. The fields are computed from them on
+the device of the module, so no field is copied from the host.
+
+Fields are cached by time, since the members of an ensemble, and often the
+history levels of consecutive steps, share their times.
+"""
+import collections
+import math
+from typing import Any, Callable, Tuple
+
+import numpy as np
+import pandas as pd
+import torch
+from modulus.utils import zenith_angle
+
+__all__ = ["SolarForcing"]
+
+
+def _timestamps(time: Any) -> Tuple[Tuple[int, ...], np.ndarray]:
+    """The shape of ``time`` and its seconds since the epoch, as float64
+
+    Times without a time zone are UTC.
+    """
+    array = np.asarray(time)
+    seconds = pd.to_datetime(array.ravel()).asi8 / 1e9
+    return array.shape, seconds
+
+
+def _sun_position(timestamp: float) -> Tuple[float, float, float]:
+    """The right ascension, declination and Greenwich mean sidereal time in
+    radians"""
+    century = zenith_angle._timestamp_to_julian_century(timestamp)
+    right_ascension, declination = zenith_angle._right_ascension_declination(century)
+    sidereal_time = zenith_angle._greenwich_mean_sidereal_time(century)
+    return float(right_ascension), float(declination), float(sidereal_time)
+
+
+def _integrate_cosz(A, B, left, right):
+    return A * (right - left) + B * (torch.sin(right) - torch.sin(left))
+
+
+def _integrate_abs_cosz(A, B, h0, h1):
+    """Integrate max(A + B cos(h), 0) from h=h0 to h1
+
+    A port of ``modulus.utils.zenith_angle._integrate_abs_cosz`` to torch.
+    """
+    # nan where the sun does not rise or set (polar day and night)
+    hc = torch.arccos(-A / B)
+    root1 = 2 * math.pi - hc
+    zero = torch.zeros_like(hc)
+
+    def from_zero_to(a):
+        n = torch.div(a, 2 * math.pi, rounding_mode="floor")
+        a = torch.remainder(a, 2 * math.pi)
+        C = _integrate_cosz(A, B, zero, torch.where(a < hc, a, hc))
+        D = torch.where(root1 < a, _integrate_cosz(A, B, root1, a), 0)
+        total = _integrate_cosz(A, B, zero, hc) + _integrate_cosz(
+            A, B, root1, zero + 2 * math.pi
+        )
+        return C + D + total * n
+
+    return torch.where(
+        torch.isnan(hc),
+        torch.clamp(_integrate_cosz(A, B, h0, h1), min=0),
+        from_zero_to(h1) - from_zero_to(h0),
+    )
+
+
+class SolarForcing(torch.nn.Module):
+    """Cosine of the solar zenith angle and TISR on a lat-lon grid
+
+    Move the module to a device with ``.to(device)``; the fields are computed
+    there. The cache is cleared when the module is moved.
+
+    Args:
+        lat: latitudes in degrees. Either the (nlat,) axis of a regular grid or
+            an array of any shape with one latitude per point.
+        lon: longitudes in degrees, the (nlon,) axis of a regular grid or one
+            longitude per point, with the shape of ``lat``.
+        maxsize: the number of fields to cache
+    """
+
+    def __init__(self, lat, lon, maxsize: int = 16):
+        super().__init__()
+        lat = torch.deg2rad(torch.as_tensor(np.asarray(lat), dtype=torch.float64))
+        lon = torch.deg2rad(torch.as_tensor(np.asarray(lon), dtype=torch.float64))
+        if lat.ndim == 1 and lon.ndim == 1:
+            lat, lon = lat[:, None], lon[None, :]
+        self.shape = torch.broadcast_shapes(lat.shape, lon.shape)
+        # float64 for the hour angles, which are differenced in ``tisr``
+        self.register_buffer("sin_lat", torch.sin(lat), persistent=False)
+        self.register_buffer("cos_lat", torch.cos(lat), persistent=False)
+        self.register_buffer("lon", lon, persistent=False)
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._cache = collections.OrderedDict()
+
+    def _apply(self, fn, *args, **kwargs):
+        self._cache.clear()
+        return super()._apply(fn, *args, **kwargs)
+
+    def _get(self, key, compute: Callable[[], torch.Tensor]) -> torch.Tensor:
+        if key in self._cache:
+            self.hits += 1
+            self._cache.move_to_end(key)
+            return self._cache[key]
+        self.misses += 1
+        value = compute()
+        self._cache[key] = value
+        if len(self._cache) > self.maxsize:
+            self._cache.popitem(last=False)
+        return value
+
+    def _fields(self, time, kind, compute) -> torch.Tensor:
+        shape, seconds = _timestamps(time)
+        fields = [self._get((kind, t), lambda t=t: compute(t)) for t in seconds]
+        if not shape:
+            return fields[0]
+        if not fields:
+            return self.sin_lat.new_empty((*shape, *self.shape), dtype=torch.float32)
+        return torch.stack(fields).reshape(*shape, *self.shape)
+
+    def _cos_zenith(self, timestamp: float) -> torch.Tensor:
+        ra, dec, gmst = _sun_position(timestamp)
+        hour_angle = self.lon + (gmst - ra)
+        cosz = self.sin_lat * math.sin(dec) + self.cos_lat * math.cos(dec) * torch.cos(
+            hour_angle
+        )
+        return cosz.expand(self.shape).float()
+
+    def _tisr(self, timestamp: float, interval: float) -> torch.Tensor:
+        ra, dec, gmst = _sun_position(timestamp)
+        h1 = self.lon + (gmst - ra)
+        h0 = h1 - interval / 86400 * 2 * math.pi
+        A = self.sin_lat * math.sin(dec)
+        B = self.cos_lat * math.cos(dec)
+        S = float(zenith_angle.irradiance(timestamp))
+        seconds_per_radian = 86400 / (2 * math.pi)
+        tisr = S * _integrate_abs_cosz(A, B, h0, h1) * seconds_per_radian
+        return tisr.expand(self.shape).float()
+
+    def cos_zenith(self, time) -> torch.Tensor:
+        """The cosine of the solar zenith angle
+
+        Args:
+            time: a datetime, or an array of datetimes or datetime64 values
+
+        Returns:
+            a float32 tensor of shape ``time.shape + grid shape``
+        """
+        return self._fields(time, "cos_zenith", self._cos_zenith)
+
+    def tisr(self, time, interval: float = 3600) -> torch.Tensor:
+        """The TOA incident solar radiation accumulated over ``interval``
+        seconds before ``time`` in J/m2
+
+        Args:
+            time: a datetime, or an array of datetimes or datetime64 values
+
+        Returns:
+            a float32 tensor of shape ``time.shape + grid shape``
+        """
+        return self._fields(time, ("tisr", interval), lambda t: self._tisr(t, interval))
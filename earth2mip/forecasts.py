@@ -118,7 +118,8 @@ class TimeLoopForecast(Forecast):
         dt = self._times[1] - self._times[0]
         yield_every = int(dt // self.time_loop.time_step)
         assert yield_every * self.time_loop.time_step == dt  # noqa
-        for time, data, _ in self.time_loop(x=x, time=self._times[i]):
+        model = time_loop.with_output_frequency(self.time_loop, yield_every)
+        for time, data, _ in model(x=x, time=self._times[i]):
             if count % yield_every == 0:
                 logger.info("forecast %s", time)
                 yield data
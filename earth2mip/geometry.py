@@ -15,6 +15,9 @@
 # limitations under the License.
 
 """Routines for working with geometry"""
+import functools
+from typing import Mapping, Sequence, Tuple
+
 import numpy as np
 import torch
 
@@ -46,18 +49,151 @@ def select_space(data, lat, lon, domain):
         domain_lon = lon[lon_sl]
         return domain_lat, domain_lon, data[:, :, lat_sl, lon_sl]
     elif domain_type == "MultiPoint":
-        # Convert lat-long points to array index (just got to closest 0.25 degree)
-        i = lat.size - np.searchsorted(lat[::-1], domain.lat, side="right")
-        j = np.searchsorted(lon, domain.lon, side="left")
-        # TODO refactor this assertion to a test
-        np.testing.assert_array_equal(domain.lat, lat[i])
-        np.testing.assert_array_equal(domain.lon, lon[j])
-        return lat[i], lon[j], data[:, :, i, j]
+        coords = {"lat": lat, "lon": lon}
+        points = {"lat": domain.lat, "lon": domain.lon}
+        out = bilinear(data, ("lat", "lon"), coords, points)
+        return np.asarray(domain.lat), np.asarray(domain.lon), out
     else:
         raise ValueError(
             f"domain {domain_type} is not supported. Check the weather_events.json"
         )
 
 
-def bilinear(data: torch.tensor, dims, source_coords, target_coords):
-    return
+def _interval(coords: np.ndarray, x: np.ndarray):
+    """Return ``i`` and ``f`` with ``x = (1 - f) * coords[i] + f * coords[i + 1]``
+
+    ``coords`` must be increasing. Points outside of ``coords`` are clamped to
+    the first or last node.
+    """
+    i = np.searchsorted(coords, x, side="right") - 1
+    i = np.clip(i, 0, coords.size - 2)
+    f = (x - coords[i]) / (coords[i + 1] - coords[i])
+    return i, np.clip(f, 0, 1)
+
+
+def is_periodic(lon: np.ndarray) -> bool:
+    """True if the equally spaced longitudes ``lon`` span all 360 degrees"""
+    spacing = lon[1] - lon[0]
+    return bool(np.isclose(lon[-1] + spacing - lon[0], 360))
+
+
+def linear_weights(
+    coords: Sequence[float], points: Sequence[float], periodic: bool = False
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """The linear interpolation weights of ``points`` along one axis
+
+    ``coords`` can be increasing or decreasing. If ``periodic``, ``coords``
+    are longitudes spanning all 360 degrees and ``points`` are interpolated
+    across the periodic boundary. Points outside of ``coords`` are clamped to
+    the first or last node.
+
+    Returns:
+        (index0, index1, fraction) arrays with the shape of ``points``. The
+        value at a point is ``(1 - fraction) * data[index0] + fraction *
+        data[index1]``.
+    """
+    coords = np.asarray(coords, dtype=np.float64)
+    points = np.asarray(points, dtype=np.float64)
+
+    if periodic:
+        points = coords[0] + np.mod(points - coords[0], 360)
+        i0, f = _interval(np.append(coords, coords[0] + 360), points)
+        return i0, (i0 + 1) % coords.size, f
+    elif coords[0] > coords[-1]:
+        i, f = _interval(coords[::-1], points)
+        return coords.size - 1 - i, coords.size - 2 - i, f
+    else:
+        i0, f = _interval(coords, points)
+        return i0, i0 + 1, f
+
+
+def bilinear_weights(
+    lat: Sequence[float],
+    lon: Sequence[float],
+    points_lat: Sequence[float],
+    points_lon: Sequence[float],
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """The bilinear interpolation weights of points on a lat-lon grid
+
+    ``lat`` can be increasing or decreasing and ``lon`` must be increasing. On
+    grids spanning all longitudes the points are interpolated across the
+    periodic boundary, so any longitude (e.g. -10 or 359.9) is supported.
+    Points outside of the grid are clamped to its edge.
+
+    Returns:
+        (lat_index, lon_index, weight) arrays of shape (4, npoints). The value
+        at point ``p`` is ``sum(weight[:, p] * data[lat_index[:, p],
+        lon_index[:, p]])``. Points on a grid node have a weight of exactly 1
+        for that node.
+    """
+    lon = np.asarray(lon, dtype=np.float64)
+    i0, i1, fi = linear_weights(lat, points_lat)
+    j0, j1, fj = linear_weights(lon, points_lon, periodic=is_periodic(lon))
+
+    lat_index = np.stack([i0, i0, i1, i1])
+    lon_index = np.stack([j0, j1, j0, j1])
+    weight = np.stack(
+        [(1 - fi) * (1 - fj), (1 - fi) * fj, fi * (1 - fj), fi * fj]
+    ).astype(np.float32)
+    return lat_index, lon_index, weight
+
+
+@functools.lru_cache(maxsize=16)
+def _cached_bilinear_weights(lat, lon, points_lat, points_lon):
+    return bilinear_weights(lat, lon, points_lat, points_lon)
+
+
+def bilinear(
+    data: torch.tensor,
+    dims: Sequence[str],
+    source_coords: Mapping[str, Sequence[float]],
+    target_coords: Mapping[str, Sequence[float]],
+) -> torch.Tensor:
+    """Interpolate ``data`` bilinearly to a set of points
+
+    The weights are cached for every pair of grid and point set, so repeated
+    calls only cost one gather.
+
+    Args:
+        data: (..., lat, lon) data
+        dims: the names of the last two dimensions of ``data``, e.g.
+            ("lat", "lon")
+        source_coords: the coordinates of ``dims``
+        target_coords: the coordinates of the points for each of ``dims``
+
+    Returns:
+        (..., npoints) tensor
+    """
+    lat_dim, lon_dim = dims
+    lat_index, lon_index, weight = _cached_bilinear_weights(
+        tuple(np.asarray(source_coords[lat_dim]).tolist()),
+        tuple(np.asarray(source_coords[lon_dim]).tolist()),
+        tuple(np.asarray(target_coords[lat_dim]).tolist()),
+        tuple(np.asarray(target_coords[lon_dim]).tolist()),
+    )
+    nlon = data.shape[-1]
+    index = torch.as_tensor(lat_index * nlon + lon_index, device=data.device)
+    weight = torch.as_tensor(weight, device=data.device)
+    return interpolate_points(data.flatten(-2), index, weight)
+
+
+def interpolate_points(
+    data: torch.Tensor, index: torch.Tensor, weight: torch.Tensor
+) -> torch.Tensor:
+    """Combine the 4 weighted neighbors of each point with one gather
+
+    Args:
+        data: (..., lat * lon)
+        index: (4, npoints) flat indices into the last dimension of ``data``
+        weight: (4, npoints)
+
+    Returns:
+        (..., npoints)
+    """
+    neighbors = data.index_select(-1, index.flatten())
+    neighbors = neighbors.unflatten(-1, index.shape)
+    weighted = neighbors * weight.to(data.dtype)
+    # nodes with zero weight, e.g. the second row for points on a grid node,
+    # must not propagate NaNs
+    weighted = torch.where(weight > 0, weighted, 0)
+    return weighted.sum(dim=-2)
@@ -15,9 +15,12 @@
 # limitations under the License.
 
 import argparse
+import copy
 import json
 import logging
+import math
 import os
+import shutil
 import sys
 from datetime import datetime
 from typing import Any, Optional
@@ -26,7 +29,7 @@ import cftime
 import numpy as np
 import torch
 import tqdm
-import xarray
+import zarr
 from modulus.distributed.manager import DistributedManager
 from netCDF4 import Dataset as DS
 
@@ -37,16 +40,29 @@ __all__ = ["run_inference", "run_basic_inference"]
 # need to import initial conditions first to avoid unfortunate
 # GLIBC version conflict when importing xarray. There are some unfortunate
 # issues with the environment.
-from earth2mip import initial_conditions, regrid, time_loop
+from earth2mip import initial_conditions, time_loop, zarr_output
 from earth2mip._channel_stds import channel_stds
+from earth2mip.batch_size import probe_batch_size
 from earth2mip.ensemble_utils import (
+    brown_noise,
     generate_bred_vector,
-    generate_noise_correlated,
     generate_noise_grf,
 )
-from earth2mip.netcdf import initialize_netcdf, update_netcdf
-from earth2mip.networks import get_model
-from earth2mip.schema import EnsembleRun, PerturbationStrategy
+from earth2mip.netcdf import (
+    AsyncWriter,
+    OutputPlan,
+    finalize_netcdf,
+    initialize_netcdf,
+    to_host_async,
+)
+from earth2mip.networks import Inference, get_model
+from earth2mip.rollout import rollout
+from earth2mip.schema import (
+    EnsembleRun,
+    OutputFormat,
+    PerturbationStrategy,
+    PrecisionPolicy,
+)
 from earth2mip.time_loop import TimeLoop
 
 logger = logging.getLogger("inference")
@@ -67,7 +83,94 @@ def save_restart(restart, rank, batch_id, path):
     path = get_checkpoint_path(rank, batch_id, path)
     os.makedirs(os.path.dirname(path), exist_ok=True)
     logger.info(f"Saving restart file to {path}.")
-    torch.save(restart, path)
+    # write to a temporary file first so a preempted job never leaves a
+    # truncated checkpoint behind
+    tmp_path = path + ".tmp"
+    torch.save(restart, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def load_restart(rank, batch_id, path) -> Optional[dict]:
+    """Load the checkpoint of ``batch_id`` or return None if there is none"""
+    path = get_checkpoint_path(rank, batch_id, path)
+    if not os.path.exists(path):
+        return None
+    logger.info(f"Loading restart file from {path}.")
+    return torch.load(path, map_location="cpu", weights_only=False)
+
+
+def has_restart(rank, path) -> bool:
+    directory = os.path.dirname(get_checkpoint_path(rank, 0, path))
+    return os.path.isdir(directory) and len(os.listdir(directory)) > 0
+
+
+def _map_tensors(obj, func):
+    if isinstance(obj, torch.Tensor):
+        return func(obj)
+    elif isinstance(obj, dict):
+        return {k: _map_tensors(v, func) for k, v in obj.items()}
+    elif isinstance(obj, (list, tuple)):
+        return type(obj)(_map_tensors(v, func) for v in obj)
+    else:
+        return obj
+
+
+def _get_rng_state():
+    return {
+        "cpu": torch.get_rng_state(),
+        "cuda": torch.cuda.get_rng_state_all() if torch.cuda.is_available() else [],
+    }
+
+
+def _set_rng_state(state):
+    torch.set_rng_state(state["cpu"])
+    if state["cuda"]:
+        torch.cuda.set_rng_state_all(state["cuda"])
+
+
+def _save_checkpoint(nc, checkpoint, events, rank, batch_id, path):
+    for event in events:
+        event.synchronize()
+    # make sure the outputs the checkpoint refers to are on disk
+    nc.sync()
+    save_restart(checkpoint, rank, batch_id, path)
+
+
+def _submit_checkpoint(
+    writer: AsyncWriter,
+    nc,
+    *,
+    restart,
+    diagnostics,
+    step,
+    time,
+    completed,
+    rank,
+    batch_id,
+    path,
+):
+    events = []
+
+    def to_host(x):
+        if x.device.type == "cuda":
+            x, event = to_host_async(x)
+            events.append(event)
+            return x
+        return x.clone()
+
+    checkpoint = {
+        "step": step,
+        "time": time,
+        "completed": completed,
+        "restart": _map_tensors(restart, to_host),
+        "rng_state": _get_rng_state(),
+        # the running statistics of the reducing diagnostics
+        "diagnostics": [
+            [_map_tensors(d.state_dict(), to_host) for d in domain_diagnostics]
+            for domain_diagnostics in diagnostics
+        ],
+    }
+    writer.submit(_save_checkpoint, nc, checkpoint, events, rank, batch_id, path)
 
 
 def run_ensembles(
@@ -89,51 +192,261 @@ def run_ensembles(
     output_path: str,
     restart_initial_directory: str = "",
     progress: bool = True,
+    output_queue_depth: int = 2,
+    ensemble_offset: int = 0,
+    resume: bool = False,
+    process_group: Any = None,
+    write_shared: bool = True,
 ):
+    """Run ``n_ensemble`` members in batches and write them to ``nc``
+
+    Args:
+        nc: a ``netCDF4.Dataset`` or a :class:`earth2mip.zarr_output.ZarrGroup`
+        restart_frequency: if not None, save a checkpoint of each batch every
+            ``restart_frequency`` steps and when the batch is finished. 0 = only
+            save when the batch is finished.
+        restart_initial_directory: the directory for checkpoints. Defaults to
+            ``{output_path}/restart``.
+        ensemble_offset: index of this rank's first member in the ensemble
+            dimension of ``nc``. Non-zero when several ranks share one output.
+        resume: if True, ``nc`` already contains the outputs of a previous
+            run. Batches with a finished checkpoint are skipped and batches
+            with a partial checkpoint are resumed from it.
+        process_group: the ranks whose members are combined by diagnostics
+            reducing over the ensemble, see
+            :class:`earth2mip.diagnostics.Diagnostics`. When ``nc`` is shared
+            by these ranks, the rank with ``write_shared`` initializes it
+            before the others open it.
+        write_shared: if True, write the variables, coordinates and times
+            shared by all ranks. Only one of the ranks sharing ``nc`` sets it.
+    """
     if not output_grid:
         output_grid = model.grid
 
-    regridder = regrid.get_regridder(model.grid, output_grid).to(model.device)
+    restart_dir = restart_initial_directory or get_restart_directory(output_path)
+
+    if output_frequency:
+        # skip the diagnostic models and outputs on steps that are not written
+        model = time_loop.with_output_frequency(model, output_frequency)
+
+    def _initialize(append):
+        return initialize_netcdf(
+            nc,
+            domains,
+            output_grid,
+            n_ensemble,
+            model.device,
+            append=append,
+            process_group=process_group,
+        )
 
-    diagnostics = initialize_netcdf(nc, domains, output_grid, n_ensemble, model.device)
     initial_time = date_obj
     time_units = initial_time.strftime("hours since %Y-%m-%d %H:%M:%S")
-    nc["time"].units = time_units
-    nc["time"].calendar = "standard"
+    if write_shared:
+        diagnostics = _initialize(append=resume)
+        nc["time"].units = time_units
+        nc["time"].calendar = "standard"
+    if process_group is not None and torch.distributed.is_initialized():
+        torch.distributed.barrier(process_group)
+    if not write_shared:
+        diagnostics = _initialize(append=True)
+
+    output_plan = OutputPlan(
+        diagnostics,
+        domains,
+        model.grid,
+        model.out_channel_names,
+        output_grid=output_grid,
+        device=model.device,
+    )
+    # netCDF is not thread-safe, so all writes to ``nc`` below this point must
+    # go through ``writer``
+    with AsyncWriter(output_queue_depth) as writer:
+        for batch_id in range(0, n_ensemble, batch_size):
+            checkpoint = None
+            if resume and restart_frequency is not None:
+                checkpoint = load_restart(rank, batch_id, restart_dir)
+
+            if checkpoint is not None:
+                # continue with the random numbers and statistics of the
+                # previous run
+                _set_rng_state(checkpoint["rng_state"])
+                for domain_diagnostics, states in zip(
+                    diagnostics, checkpoint.get("diagnostics", [])
+                ):
+                    for diagnostic, state in zip(domain_diagnostics, states):
+                        diagnostic.load_state_dict(state)
+                if checkpoint["completed"]:
+                    logger.info(f"Skipping finished ensemble batch {batch_id}.")
+                    continue
+                checkpoint["restart"] = _map_tensors(
+                    checkpoint["restart"], lambda x: x.to(model.device)
+                )
+
+            _run_batch(
+                model=model,
+                perturb=perturb,
+                x=x,
+                nc=nc,
+                writer=writer,
+                output_plan=output_plan,
+                diagnostics=diagnostics,
+                n_steps=n_steps,
+                n_ensemble=n_ensemble,
+                batch_id=batch_id,
+                batch_size=batch_size,
+                rank=rank,
+                output_frequency=output_frequency,
+                initial_time=initial_time,
+                time_units=time_units,
+                progress=progress,
+                ensemble_offset=ensemble_offset,
+                restart_frequency=restart_frequency,
+                restart_dir=restart_dir,
+                checkpoint=checkpoint,
+                write_time=write_shared,
+            )
 
-    for batch_id in range(0, n_ensemble, batch_size):
-        logger.info(f"ensemble members {batch_id+1}-{batch_id+batch_size}/{n_ensemble}")
-        batch_size = min(batch_size, n_ensemble - batch_id)
+        finalize_netcdf(diagnostics, writer)
+
+
+def get_restart_directory(output_path: str) -> str:
+    return os.path.join(output_path, "restart")
+
+
+def _get_batch_size_path(restart_dir: str) -> str:
+    return os.path.join(restart_dir, "ensemble_batch_size.json")
 
-        x = x.repeat(batch_size, 1, 1, 1, 1)
-        x_start = perturb(x, rank, batch_id, model.device)
 
+def _resolve_batch_size(
+    model: TimeLoop,
+    x: torch.Tensor,
+    config: EnsembleRun,
+    date_obj: datetime,
+    n_ensemble: int,
+    restart_dir: str,
+    resume: bool,
+    group: Any,
+):
+    """Return the batch size and the probe record, None unless probed
+
+    A resumed run reuses the batch size of the run it continues, since the
+    checkpoints are stored per batch.
+    """
+    if config.ensemble_batch_size != "auto":
+        return config.ensemble_batch_size, None
+
+    path = _get_batch_size_path(restart_dir)
+    if resume and os.path.exists(path):
+        with open(path) as f:
+            record = json.load(f)
+        logger.info(f"Reusing ensemble batch size {record['batch_size']}.")
+        return record["batch_size"], record
+
+    probe = probe_batch_size(
+        model,
+        x,
+        date_obj,
+        max_batch_size=n_ensemble,
+        headroom=config.ensemble_batch_size_headroom,
+    )
+    batch_size = probe.batch_size
+    if torch.distributed.is_initialized():
+        # all ranks must agree for the chunking of a shared output store
+        buf = torch.tensor(batch_size, device=model.device)
+        torch.distributed.all_reduce(buf, torch.distributed.ReduceOp.MIN, group=group)
+        batch_size = int(buf.item())
+
+    record = probe.to_dict()
+    record["batch_size"] = batch_size
+    logger.info(f"Using ensemble batch size {batch_size}.")
+    if config.restart_frequency is not None and DistributedManager().rank == 0:
+        os.makedirs(restart_dir, exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(record, f)
+    return batch_size, record
+
+
+def _set_time(nc, time_count, value):
+    nc["time"][time_count] = value
+
+
+def _run_batch(
+    *,
+    model: TimeLoop,
+    perturb,
+    x,
+    nc,
+    writer: AsyncWriter,
+    output_plan: OutputPlan,
+    diagnostics,
+    n_steps: int,
+    n_ensemble: int,
+    batch_id: int,
+    batch_size: int,
+    rank: int,
+    output_frequency: int,
+    initial_time: datetime,
+    time_units: str,
+    progress: bool,
+    ensemble_offset: int,
+    restart_frequency: Optional[int],
+    restart_dir: str,
+    checkpoint: Optional[dict],
+    write_time: bool = True,
+):
+    logger.info(f"ensemble members {batch_id+1}-{batch_id+batch_size}/{n_ensemble}")
+    batch_size = min(batch_size, n_ensemble - batch_id)
+
+    x = x.repeat(batch_size, 1, 1, 1, 1)
+    if checkpoint is None:
+        x_start = perturb(x, rank, batch_id, model.device)
         iterator = model(initial_time, x_start)
+        first_step = 0
+    else:
+        logger.info(f"Resuming ensemble batch {batch_id} at step {checkpoint['step']}.")
+        iterator = model(checkpoint["time"], x, restart=checkpoint["restart"])
+        # the first item repeats the checkpointed step, which was already saved
+        next(iterator)
+        first_step = checkpoint["step"] + 1
+
+    # Check if stdout is connected to a terminal
+    if sys.stderr.isatty() and progress:
+        iterator = tqdm.tqdm(iterator, total=n_steps - first_step)
+
+    for k, (time, data, restart) in enumerate(iterator, start=first_step):
+        # Saving the output
+        if output_frequency and k % output_frequency == 0:
+            time_count = k // output_frequency
+            logger.debug(f"Saving data at step {k} of {n_steps}.")
+            # output_queue_depth counts output steps
+            with writer.group():
+                if write_time:
+                    value = cftime.date2num(time, time_units)
+                    writer.submit(_set_time, nc, time_count, value)
+                output_plan.update(
+                    data, ensemble_offset + batch_id, time_count, writer=writer
+                )
 
-        # Check if stdout is connected to a terminal
-        if sys.stderr.isatty() and progress:
-            iterator = tqdm.tqdm(iterator, total=n_steps)
-
-        time_count = -1
-
-        for k, (time, data, _) in enumerate(iterator):
-            # Saving the output
-            if output_frequency and k % output_frequency == 0:
-                time_count += 1
-                logger.debug(f"Saving data at step {k} of {n_steps}.")
-                nc["time"][time_count] = cftime.date2num(time, nc["time"].units)
-                update_netcdf(
-                    regridder(data),
-                    diagnostics,
-                    domains,
-                    batch_id,
-                    time_count,
-                    model.grid,
-                    model.out_channel_names,
+        if restart_frequency is not None:
+            completed = k == n_steps
+            periodic = restart_frequency and k % restart_frequency == 0 and k > 0
+            if completed or (periodic and restart is not None):
+                _submit_checkpoint(
+                    writer,
+                    nc,
+                    restart=None if completed else restart,
+                    diagnostics=diagnostics,
+                    step=k,
+                    time=time,
+                    completed=completed,
+                    rank=rank,
+                    batch_id=batch_id,
+                    path=restart_dir,
                 )
 
-            if k == n_steps:
-                break
+        if k == n_steps:
+            break
 
 
 def main(config=None):
@@ -182,19 +495,31 @@ def get_initializer(
     model,
     config,
 ):
+    # When field is not in known normalization dictionary set scale to 0
+    scale = []
+    for channel in model.in_channel_names:
+        perturbed = (
+            config.perturbation_channels is None
+            or channel in config.perturbation_channels
+        )
+        if perturbed and channel in channel_stds:
+            scale.append(channel_stds[channel])
+        else:
+            scale.append(0)
+    scale = torch.tensor(scale)[:, None, None]
+
     def perturb(x, rank, batch_id, device):
         shape = x.shape
+        # multiplied into the channel scale, so the noise is only scaled once
+        amplitude = 1.0
         if config.perturbation_strategy == PerturbationStrategy.gaussian:
-            noise = config.noise_amplitude * torch.normal(
-                torch.zeros(shape), torch.ones(shape)
-            ).to(device)
+            noise = torch.randn(shape, device=device, dtype=x.dtype)
+            amplitude = config.noise_amplitude
         elif config.perturbation_strategy == PerturbationStrategy.correlated:
-            noise = generate_noise_correlated(
-                shape,
-                reddening=config.noise_reddening,
-                device=device,
-                noise_amplitude=config.noise_amplitude,
+            noise = brown_noise(
+                shape, config.noise_reddening, device=device, dtype=x.dtype
             )
+            amplitude = config.noise_amplitude
         elif config.perturbation_strategy == PerturbationStrategy.spherical_grf:
             noise = generate_noise_grf(
                 shape,
@@ -202,7 +527,7 @@ def get_initializer(
                 sigma=config.grf_noise_sigma,
                 alpha=config.grf_noise_alpha,
                 tau=config.grf_noise_tau,
-                device=device,
+                out=torch.empty(shape, dtype=x.dtype, device=device),
             )
         elif config.perturbation_strategy == PerturbationStrategy.bred_vector:
             noise = generate_bred_vector(
@@ -216,30 +541,8 @@ def get_initializer(
         if rank == 0 and batch_id == 0:  # first ens-member is deterministic
             noise[0, :, :, :, :] = 0
 
-        # When field is not in known normalization dictionary set scale to 0
-        scale = []
-        for i, channel in enumerate(model.in_channel_names):
-            if channel in channel_stds:
-                scale.append(channel_stds[channel])
-            else:
-                scale.append(0)
-        scale = torch.tensor(scale, device=x.device)
-
-        if config.perturbation_channels is None:
-            return x + noise * scale[:, None, None]
-        else:
-            channel_list = model.in_channel_names
-            indices = torch.tensor(
-                [
-                    channel_list.index(channel)
-                    for channel in config.perturbation_channels
-                    if channel in channel_list
-                ]
-            )
-            x[:, :, indices, :, :] += (
-                noise[:, :, indices, :, :] * scale[indices, None, None]
-            )
-        return x
+        channel_scale = (amplitude * scale).to(device=noise.device, dtype=x.dtype)
+        return torch.addcmul(x, noise, channel_scale)
 
     return perturb
 
@@ -250,25 +553,29 @@ def run_basic_inference(
     data_source: Any,
     time: datetime,
 ):
-    """Run a basic inference"""
+    """Run a basic inference
+
+    See :func:`earth2mip.rollout.rollout` to store the outputs in a
+    preallocated or memory mapped array.
+    """
 
     x = initial_conditions.get_initial_condition_for_model(model, data_source, time)
+    output = rollout(model, x, n, time=time)
+    return output.rename(batch="history")
 
-    arrays = []
-    times = []
-    for k, (time, data, _) in enumerate(model(time, x)):
-        arrays.append(data.cpu().numpy())
-        times.append(time)
-        if k == n:
-            break
 
-    stacked = np.stack(arrays)
-    coords = dict(lat=model.grid.lat, lon=model.grid.lon)
-    coords["channel"] = model.out_channel_names
-    coords["time"] = times
-    return xarray.DataArray(
-        stacked, dims=["time", "history", "channel", "lat", "lon"], coords=coords
-    )
+def _enable_compile(model: TimeLoop, cuda_graphs: bool):
+    if isinstance(model, Inference):
+        model.enable_compile(cuda_graphs=cuda_graphs)
+    else:
+        logger.warning(f"{type(model).__name__} does not support compiling.")
+
+
+def _set_precision(model: TimeLoop, precision: PrecisionPolicy):
+    if isinstance(model, Inference):
+        model.set_precision(precision)
+    else:
+        logger.warning(f"{type(model).__name__} does not support precision policies.")
 
 
 def run_inference(
@@ -289,6 +596,11 @@ def run_inference(
         data_source: a Mapping object indexed by datetime and returning an
             xarray.Dataset object.
     """
+    if isinstance(model, Inference):
+        # the model may be shared, e.g. by networks.model_cache, so the precision
+        # and compile settings of this run are applied to a copy
+        model = copy.copy(model)
+
     if not perturb:
         perturb = get_initializer(model, config)
 
@@ -340,18 +652,90 @@ def run_inference(
         with open(config_path, "w") as f:
             f.write(config.json())
 
+    if config.precision is not None:
+        # before the probe, since the state precision changes the memory use
+        _set_precision(model, config.precision)
+
     group_rank = torch.distributed.get_group_rank(group, dist.rank)
-    output_file_path = os.path.join(output_path, f"ensemble_out_{group_rank}.nc")
-
-    with DS(output_file_path, "w", format="NETCDF4") as nc:
-        # assign global attributes
-        nc.model = config.weather_model
-        nc.config = config.json()
-        nc.weather_event = weather_event.json()
-        nc.date_created = datetime.now().isoformat()
-        nc.history = " ".join(sys.argv)
-        nc.institution = "NVIDIA"
-        nc.Conventions = "CF-1.10"
+    restart_dir = get_restart_directory(output_path)
+    checkpointing = config.restart_frequency is not None
+    batch_size, batch_size_record = _resolve_batch_size(
+        model,
+        x,
+        config,
+        date_obj,
+        n_ensemble,
+        restart_dir,
+        resume=checkpointing and has_restart(dist.rank, restart_dir),
+        group=group,
+    )
+    if config.compile_model or config.use_cuda_graphs:
+        # after the probe, which would compile a step for every batch size tried
+        _enable_compile(model, cuda_graphs=config.use_cuda_graphs)
+
+    if config.output_format == OutputFormat.zarr:
+        output_file_path = os.path.join(output_path, "ensemble_out.zarr")
+        # the restart directory also holds the batch size record, so look for
+        # the checkpoints themselves
+        any_restart = checkpointing and any(
+            has_restart(rank, restart_dir) for rank in range(dist.world_size)
+        )
+        if dist.rank == 0 and not any_restart:
+            # clear any previous outputs before other ranks open the store
+            zarr_output.ZarrGroup.open(output_file_path, mode="w")
+        if torch.distributed.is_initialized():
+            torch.distributed.barrier(group)
+        n_output_times = config.simulation_length // config.output_frequency + 1
+        nc = zarr_output.ZarrGroup.open(
+            output_file_path,
+            dimensions={
+                "ensemble": n_ensemble * dist.world_size,
+                "time": n_output_times,
+            },
+            # every batch written by every rank covers whole chunks
+            chunks={
+                "ensemble": math.gcd(batch_size, n_ensemble),
+                "time": 1,
+            },
+        )
+        ensemble_offset = dist.rank * n_ensemble
+        resume = any_restart and has_restart(dist.rank, restart_dir)
+        # all ranks share the statistics of the reducing diagnostics
+        process_group = group
+        # rank 0 writes the attributes and coordinates shared by all ranks
+        write_shared = dist.rank == 0
+    else:
+        output_file_path = os.path.join(output_path, f"ensemble_out_{group_rank}.nc")
+        resume = (
+            checkpointing
+            and has_restart(dist.rank, restart_dir)
+            and os.path.exists(output_file_path)
+        )
+        nc = DS(output_file_path, "a" if resume else "w", format="NETCDF4")
+        ensemble_offset = 0
+        process_group = None
+        write_shared = True
+
+    if resume:
+        logger.info(f"Resuming from restart files in {restart_dir}.")
+    elif checkpointing:
+        # remove stale checkpoints of an unrelated previous run
+        rank_dir = os.path.dirname(get_checkpoint_path(dist.rank, 0, restart_dir))
+        shutil.rmtree(rank_dir, ignore_errors=True)
+
+    with nc:
+        if write_shared:
+            # assign global attributes
+            nc.model = config.weather_model
+            nc.config = config.json()
+            nc.weather_event = weather_event.json()
+            nc.date_created = datetime.now().isoformat()
+            nc.history = " ".join(sys.argv)
+            nc.institution = "NVIDIA"
+            nc.Conventions = "CF-1.10"
+            nc.ensemble_batch_size = batch_size
+            if batch_size_record is not None:
+                nc.ensemble_batch_size_probe = json.dumps(batch_size_record)
 
         run_ensembles(
             weather_event=weather_event,
@@ -363,21 +747,29 @@ def run_inference(
             n_ensemble=n_ensemble,
             n_steps=config.simulation_length,
             output_frequency=config.output_frequency,
-            batch_size=config.ensemble_batch_size,
+            batch_size=batch_size,
             rank=dist.rank,
             date_obj=date_obj,
             restart_frequency=config.restart_frequency,
             output_path=output_path,
+            output_queue_depth=config.output_queue_depth,
             output_grid=(
                 earth2mip.grid.from_enum(config.output_grid)
                 if config.output_grid
                 else None
             ),
             progress=progress,
+            ensemble_offset=ensemble_offset,
+            resume=resume,
+            process_group=process_group,
+            write_shared=write_shared,
         )
     if torch.distributed.is_initialized():
         torch.distributed.barrier(group)
 
+    if config.output_format == OutputFormat.zarr and dist.rank == 0:
+        zarr.consolidate_metadata(output_file_path)
+
     logger.info(f"Ensemble forecast finished, saved to: {output_file_path}")
 
 
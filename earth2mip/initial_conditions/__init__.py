@@ -15,13 +15,14 @@
 # limitations under the License.
 
 import datetime
+import importlib
 from typing import List
 
 import numpy as np
 import torch
 
 from earth2mip import config, regrid, schema, time_loop
-from earth2mip.initial_conditions import base, cds, gfs, hdf5, hrmip, ifs
+from earth2mip.initial_conditions import base
 
 __all__ = [
     "get_data_source",
@@ -32,6 +33,20 @@ __all__ = [
     "hdf5",
 ]
 
+# the data sources are imported on first use, since they depend on slow to
+# import packages like cdsapi and eccodes
+_DATA_SOURCE_MODULES = ["cds", "gfs", "hdf5", "hrmip", "ifs"]
+
+
+def __getattr__(name):
+    if name in _DATA_SOURCE_MODULES:
+        return importlib.import_module(f"{__name__}.{name}")
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_DATA_SOURCE_MODULES))
+
 
 def get_data_source(
     channel_names: List[str],
@@ -39,16 +54,26 @@ def get_data_source(
     initial_condition_source=schema.InitialConditionSource.era5,
 ) -> base.DataSource:
     if initial_condition_source == schema.InitialConditionSource.era5:
+        from earth2mip.initial_conditions import hdf5
+
         return hdf5.DataSource.from_path(
             root=config.ERA5_HDF5, channel_names=channel_names
         )
     elif initial_condition_source == schema.InitialConditionSource.cds:
+        from earth2mip.initial_conditions import cds
+
         return cds.DataSource(channel_names)
     elif initial_condition_source == schema.InitialConditionSource.gfs:
+        from earth2mip.initial_conditions import gfs
+
         return gfs.DataSource(channel_names)
     elif initial_condition_source == schema.InitialConditionSource.ifs:
+        from earth2mip.initial_conditions import ifs
+
         return ifs.DataSource(channel_names)
     elif initial_condition_source == schema.InitialConditionSource.hrmip:
+        from earth2mip.initial_conditions import hrmip
+
         return hrmip.HDFPlSl(path=config.ERA5_HDF5)
     else:
         raise NotImplementedError(initial_condition_source)
@@ -64,7 +89,7 @@ def get_data_from_source(
     device: torch.device = "cpu",
     dtype: torch.dtype = torch.float,
     channel_to_modify: str = None,
-    modulating_factor: float = 1.0
+    modulating_factor: float = 1.0,
 ) -> torch.Tensor:
     """Get data from a data source
 
@@ -102,20 +127,26 @@ def get_data_from_source(
     # make an empty batch dim
     x = x[None]
     x = regridder(x)
-    
+
     # Modify the data of the specified channel by the modulating factor
     if channel_to_modify is not None:
         try:
             channel_index = channel_names.index(channel_to_modify)
             x[:, :, channel_index, :, :] *= modulating_factor
         except ValueError:
-            raise ValueError(f"Channel '{channel_to_modify}' not found in channel_names.")
+            raise ValueError(
+                f"Channel '{channel_to_modify}' not found in channel_names."
+            )
 
     return x
 
 
 def get_initial_condition_for_model(
-    time_loop: time_loop.TimeLoop, data_source: base.DataSource, time: datetime, channel_to_modify: str, modulating_factor: float
+    time_loop: time_loop.TimeLoop,
+    data_source: base.DataSource,
+    time: datetime,
+    channel_to_modify: str = None,
+    modulating_factor: float = 1.0,
 ) -> torch.Tensor:
     return get_data_from_source(
         data_source,
@@ -127,5 +158,5 @@ def get_initial_condition_for_model(
         time_loop.device,
         time_loop.dtype,
         channel_to_modify=channel_to_modify,
-        modulating_factor=modulating_factor
-    )
\ No newline at end of file
+        modulating_factor=modulating_factor,
+    )
@@ -22,7 +22,6 @@ import warnings
 from typing import Any, List, Optional
 
 import numpy as np
-import s3fs
 import xarray
 
 from earth2mip import config, filesystem, grid
@@ -102,9 +101,7 @@ class DataSource(base.DataSource):
     def __getitem__(self, time: datetime.datetime) -> np.ndarray:
         path = _get_path(self.root, time)
         if path.startswith("s3://"):
-            fs = s3fs.S3FileSystem(
-                client_kwargs=dict(endpoint_url="https://pbss.s8k.io")
-            )
+            fs = filesystem._get_fs(path)
             f = fs.open(path)
         else:
             f = None
@@ -130,9 +127,7 @@ def open_xarray(time: datetime.datetime) -> xarray.DataArray:
 
     if path.endswith(".h5"):
         if path.startswith("s3://"):
-            fs = s3fs.S3FileSystem(
-                client_kwargs=dict(endpoint_url="https://pbss.s8k.io")
-            )
+            fs = filesystem._get_fs(path)
             f = fs.open(path)
         else:
             f = None
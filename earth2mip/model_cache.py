@@ -0,0 +1,174 @@
+# SPDX-FileCopyrightText: Copyright (c) 2023 NVIDIA CORPORATION & AFFILIATES.
+# SPDX-FileCopyrightText: All rights reserved.
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""An in-process cache of loaded models
+
+:func:`earth2mip.networks.get_model` keeps the models it loads in
+``earth2mip.networks.model_cache``, so loading the same model again in the same
+process returns the loaded instance. The cache holds at most
+``config.MODEL_CACHE_BYTES`` of parameters and buffers (0, the default,
+disables it) and evicts the least recently used models first. Models whose
+weights are not torch tensors, e.g. onnx or jax models, report their size with
+an ``nbytes`` attribute; models of unknown size are not cached.
+
+Cached models are shared by all callers, so changes to one, e.g.
+:meth:`earth2mip.networks.Inference.set_precision`, are seen by the next user.
+:func:`earth2mip.inference_ensemble.run_inference` applies the precision and
+compile settings of a run to a copy of the model instead.
+"""
+import collections
+import dataclasses
+import itertools
+import logging
+import threading
+from typing import Any, Callable, Hashable, Optional
+
+import torch
+
+__all__ = ["CacheInfo", "ModelCache", "model_nbytes", "module_nbytes"]
+
+logger = logging.getLogger(__name__)
+
+
+@dataclasses.dataclass
+class CacheInfo:
+    """The state of a :class:`ModelCache`
+
+    Attributes:
+        hits: the number of loads served from the cache
+        misses: the number of loads which loaded the model
+        evictions: the number of models evicted to stay within the budget
+        n_models: the number of cached models
+        nbytes: the memory of the cached models
+        max_bytes: the memory budget
+    """
+
+    hits: int
+    misses: int
+    evictions: int
+    n_models: int
+    nbytes: int
+    max_bytes: int
+
+
+def _tensor_storages(tensor: torch.Tensor):
+    if tensor.layout == torch.sparse_coo:
+        return [tensor._indices(), tensor._values()]
+    if tensor.layout == torch.sparse_csr:
+        return [tensor.crow_indices(), tensor.col_indices(), tensor.values()]
+    return [tensor]
+
+
+def module_nbytes(module: torch.nn.Module) -> int:
+    """The memory of the parameters and buffers of ``module``
+
+    Tensors sharing memory are counted once.
+    """
+    storages = {}
+    for tensor in itertools.chain(module.parameters(), module.buffers()):
+        for t in _tensor_storages(tensor):
+            storage = t.untyped_storage()
+            storages[(t.device, storage.data_ptr())] = storage.nbytes()
+    return sum(storages.values())
+
+
+def model_nbytes(model: Any) -> Optional[int]:
+    """The memory of ``model``, or None if it is unknown
+
+    This is the ``nbytes`` attribute of the model if it has one, otherwise the
+    memory of the parameters and buffers of torch modules. Other models, and
+    modules without parameters or buffers, are of unknown size.
+    """
+    nbytes = getattr(model, "nbytes", None)
+    if nbytes is not None:
+        return nbytes
+    if isinstance(model, torch.nn.Module):
+        return module_nbytes(model) or None
+    return None
+
+
+class ModelCache:
+    """A thread safe LRU cache of models with a memory budget
+
+    Args:
+        max_bytes: the memory budget. Models larger than this, or of unknown
+            size (see :func:`model_nbytes`), are not cached.
+    """
+
+    def __init__(self, max_bytes: int = 0):
+        self.max_bytes = max_bytes
+        self._models = collections.OrderedDict()
+        self._lock = threading.RLock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def get(self, key: Hashable, load: Callable[[], Any]) -> Any:
+        """Return the model cached under ``key`` or load it with ``load``"""
+        with self._lock:
+            if key in self._models:
+                self._hits += 1
+                self._models.move_to_end(key)
+                return self._models[key][0]
+            self._misses += 1
+
+            model = load()
+            if self.max_bytes <= 0:
+                return model
+            nbytes = model_nbytes(model)
+            if nbytes is None:
+                logger.info(f"Not caching {key}: its size is unknown.")
+            elif nbytes <= self.max_bytes:
+                self._models[key] = (model, nbytes)
+                self._evict(self.max_bytes)
+            else:
+                logger.info(
+                    f"Not caching {key}: {nbytes} bytes exceed the budget of "
+                    f"{self.max_bytes} bytes."
+                )
+            return model
+
+    def _evict(self, max_bytes: int):
+        while self._models and self._nbytes() > max_bytes:
+            key, _ = self._models.popitem(last=False)
+            self._evictions += 1
+            logger.info(f"Evicted {key} from the model cache.")
+
+    def _nbytes(self) -> int:
+        return sum(nbytes for _, nbytes in self._models.values())
+
+    def release(self, model: Optional[Any] = None):
+        """Remove ``model`` from the cache, or all models if None
+
+        The memory of a model is freed once no other references to it remain.
+        """
+        with self._lock:
+            if model is None:
+                self._models.clear()
+                return
+            for key, (cached, _) in list(self._models.items()):
+                if cached is model:
+                    del self._models[key]
+
+    def info(self) -> CacheInfo:
+        with self._lock:
+            return CacheInfo(
+                hits=self._hits,
+                misses=self._misses,
+                evictions=self._evictions,
+                n_models=len(self._models),
+                nbytes=self._nbytes(),
+                max_bytes=self.max_bytes,
+            )
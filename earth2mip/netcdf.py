@@ -16,18 +16,29 @@
 
 """Routines to save domains to a netCDF file
 """
-from typing import Iterable, List
+import collections
+import contextlib
+import dataclasses
+import math
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Deque, Iterable, List, Optional, Union
 
 import numpy as np
 import torch
 import xarray as xr
 
 import earth2mip.grid
-from earth2mip import geometry
+from earth2mip import geometry, regrid
 from earth2mip.diagnostics import Diagnostics, DiagnosticTypes
 from earth2mip.weather_events import Domain
 
-__all__ = ["initialize_netcdf", "update_netcdf"]
+__all__ = [
+    "initialize_netcdf",
+    "update_netcdf",
+    "finalize_netcdf",
+    "AsyncWriter",
+    "OutputPlan",
+]
 
 
 def _assign_lat_attributes(nc_variable):
@@ -107,22 +118,36 @@ def init_dimensions(domain: Domain, group, grid: earth2mip.grid.LatLonGrid):
 
 
 def initialize_netcdf(
-    nc, domains: Iterable[Domain], grid: earth2mip.grid.LatLonGrid, n_ensemble, device
+    nc,
+    domains: Iterable[Domain],
+    grid: earth2mip.grid.LatLonGrid,
+    n_ensemble,
+    device,
+    append: bool = False,
+    process_group: Any = None,
 ) -> List[List[Diagnostics]]:
-    nc.createVLType(str, "vls")
-    nc.createDimension("time", None)
-    nc.createDimension("ensemble", n_ensemble)
-    nc.createVariable("time", np.float32, ("time"))
+    """Create the groups and variables of ``domains``
+
+    If ``append`` is True, ``nc`` was initialized by a previous run and only
+    the diagnostics are constructed. ``process_group`` is passed to the
+    diagnostics, see :class:`earth2mip.diagnostics.Diagnostics`.
+    """
+    if not append:
+        nc.createVLType(str, "vls")
+        nc.createDimension("time", None)
+        nc.createDimension("ensemble", n_ensemble)
+        nc.createVariable("time", np.float32, ("time"))
     total_diagnostics = []
     for domain in domains:
         group = nc.createGroup(domain.name)
-        init_dimensions(domain, group, grid)
+        if not append:
+            init_dimensions(domain, group, grid)
         diagnostics = []
         for d in domain.diagnostics:
             lat = np.array(grid.lat)
             lon = np.array(grid.lon)
             diagnostic = DiagnosticTypes[d.type](
-                group, domain, grid, d, lat, lon, device
+                group, domain, grid, d, lat, lon, device, process_group=process_group
             )
             diagnostics.append(diagnostic)
 
@@ -130,6 +155,296 @@ def initialize_netcdf(
     return total_diagnostics
 
 
+class AsyncWriter:
+    """Run output writes on a dedicated background thread
+
+    Writes are executed in submission order by a single worker thread, so
+    non-thread-safe backends like netCDF4 are only ever touched by one thread
+    at a time. Once ``queue_depth`` writes are pending, ``submit`` blocks until
+    the oldest one finishes. The writes submitted within :meth:`group`, e.g.
+    all the writes of an output step, count as one. Errors raised by a write
+    are re-raised in the calling thread by the next ``submit``, ``flush`` or
+    ``close``.
+
+    Args:
+        queue_depth: the maximum number of pending writes or groups of writes.
+            If 0, writes are executed synchronously in the calling thread.
+
+    Example:
+        >>> with AsyncWriter(queue_depth=2) as writer:
+        ...     writer.submit(print, "hello")
+        hello
+    """
+
+    def __init__(self, queue_depth: int = 2):
+        if queue_depth < 0:
+            raise ValueError(f"queue_depth must be >= 0, got {queue_depth}.")
+        self.queue_depth = queue_depth
+        self._pending: Deque[List[Future]] = collections.deque()
+        self._group: Optional[List[Future]] = None
+        self._pool = ThreadPoolExecutor(max_workers=1) if queue_depth else None
+
+    def submit(self, fn: Callable, *args: Any, **kwargs: Any) -> None:
+        if self._pool is None:
+            fn(*args, **kwargs)
+            return
+
+        if self._group is not None:
+            self._group.append(self._pool.submit(fn, *args, **kwargs))
+            return
+        self._wait(self.queue_depth - 1)
+        self._pending.append([self._pool.submit(fn, *args, **kwargs)])
+
+    @contextlib.contextmanager
+    def group(self):
+        """Count the writes submitted in this context as one pending write"""
+        if self._pool is None or self._group is not None:
+            yield
+            return
+        self._wait(self.queue_depth - 1)
+        self._group = []
+        try:
+            yield
+        finally:
+            self._pending.append(self._group)
+            self._group = None
+
+    def _wait(self, n: int) -> None:
+        """Block until at most ``n`` writes or groups are pending"""
+        while len(self._pending) > n:
+            for future in self._pending.popleft():
+                future.result()
+
+    def flush(self) -> None:
+        """Block until all pending writes are finished"""
+        self._wait(0)
+
+    def close(self) -> None:
+        try:
+            self.flush()
+        finally:
+            if self._pool is not None:
+                self._pool.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        elif self._pool is not None:
+            # let in-flight writes finish before the file is closed, but do
+            # not mask the original exception
+            self._pool.shutdown(wait=True, cancel_futures=True)
+
+
+def to_host_async(x: torch.Tensor):
+    """Start a device to host copy of ``x``
+
+    CUDA tensors are copied into page-locked memory with a non-blocking copy.
+    Pinned buffers are recycled by torch's caching host allocator, so a bounded
+    number of buffers rotates between the producer and the writer.
+
+    Returns:
+        (host tensor, event) tuple. Call ``event.synchronize()`` before reading
+        the host tensor. ``event`` is None for tensors already on the host.
+    """
+    if x.device.type != "cuda":
+        return x, None
+
+    out = torch.empty(x.shape, dtype=x.dtype, pin_memory=True)
+    out.copy_(x, non_blocking=True)
+    event = torch.cuda.Event()
+    event.record()
+    return out, event
+
+
+def _index(index) -> Union[slice, torch.Tensor, np.ndarray]:
+    """Use a slice for contiguous indices, so selecting them is a view"""
+    index = np.asarray(index)
+    if index.size > 0 and np.all(np.diff(index) == 1):
+        return slice(int(index[0]), int(index[-1]) + 1)
+    return index
+
+
+def _select(x: torch.Tensor, dim: int, index) -> torch.Tensor:
+    if isinstance(index, slice):
+        return x.narrow(dim, index.start, index.stop - index.start)
+    return x.index_select(dim, index)
+
+
+@dataclasses.dataclass
+class _Gather:
+    diagnostic: Diagnostics
+    channels: Any
+    lat: Any = None
+    lon: Any = None
+    # flattened (lat, lon) indices and weights of the 4 neighbors of the
+    # points of MultiPoint domains, shape (4, npoints)
+    points: Any = None
+    weights: Any = None
+
+    def to(self, device):
+        def move(index):
+            if isinstance(index, np.ndarray):
+                return torch.as_tensor(index, device=device)
+            return index
+
+        return _Gather(
+            self.diagnostic,
+            move(self.channels),
+            move(self.lat),
+            move(self.lon),
+            move(self.points),
+            move(self.weights),
+        )
+
+    def __call__(self, data: torch.Tensor) -> torch.Tensor:
+        x = data
+        if self.points is not None:
+            x = geometry.interpolate_points(x.flatten(2), self.points, self.weights)
+        else:
+            x = _select(_select(x, 2, self.lat), 3, self.lon)
+        return _select(x, 1, self.channels)
+
+
+def _source_indices(regridder, grid: earth2mip.grid.LatLonGrid):
+    """The grid points of ``grid`` picked by ``regridder``, None if it
+    interpolates
+    """
+    if isinstance(regridder, regrid.Identity):
+        return np.arange(len(grid.lat)), np.arange(len(grid.lon))
+    elif isinstance(regridder, regrid.RegridLatLon):
+        return regridder.lat_index, regridder.lon_index
+    return None
+
+
+def _write_when_ready(gathers: List[_Gather], shapes, output, event, *args):
+    if event is not None:
+        event.synchronize()
+    sizes = [math.prod(shape) for shape in shapes]
+    for gather, shape, x in zip(gathers, shapes, torch.split(output, sizes)):
+        gather.diagnostic.update(x.view(shape), *args)
+
+
+class OutputPlan:
+    """Selects the data of every diagnostic from the output of a time loop
+
+    The channel, window and point indices of all diagnostics are computed once.
+    The points of MultiPoint domains are interpolated bilinearly with a single
+    gather. If the regridder only picks grid points, the domains are cropped on
+    the source grid, so only the points of the domains are regridded. Each step, the
+    outputs of all diagnostics written to file are gathered on the device into
+    one tensor and copied to the host in a single transfer.
+
+    Args:
+        total_diagnostics: as returned by :func:`initialize_netcdf`
+        domains: the domains of ``total_diagnostics``
+        grid: the grid of the data passed to :meth:`update`
+        channel_names: the channel names of the data passed to :meth:`update`
+        output_grid: the grid the domains are defined on. Defaults to ``grid``.
+        device: the device of the data passed to :meth:`update`
+    """
+
+    def __init__(
+        self,
+        total_diagnostics: List[List[Diagnostics]],
+        domains: List[Domain],
+        grid: earth2mip.grid.LatLonGrid,
+        channel_names: List[str],
+        output_grid: Optional[earth2mip.grid.LatLonGrid] = None,
+        device: Optional[torch.device] = None,
+    ):
+        assert len(total_diagnostics) == len(domains), (  # noqa
+            total_diagnostics,
+            domains,
+        )
+        output_grid = output_grid or grid
+        regridder = regrid.get_regridder(grid, output_grid)
+        indices = _source_indices(regridder, grid)
+        if indices is None:
+            self._regridder = regridder.to(device)
+            lat_index = np.arange(len(output_grid.lat))
+            lon_index = np.arange(len(output_grid.lon))
+        else:
+            self._regridder = None
+            lat_index, lon_index = indices
+        nlon = len(lon_index) if indices is None else len(grid.lon)
+
+        lat = np.array(output_grid.lat)
+        lon = np.array(output_grid.lon)
+        self._gathers: List[_Gather] = []
+        for domain, domain_diagnostics in zip(domains, total_diagnostics):
+            if domain.type in ["Window", geometry.LAT_AVERAGE, "global"]:
+                lat_sl, lon_sl = geometry.get_bounds_window(domain, lat, lon)
+                selection = {
+                    "lat": _index(lat_index[lat_sl]),
+                    "lon": _index(lon_index[lon_sl]),
+                }
+            elif domain.type == "MultiPoint":
+                i, j, weights = geometry.bilinear_weights(
+                    lat, lon, domain.lat, domain.lon
+                )
+                selection = {
+                    "points": lat_index[i] * nlon + lon_index[j],
+                    "weights": weights,
+                }
+            else:
+                raise ValueError(
+                    f"domain {domain.type} is not supported. Check the "
+                    "weather_events.json"
+                )
+
+            for diagnostic in domain_diagnostics:
+                channels = _index(
+                    [channel_names.index(c) for c in diagnostic.diagnostic.channels]
+                )
+                gather = _Gather(diagnostic, channels, **selection)
+                self._gathers.append(gather.to(device))
+
+    def update(
+        self,
+        data: torch.Tensor,
+        batch_id: int,
+        time_count: int,
+        writer: Optional[AsyncWriter] = None,
+    ):
+        """Pass ``data`` to all the diagnostics
+
+        If ``writer`` is provided, the outputs are copied to the host
+        asynchronously and the writes are deferred to the writer's thread.
+        Diagnostics reducing over the ensemble are updated on the device right
+        away.
+        """
+        if self._regridder is not None:
+            data = self._regridder(data)
+        batch_size = geometry.get_batch_size(data)
+
+        to_write = []
+        outputs = []
+        for gather in self._gathers:
+            output = gather(data)
+            if gather.diagnostic.reduces_ensemble:
+                gather.diagnostic.update(output, time_count, batch_id, batch_size)
+            else:
+                to_write.append(gather)
+                outputs.append(output)
+
+        if not to_write:
+            return
+
+        # cat always copies, so the model may reuse ``data`` while the copy is
+        # waiting to be written
+        output = torch.cat([x.reshape(-1) for x in outputs])
+        output, event = to_host_async(output)
+        shapes = [x.shape for x in outputs]
+        args = (to_write, shapes, output, event, time_count, batch_id, batch_size)
+        if writer is None:
+            _write_when_ready(*args)
+        else:
+            writer.submit(_write_when_ready, *args)
+
+
 def update_netcdf(
     data: torch.Tensor,
     total_diagnostics: List[List[Diagnostics]],
@@ -138,20 +453,35 @@ def update_netcdf(
     time_count,
     grid: earth2mip.grid.LatLonGrid,
     channel_names_of_data: List[str],
+    writer: Optional[AsyncWriter] = None,
 ):
-    assert len(total_diagnostics) == len(domains), (total_diagnostics, domains)  # noqa
-    lat = np.array(grid.lat)
-    lon = np.array(grid.lon)
+    """Write ``data`` to all the diagnostics
 
-    batch_size = geometry.get_batch_size(data)
-    for d_index, domain in enumerate(domains):
-        lat, lon, regional_data = geometry.select_space(data, lat, lon, domain)
+    This compiles an :class:`OutputPlan` on every call. Build the plan once
+    when writing many steps.
+    """
+    plan = OutputPlan(
+        total_diagnostics,
+        domains,
+        grid,
+        channel_names_of_data,
+        device=data.device,
+    )
+    plan.update(data, batch_id, time_count, writer=writer)
+
+
+def finalize_netcdf(
+    total_diagnostics: List[List[Diagnostics]], writer: Optional[AsyncWriter] = None
+):
+    """Write the statistics of the diagnostics reducing over the ensemble
 
-        domain_diagnostics = total_diagnostics[d_index]
+    Call once after all the ensemble members have been passed to
+    :func:`update_netcdf`.
+    """
+    for domain_diagnostics in total_diagnostics:
         for diagnostic in domain_diagnostics:
-            index = [
-                channel_names_of_data.index(c) for c in diagnostic.diagnostic.channels
-            ]
-            output = data[:, index]
-            diagnostic.update(output, time_count, batch_id, batch_size)
-    return
\ No newline at end of file
+            diagnostic.reduce()
+            if writer is None:
+                diagnostic.finalize()
+            else:
+                writer.submit(diagnostic.finalize)
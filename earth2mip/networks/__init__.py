@@ -14,26 +14,30 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import copy
 import datetime
+import logging
 import sys
 import urllib
 import warnings
-from typing import Any, Callable, Iterator, Optional, Tuple
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
 
 import numpy as np
 import torch
-from modulus.utils.zenith_angle import cos_zenith_angle
 
 import earth2mip.grid
 from earth2mip import (
     ModelRegistry,
+    config,
     loaders,
     model_registry,
     registry,
     schema,
     time_loop,
 )
+from earth2mip.forcing import SolarForcing
 from earth2mip.loaders import LoaderProtocol
+from earth2mip.model_cache import ModelCache, model_nbytes, module_nbytes
 
 if sys.version_info < (3, 10):
     from importlib_metadata import EntryPoint, entry_points
@@ -41,7 +45,12 @@ else:
     from importlib.metadata import EntryPoint, entry_points
 
 
-__all__ = ["get_model"]
+__all__ = ["get_model", "model_cache"]
+
+logger = logging.getLogger(__name__)
+
+# the models loaded by get_model, see earth2mip.model_cache
+model_cache = ModelCache(config.MODEL_CACHE_BYTES)
 
 
 def depends_on_time(f):
@@ -83,14 +92,22 @@ class CosZenWrapper(torch.nn.Module):
         self.model = model
         self.lon = lon
         self.lat = lat
+        self.solar = SolarForcing(lat, lon)
 
     def forward(self, x, time):
-        lon_grid, lat_grid = np.meshgrid(self.lon, self.lat)
-        cosz = cos_zenith_angle(time, lon_grid, lat_grid)
-        cosz = cosz.astype(np.float32)
-        z = torch.from_numpy(cosz).to(device=x.device)
+        """
+        Args:
+            x: (batch, channel, lat, lon)
+            time: a datetime or one datetime per sample
+        """
+        if time_loop.is_per_sample(time):
+            times = time_loop.batch_times(time, x.shape[0])
+        else:
+            times = [time]
+        z = self.solar.cos_zenith(times).to(x.device)
         # assume no history
-        x = torch.cat([x, z[None, None]], dim=1)
+        z = z[:, None].expand(x.shape[0], -1, -1, -1)
+        x = torch.cat([x, z.to(x.dtype)], dim=1)
         return self.model(x)
 
 
@@ -118,6 +135,38 @@ class _SimpleModelAdapter(torch.nn.Module):
         return y
 
 
+class _CompiledStep:
+    """``step`` compiled with ``torch.compile``
+
+    Compiling happens on the first call. If it fails, or a later call of the
+    compiled function raises, ``step`` runs eagerly from then on.
+
+    With ``cuda_graphs`` the compiled step is captured in a CUDA graph
+    ("reduce-overhead" mode). The graph reuses its output memory on every
+    replay, so the outputs are copied before they are returned.
+    """
+
+    def __init__(self, step: Callable, cuda_graphs: bool = False):
+        self.step = step
+        self.cuda_graphs = cuda_graphs
+        self.failed = False
+        mode = "reduce-overhead" if cuda_graphs else "default"
+        self.compiled = torch.compile(step, mode=mode, dynamic=False)
+
+    def __call__(self, x: torch.Tensor):
+        if self.failed:
+            return self.step(x)
+        try:
+            if self.cuda_graphs:
+                torch.compiler.cudagraph_mark_step_begin()
+                return tuple(y if y is None else y.clone() for y in self.compiled(x))
+            return self.compiled(x)
+        except Exception as e:
+            logger.warning(f"Compiled time step failed, running eagerly: {e}")
+            self.failed = True
+            return self.step(x)
+
+
 class Inference(torch.nn.Module, time_loop.TimeLoop):
     def __init__(
         self,
@@ -129,13 +178,14 @@ class Inference(torch.nn.Module, time_loop.TimeLoop):
         n_history: int = 0,
         time_step=datetime.timedelta(hours=6),
         channel_names=None,
+        precision: Optional[schema.PrecisionPolicy] = None,
     ):
         """
         Args:
             model: a model, with signature model(x, time) or model(x). With n_history == 0, x is a
                 torch tensor with shape (batch, nchannel, lat, lon). With
                 n_history > 0 x has the shape (batch, nchannel, lat, lon).
-                `time` is a datetime object, which is passed if model.forward has time as an argument.
+                `time` is a datetime object, or a list of one datetime per sample, which is passed if model.forward has time as an argument.
             center: a 1d numpy array with shape (n_channels in data) containing
                 the means. The shape is NOT `len(channels)`.
             scale: a 1d numpy array with shape (n_channels in data) containing
@@ -146,6 +196,7 @@ class Inference(torch.nn.Module, time_loop.TimeLoop):
             channel_names: The names of the prognostic channels.
             n_history: whether `model` was trained with history.
             time_step: the time-step `model` was trained with.
+            precision: the precision policy, see ``set_precision``. None = float32.
 
         """  # noqa
         super().__init__()
@@ -178,6 +229,62 @@ class Inference(torch.nn.Module, time_loop.TimeLoop):
         self.register_buffer("scale", scale[:, None, None])
         self.register_buffer("center", center[:, None, None])
 
+        self.compile_steps = False
+        self.cuda_graphs = False
+        self._compiled_steps: Dict[Tuple, _CompiledStep] = {}
+        self.output_frequency = 1
+        self.set_precision(precision or schema.PrecisionPolicy())
+
+    def set_precision(self, precision: schema.PrecisionPolicy):
+        """Set the precision of the model call and of the state between steps
+
+        The model is run under ``torch.autocast`` with ``precision.autocast``.
+        Normalization, the source term and the outputs stay in float32, while
+        the normalized state is stored in ``precision.state``.
+        """
+        self.precision = precision
+        self.autocast_dtype = getattr(torch, precision.autocast.value)
+        self.state_dtype = getattr(torch, precision.state.value)
+        self._compiled_steps.clear()
+
+    def enable_compile(self, cuda_graphs: bool = False):
+        """Run the time steps through ``torch.compile``
+
+        The compiled step covers the model and the unnormalization of its
+        output. It is compiled once for every (batch size, dtype, device) the
+        loop is called with. Models that depend on ``time`` run eagerly.
+
+        Args:
+            cuda_graphs: capture the compiled step in a CUDA graph. Ignored on
+                the CPU.
+        """
+        self.compile_steps = True
+        self.cuda_graphs = cuda_graphs
+        self._compiled_steps.clear()
+
+    def __copy__(self) -> "Inference":
+        # copies share the model, but not the compiled steps, which depend on
+        # the precision and compile settings of each copy
+        inference = self.__class__.__new__(self.__class__)
+        inference.__dict__.update(self.__dict__)
+        inference._compiled_steps = {}
+        return inference
+
+    def with_output_frequency(self, output_frequency: int) -> "Inference":
+        """A copy of this loop which only unnormalizes the output every
+        ``output_frequency`` steps
+
+        The output of the other steps is None. The copy shares the model with
+        this loop.
+        """
+        if output_frequency < 1:
+            raise ValueError(
+                f"output_frequency must be at least 1. Got {output_frequency}."
+            )
+        inference = copy.copy(self)
+        inference.output_frequency = output_frequency
+        return inference
+
     @property
     def n_history_levels(self) -> int:
         """The expected size of the second dimension"""
@@ -187,41 +294,95 @@ class Inference(torch.nn.Module, time_loop.TimeLoop):
     def device(self) -> torch.device:
         return self.scale.device
 
+    @property
+    def nbytes(self) -> Optional[int]:
+        """The memory of the model, or None if it is unknown"""
+        nbytes = module_nbytes(self)
+        model = self.model.model
+        if not isinstance(model, torch.nn.Module):
+            # e.g. an onnx model, whose weights are not buffers of this module
+            model_bytes = model_nbytes(model)
+            if model_bytes is None:
+                return None
+            nbytes += model_bytes
+        return nbytes
+
     def __call__(
         self,
-        time: datetime.datetime,
+        time: time_loop.TimeT,
         x: torch.Tensor,
         restart: Optional[Any] = None,
         normalize=True,
-    ) -> Iterator[Tuple[datetime.datetime, torch.Tensor, Any]]:
+    ) -> Iterator[Tuple[time_loop.TimeT, torch.Tensor, Any]]:
         """
         Args:
             x: an initial condition. has shape (B, n_history_levels,
                 len(in_channel_names), Y, X).  (Y, X) should be consistent with
                 ``grid``.
-            time: the datetime to start with
+            time: the datetime to start with, or one datetime per sample
             restart: if provided this restart information (typically some torch
                 Tensor) can be used to restart the time loop
 
         Yields:
             (time, output, restart) tuples. ``output`` is a tensor with
                 shape (B, len(out_channel_names), Y, X) which will be used for
-                diagnostics. Restart data should encode the state of the time
-                loop.
+                diagnostics, or None on steps that are not a multiple of
+                ``output_frequency``. Restart data should encode the state of
+                the time loop.
         """
         if restart:
             yield from self._iterate(**restart)
         else:
             yield from self._iterate(x=x, time=time)
 
-    def _iterate(self, x, normalize=True, time=None):
+    def _advance(self, x, time):
+        with torch.autocast(
+            x.device.type,
+            dtype=self.autocast_dtype,
+            enabled=self.autocast_dtype != torch.float32,
+        ):
+            y = self.model(x.float(), time)
+        return y.float()
+
+    def _step(self, x, time=None):
+        y = self._advance(x, time)
+        return y.to(self.state_dtype), self.scale * y[:, -1] + self.center
+
+    def _step_without_output(self, x, time=None):
+        return self._advance(x, time).to(self.state_dtype), None
+
+    def _get_step(self, x: torch.Tensor, output: bool = True) -> Callable:
+        step = self._step if output else self._step_without_output
+        if not self.compile_steps:
+            return step
+        if self.time_dependent:
+            # the time would be baked into the compiled graph
+            logger.warning("Time dependent models are not compiled.")
+            self.compile_steps = False
+            return step
+
+        key = (x.shape[0], x.dtype, x.device, output)
+        if key not in self._compiled_steps:
+            cuda_graphs = self.cuda_graphs and x.device.type == "cuda"
+            self._compiled_steps[key] = _CompiledStep(step, cuda_graphs)
+        compiled = self._compiled_steps[key]
+        return lambda x, time: compiled(x)
+
+    def _iterate(self, x, normalize=True, time=None, step=0):
         """Yield (time, unnormalized data, restart) tuples
 
         restart = (time, unnormalized data)
+
+        ``step`` is the number of steps taken before ``x``, so that restarted
+        loops yield outputs on the same steps.
         """
-        if self.time_dependent and not time:
+        time = time_loop.as_time(time)
+        if self.time_dependent and time is None:
             raise ValueError("Time dependent models require ``time``.")
-        time = time or datetime.datetime(1900, 1, 1)
+        if time is None:
+            time = datetime.datetime(1900, 1, 1)
+        # raises if the number of times does not match the batch
+        time_loop.batch_times(time, x.shape[0])
         with torch.no_grad():
             # drop all but the last time point
             # remove channels
@@ -233,20 +394,33 @@ class Inference(torch.nn.Module, time_loop.TimeLoop):
                 x = (x - self.center) / self.scale
 
             # yield initial time for convenience
-            restart = dict(x=x, normalize=False, time=time)
-            yield time, self.scale * x[:, -1] + self.center, restart
+            k = step
+            out = None
+            if k % self.output_frequency == 0:
+                out = self.scale * x[:, -1] + self.center
+            x = x.to(self.state_dtype)
+            restart = dict(x=x, normalize=False, time=time, step=k)
+            yield time, out, restart
 
+            step_with_output = self._get_step(x)
+            if self.output_frequency > 1:
+                step_without_output = self._get_step(x, output=False)
             while True:
                 if self.source:
-                    x_with_units = x * self.scale + self.center
+                    # the source term is added in float32
+                    x_with_units = x.float() * self.scale + self.center
                     dt = torch.tensor(self.time_step.total_seconds())
-                    x += self.source(x_with_units, time) / self.scale * dt
-                x = self.model(x, time)
-                time = time + self.time_step
+                    dx = self.source(x_with_units, time) / self.scale * dt
+                    x = (x.float() + dx).to(self.state_dtype)
+                k += 1
+                if k % self.output_frequency == 0:
+                    x, out = step_with_output(x, time)
+                else:
+                    x, out = step_without_output(x, time)
+                time = time_loop.add_time(time, self.time_step)
 
                 # create args and kwargs for future use
-                restart = dict(x=x, normalize=False, time=time)
-                out = self.scale * x[:, -1] + self.center
+                restart = dict(x=x, normalize=False, time=time, step=k)
                 yield time, out, restart
 
 
@@ -274,6 +448,7 @@ def _default_inference(package, metadata: schema.Model, device):
         grid=earth2mip.grid.from_enum(metadata.grid),
         n_history=metadata.n_history,
         time_step=metadata.time_step,
+        precision=metadata.precision,
     )
     inference.to(device)
     return inference
@@ -314,6 +489,7 @@ def get_model(
     registry: ModelRegistry = registry,
     device="cpu",
     metadata: Optional[schema.Model] = None,
+    cache: bool = True,
 ) -> time_loop.TimeLoop:
     """
     Function to construct an inference model and load the appropriate
@@ -330,6 +506,9 @@ def get_model(
         By default this will be loaded from the file ``metadata.json`` in the
         model package.
     device: the device to load on, by default the 'cpu'
+    cache: if True, return the instance in ``model_cache`` if this model was
+        loaded before in this process, and add it to ``model_cache`` otherwise.
+        Cached instances are shared by all callers.
 
 
     Returns
@@ -338,6 +517,17 @@ def get_model(
 
 
     """
+    if cache:
+        key = (
+            model,
+            getattr(registry, "path", None),
+            str(torch.device(device)),
+            None if metadata is None else metadata.json(),
+        )
+        return model_cache.get(
+            key, lambda: get_model(model, registry, device, metadata, cache=False)
+        )
+
     url = urllib.parse.urlparse(model)
 
     if url.scheme == "e2mip":
@@ -16,21 +16,71 @@
 
 import datetime
 import logging
+import os
+import tempfile
 
 import modulus
 import numpy as np
 import torch
 import xarray
 from modulus.utils.filesystem import Package
-from modulus.utils.zenith_angle import cos_zenith_angle
 
 import earth2mip.grid
+from earth2mip import time_loop
+from earth2mip.forcing import SolarForcing
 
 logger = logging.getLogger(__file__)
 
 CHANNELS = ["t850", "z1000", "z700", "z500", "z300", "tcwv", "t2m"]
 
 
+def _read_remap(path: str) -> torch.Tensor:
+    """Read a SCRIP/ESMF map file as a (n_b, n_a) CSR matrix"""
+    with xarray.open_dataset(path) as ds:
+        i = ds.row.values - 1
+        j = ds.col.values - 1
+        data = ds.S.values
+        if "n_a" in ds.sizes and "n_b" in ds.sizes:
+            size = (ds.sizes["n_b"], ds.sizes["n_a"])
+        else:
+            size = (i.max() + 1, j.max() + 1)
+    M = torch.sparse_coo_tensor(np.array((i, j)), data, size=size)
+    return M.float().coalesce().to_sparse_csr()
+
+
+def _load_remap(path: str, cache: bool = True) -> torch.Tensor:
+    """Load the map file at ``path`` as a CSR matrix
+
+    With ``cache``, the matrix is stored next to ``path`` on the first call and
+    loaded from there afterwards, which skips decoding the map file.
+    """
+    cache_path = path + ".csr.pt"
+    if cache and os.path.exists(cache_path):
+        crow, col, values, size = torch.load(cache_path)
+        return torch.sparse_csr_tensor(crow, col, values, size=size)
+
+    M = _read_remap(path)
+    if cache:
+        try:
+            # write atomically, other ranks may load the same package
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(cache_path))
+            with os.fdopen(fd, "wb") as f:
+                torch.save(
+                    (M.crow_indices(), M.col_indices(), M.values(), tuple(M.shape)), f
+                )
+            os.replace(tmp, cache_path)
+        except OSError as e:
+            logger.warning(f"Could not cache the remap operator of {path}: {e}")
+    return M
+
+
+def _remap(M: torch.Tensor, x: torch.Tensor) -> torch.Tensor:
+    """Apply M to the last dimension of a 2D tensor"""
+    if M.dtype != x.dtype:
+        M = M.to(x.dtype)
+    return (M @ x.T).T
+
+
 class DLWPInference(torch.nn.Module):
     n_history_levels = 2
     time_step = datetime.timedelta(hours=6)
@@ -100,6 +150,9 @@ class DLWPInference(torch.nn.Module):
             raise NotImplementedError("Restart capability not implemented.")
         # do not implement restart capability
         restart_data = None
+        time = time_loop.as_time(time)
+        # raises if the number of times does not match the batch
+        time_loop.batch_times(time, x.shape[0])
 
         with torch.no_grad():
             x0 = x[:, 1].clone()
@@ -109,11 +162,11 @@ class DLWPInference(torch.nn.Module):
                 # Forward pass DLWP
                 x0 = self.model(self.normalize(x), time)
                 x0 = self.unnormalize(x0)
-                time += datetime.timedelta(hours=6)
+                time = time_loop.add_time(time, datetime.timedelta(hours=6))
                 out = x0[:, 0]
                 yield time, out, restart_data
 
-                time += datetime.timedelta(hours=6)
+                time = time_loop.add_time(time, datetime.timedelta(hours=6))
                 out = x0[:, 1]
                 yield time, out, restart_data
 
@@ -132,17 +185,29 @@ class _DLWPWrapper(torch.nn.Module):
         topographic_height,
         ll_to_cs_mapfile_path,
         cs_to_ll_mapfile_path,
+        ll_shape=(721, 1440),
+        cache_remap: bool = True,
     ):
         super(_DLWPWrapper, self).__init__()
         self.model = model
-        self.lsm = lsm
         self.longrid = longrid
         self.latgrid = latgrid
-        self.topographic_height = topographic_height
-
-        # load map weights
-        self.input_map_wts = xarray.open_dataset(ll_to_cs_mapfile_path)
-        self.output_map_wts = xarray.open_dataset(cs_to_ll_mapfile_path)
+        self.ll_shape = tuple(ll_shape)
+        self.solar = SolarForcing(latgrid, longrid)
+
+        # the remap operators and static fields are buffers so they are moved
+        # to the device of the model once
+        input_map = _load_remap(ll_to_cs_mapfile_path, cache=cache_remap)
+        output_map = _load_remap(cs_to_ll_mapfile_path, cache=cache_remap)
+        self.register_buffer("input_map", input_map, persistent=False)
+        self.register_buffer("output_map", output_map, persistent=False)
+
+        topographic_height = (topographic_height - 3.724e03) / 8.349e03
+        static = [lsm, topographic_height]
+        static = np.concatenate([v.reshape(-1, *latgrid.shape) for v in static])[None]
+        self.register_buffer(
+            "static", torch.tensor(static, dtype=torch.float), persistent=False
+        )
 
     @property
     def channel_names(self):
@@ -152,37 +217,24 @@ class _DLWPWrapper(torch.nn.Module):
         device = input.device
         dtype = input.dtype
 
-        i = self.input_map_wts.row.values - 1
-        j = self.input_map_wts.col.values - 1
-        data = self.input_map_wts.S.values
-        M = torch.sparse_coo_tensor(np.array((i, j)), data).type(dtype).to(device)
-
         bs, t, chan = input.shape[0], input.shape[1], input.shape[2]
-        input = input.reshape(bs * t * chan, -1) @ M.T
-        input = input.reshape(bs, t, chan, 6, 64, 64)
+        input = _remap(self.input_map, input.reshape(bs * t * chan, -1))
+        input = input.reshape(bs, t, chan, *self.latgrid.shape)
         input_list = list(torch.split(input, 1, dim=1))
         input_list = [tensor.squeeze(1) for tensor in input_list]
         repeat_vals = (input.shape[0], -1, -1, -1, -1)  # repeat along batch dimension
+        if time_loop.is_per_sample(time):
+            times = time_loop.batch_times(time, bs)
+        else:
+            times = [time]
         for i in range(len(input_list)):
-            tisr = np.maximum(
-                cos_zenith_angle(
-                    time
-                    - datetime.timedelta(hours=6 * (t - 1))
-                    + datetime.timedelta(hours=6 * i),
-                    self.longrid,
-                    self.latgrid,
-                ),
-                0,
-            ) - (
-                1 / np.pi
-            )  # subtract mean value
-            tisr = (
-                torch.tensor(tisr, dtype=dtype)
-                .to(device)
-                .unsqueeze(dim=0)
-                .unsqueeze(dim=0)
-            )  # add channel and batch size dimension
-            tisr = tisr.expand(*repeat_vals)  # TODO - find better way to batch TISR
+            offset = datetime.timedelta(hours=6 * i) - datetime.timedelta(
+                hours=6 * (t - 1)
+            )
+            cosz = self.solar.cos_zenith([time + offset for time in times])
+            tisr = torch.clamp(cosz, min=0) - (1 / np.pi)  # subtract mean value
+            tisr = tisr.to(device, dtype).unsqueeze(dim=1)  # add channel dimension
+            tisr = tisr.expand(*repeat_vals)  # one time for the whole batch
             input_list[i] = torch.cat(
                 (input_list[i], tisr), dim=1
             )  # concat along channel dim
@@ -191,32 +243,16 @@ class _DLWPWrapper(torch.nn.Module):
             input_list, dim=1
         )  # concat the time dimension into channels
 
-        lsm_tensor = torch.tensor(self.lsm, dtype=dtype).to(device).unsqueeze(dim=0)
-        lsm_tensor = lsm_tensor.expand(*repeat_vals)
-        topographic_height_tensor = (
-            torch.tensor((self.topographic_height - 3.724e03) / 8.349e03, dtype=dtype)
-            .to(device)
-            .unsqueeze(dim=0)
-        )
-        topographic_height_tensor = topographic_height_tensor.expand(*repeat_vals)
-
-        input_model = torch.cat(
-            (input_model, lsm_tensor, topographic_height_tensor), dim=1
-        )
+        static = self.static.to(dtype).expand(*repeat_vals)
+        input_model = torch.cat((input_model, static), dim=1)
         return input_model
 
     def prepare_output(self, output):
-        device = output.device
-        dtype = output.dtype
         output = torch.split(output, output.shape[1] // 2, dim=1)
         output = torch.stack(output, dim=1)  # add time dimension back in
-        i = self.output_map_wts.row.values - 1
-        j = self.output_map_wts.col.values - 1
-        data = self.output_map_wts.S.values
-        M = torch.sparse_coo_tensor(np.array((i, j)), data).type(dtype).to(device)
-
-        output = output.reshape(output.shape[0], 2, output.shape[2], -1) @ M.T
-        output = output.reshape(output.shape[0], 2, output.shape[2], 721, 1440)
+        bs, t, chan = output.shape[0], output.shape[1], output.shape[2]
+        output = _remap(self.output_map, output.reshape(bs * t * chan, -1))
+        output = output.reshape(bs, t, chan, *self.ll_shape)
 
         return output
 
@@ -226,7 +262,13 @@ class _DLWPWrapper(torch.nn.Module):
         return self.prepare_output(y)
 
 
-def load(package: Package, *, pretrained=True, device="cuda"):
+def load(package: Package, *, pretrained=True, device="cuda", cache_remap=True):
+    """Load DLWP
+
+    Args:
+        cache_remap: store the cubed sphere remap operators next to their map
+            files, so later loads skip decoding them
+    """
     assert pretrained  # noqa
 
     # load static datasets
@@ -251,6 +293,7 @@ def load(package: Package, *, pretrained=True, device="cuda"):
             topographic_height,
             ll_to_cs_mapfile_path,
             cs_to_ll_mapfile_path,
+            cache_remap=cache_remap,
         )
 
         center = np.load(package.get("global_means.npy"))
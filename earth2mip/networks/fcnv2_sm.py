@@ -24,13 +24,12 @@ import logging
 import pathlib
 
 import numpy as np
-import torch
 
 import earth2mip.grid
 
 # TODO: Update to new arch in Modulus!
 import earth2mip.networks.fcnv2 as fcnv2
-from earth2mip import networks
+from earth2mip import checkpoint, networks
 
 logger = logging.getLogger(__file__)
 
@@ -111,31 +110,6 @@ CHANNELS = [
 ]
 
 
-def _fix_state_dict_keys(state_dict, add_module=False):
-    """Add or remove 'module.' from state_dict keys
-
-    Parameters
-    ----------
-    state_dict : Dict
-        Model state_dict
-    add_module : bool, optional
-        If True, will add 'module.' to keys, by default False
-
-    Returns
-    -------
-    Dict
-        Model state_dict with fixed keys
-    """
-    fixed_state_dict = {}
-    for key, value in state_dict.items():
-        if add_module:
-            new_key = "module." + key
-        else:
-            new_key = key.replace("module.", "")
-        fixed_state_dict[new_key] = value
-    return fixed_state_dict
-
-
 def load(package, *, pretrained=True, device="cuda"):
     assert pretrained  # noqa
 
@@ -151,10 +125,10 @@ def load(package, *, pretrained=True, device="cuda"):
     local_center = np.load(package.get("global_means.npy"))
     local_std = np.load(package.get("global_stds.npy"))
 
-    weights_path = package.get("weights.tar")
-    weights = torch.load(weights_path, map_location=device)
-    fixed_weights = _fix_state_dict_keys(weights["model_state"], add_module=False)
-    core_model.load_state_dict(fixed_weights)
+    weights = checkpoint.load_package_state_dict(
+        package, "weights.tar", key="model_state", strip_prefix="module."
+    )
+    checkpoint.load_module(core_model, weights)
 
     grid = earth2mip.grid.equiangular_lat_lon_grid(721, 1440)
     dt = datetime.timedelta(hours=6)
@@ -16,6 +16,8 @@
 # TODO add license text from graphcast
 import dataclasses
 import functools
+import hashlib
+import json
 import os
 
 from earth2mip.time_loop import TimeStepperLoop
@@ -25,6 +27,7 @@ __all__ = ["load_time_loop", "load_time_loop_operational", "load_time_loop_small
 
 import datetime
 import warnings
+from typing import Optional
 
 import haiku as hk
 import jax
@@ -48,7 +51,8 @@ from graphcast.rollout import _get_next_inputs
 from modulus.utils import zenith_angle
 
 import earth2mip.grid
-from earth2mip import time_loop
+from earth2mip import config, time_loop
+from earth2mip.forcing import SolarForcing
 from earth2mip.initial_conditions import cds
 
 # see ecwmf parameter table https://codes.ecmwf.int/grib/param-db/?&filter=grib1&table=128 # noqa
@@ -80,8 +84,60 @@ def torch_to_jax(x):
     return jax.dlpack.from_dlpack(torch.utils.dlpack.to_dlpack(x.contiguous()))
 
 
+def _default_cache_dir() -> str:
+    return os.path.join(config.LOCAL_CACHE, "graphcast")
+
+
+def graph_cache_key(
+    model_config: graphcast.ModelConfig,
+    task_config: graphcast.TaskConfig,
+    lat: np.ndarray,
+    lon: np.ndarray,
+) -> str:
+    """A hash of everything the graph structures of GraphCast depend on"""
+    h = hashlib.sha256()
+    configs = [dataclasses.asdict(model_config), dataclasses.asdict(task_config)]
+    h.update(json.dumps(configs, sort_keys=True, default=str).encode())
+    for coord in (lat, lon):
+        h.update(np.ascontiguousarray(coord, dtype=np.float64).tobytes())
+    return h.hexdigest()
+
+
+def _enable_compilation_cache(path: str):
+    """Cache the compiled jax functions in ``path``, unless the jax
+    compilation cache is configured already"""
+    if jax.config.jax_compilation_cache_dir:
+        return
+    os.makedirs(path, exist_ok=True)
+    jax.config.update("jax_compilation_cache_dir", path)
+
+
 class CachedGraphcast(graphcast.GraphCast):
-    """GraphCast with cached graph structures"""
+    """GraphCast with cached graph structures
+
+    The graph structures are saved in ``cache_dir``, under a key of the
+    configs and the grid (see :func:`graph_cache_key`).
+    """
+
+    def __init__(
+        self,
+        model_config: graphcast.ModelConfig,
+        task_config: graphcast.TaskConfig,
+        cache_dir: Optional[str] = None,
+    ):
+        super().__init__(model_config, task_config)
+        self._model_config = model_config
+        self._task_config = task_config
+        self._cache_dir = cache_dir or _default_cache_dir()
+
+    def _cache_path(self, sample_inputs) -> str:
+        key = graph_cache_key(
+            self._model_config,
+            self._task_config,
+            sample_inputs.lat.values,
+            sample_inputs.lon.values,
+        )
+        return os.path.join(self._cache_dir, f"graph-{key}.pkl")
 
     def _maybe_init(self, sample_inputs):
         if self._initialized:
@@ -92,26 +148,31 @@ class CachedGraphcast(graphcast.GraphCast):
                 grid_lat=sample_inputs.lat, grid_lon=sample_inputs.lon
             )
 
-            if os.path.exists(".cache.pkl"):
-                print("Loading cached graph structures from .cache.pkl")
+            path = self._cache_path(sample_inputs)
+            if os.path.exists(path):
+                print(f"Loading cached graph structures from {path}")
                 (
                     self._mesh2grid_graph_structure,
                     self._mesh_graph_structure,
                     self._grid2mesh_graph_structure,
-                ) = joblib.load(".cache.pkl")
+                ) = joblib.load(path)
             else:
                 self._grid2mesh_graph_structure = self._init_grid2mesh_graph()
                 self._mesh_graph_structure = self._init_mesh_graph()
                 self._mesh2grid_graph_structure = self._init_mesh2grid_graph()
-                print("Saving graph structures to .cache.pkl")
+                print(f"Saving graph structures to {path}")
+                os.makedirs(self._cache_dir, exist_ok=True)
+                # write atomically, other processes may be loading the cache
+                tmp = f"{path}.{os.getpid()}.tmp"
                 joblib.dump(
                     [
                         self._mesh2grid_graph_structure,
                         self._mesh_graph_structure,
                         self._grid2mesh_graph_structure,
                     ],
-                    ".cache.pkl",
+                    tmp,
                 )
+                os.replace(tmp, path)
             self._initialized = True
 
 
@@ -176,12 +237,14 @@ def _get_tisr(seconds_since_epoch, lat, lon):
     return xarray_jax.Variable(["batch", "time", "lat", "lon"], tisr)
 
 
-def get_forcings(time, lat, lon):
+def get_forcings(time, lat, lon, solar: Optional[SolarForcing] = None):
     """
     Args:
         time: (batch, time) shaped array
         lat: (lat,) shaped array
         lon: (lon,) shaped array
+        solar: if provided, compute the TISR with it on its torch device rather
+            than with ``lat`` and ``lon``
     Returns:
         forcings: Dataset, maximum dims are (batch, time, lat, lon)
 
@@ -210,7 +273,13 @@ def get_forcings(time, lat, lon):
         )
         seconds_since_epoch = jax.device_put(seconds_since_epoch, device=lat.device())
 
-    forcings["toa_incident_solar_radiation"] = _get_tisr(seconds_since_epoch, lat, lon)
+    if solar is None:
+        tisr = _get_tisr(seconds_since_epoch, lat, lon)
+    else:
+        tisr = solar.tisr(time.astype("datetime64[ns]"))
+        tisr = torch_to_jax(tisr) if isinstance(lat, jax.Array) else tisr.cpu().numpy()
+        tisr = xarray_jax.Variable(["batch", "time", "lat", "lon"], tisr)
+    forcings["toa_incident_solar_radiation"] = tisr
 
     return forcings
 
@@ -220,6 +289,17 @@ def torch_device_to_jax(device: torch.device) -> jax.Device:
     return torch_to_jax(x).device()
 
 
+def _forcing_times(time, offsets):
+    """The (batch, time) array of the times ``offsets`` after ``time``
+
+    ``time`` is a single timestamp, broadcast over the batch, or a (batch,)
+    datetime64 array of per-sample times.
+    """
+    if isinstance(time, np.ndarray):
+        return time[:, None] + offsets[None]
+    return (time + offsets)[None]
+
+
 class GraphcastStepper(time_loop.TimeStepper):
     """
 
@@ -348,8 +428,15 @@ class GraphcastStepper(time_loop.TimeStepper):
         eval_forcings,
         task_config,
         device=None,
+        nbytes: Optional[int] = None,
     ):
+        """
+        Args:
+            nbytes: the memory of the parameters, reported to
+                :mod:`earth2mip.model_cache`
+        """
         self.run_forward = run_forward
+        self.nbytes = nbytes
         self.eval_inputs = eval_inputs
         self.eval_targets = eval_targets
         self.eval_forcings = eval_forcings
@@ -365,6 +452,7 @@ class GraphcastStepper(time_loop.TimeStepper):
         self._jax_device = torch_device_to_jax(self._device)
         self.lat = jax.device_put(lat, device=self._jax_device)
         self.lon = jax.device_put(lon, device=self._jax_device)
+        self._solar = SolarForcing(lat, lon).to(self._device)
 
     @property
     def input_info(self) -> time_loop.GeoTensorInfo:
@@ -401,9 +489,13 @@ class GraphcastStepper(time_loop.TimeStepper):
         data = xarray_jax.unwrap_data(inputs[first_input])
         assert data.device() == self._jax_device
 
-    def initialize(self, x: torch.Tensor, time: datetime.datetime):
+    def initialize(self, x: torch.Tensor, time: time_loop.TimeT):
         x_jax = torch_to_jax(x)
-        time = pd.Timestamp(time)
+        if time_loop.is_per_sample(time):
+            time = time_loop.batch_times(time, x.shape[0])
+            time = np.array(time, dtype="datetime64[ns]")
+        else:
+            time = pd.Timestamp(time)
         dt = pd.Timedelta(self.time_step)
         inputs = self._get_inputs(x_jax, time, dt)
         self._assert_inputs_are_on_the_correct_device(inputs)
@@ -427,10 +519,8 @@ class GraphcastStepper(time_loop.TimeStepper):
         target_template = self.eval_targets.isel(time=slice(0, 1))
 
         # get forcings
-        forcing_time = time + forcings_template.time.values
-        # add batch dim
-        forcing_time = forcing_time[None]
-        forcings = get_forcings(forcing_time, self.lat, self.lon)
+        forcing_time = _forcing_times(time, forcings_template.time.values)
+        forcings = get_forcings(forcing_time, self.lat, self.lon, solar=self._solar)
         forcings = forcings.assign_coords(
             time=self.eval_forcings.time.isel(time=slice(0, 1))
         )
@@ -500,7 +590,8 @@ class GraphcastStepper(time_loop.TimeStepper):
             x: (batch, time, channel, lat, lon) shaped array
                 packed along the channel dimension. The order is 3d variables,
                 then surface.
-            time: the time of x[:, -1] (np.timedelta64)
+            time: the time of x[:, -1] (pd.Timestamp), or a (batch,)
+                datetime64 array of per-sample times
             dt: the time difference along the time dimension
         Returns:
             xarray.Dataset like eval_inputs. Forcings are computed from time, lat, lon.
@@ -551,9 +642,10 @@ class GraphcastStepper(time_loop.TimeStepper):
             )
 
         forcings = get_forcings(
-            time + time_offset[None],
+            _forcing_times(time, time_offset),
             self.eval_inputs.lat.values,
             self.eval_inputs.lon.values,
+            solar=self._solar,
         )
         del forcings["year_progress"]
         del forcings["day_progress"]
@@ -567,7 +659,17 @@ def load_stepper(
     dataset_filename: str,
     stats_dir: str,
     device: torch.device = None,
+    cache_dir: Optional[str] = None,
 ):
+    """Load a GraphCast stepper
+
+    Args:
+        cache_dir: where to cache the graph structures and the compiled
+            forward pass. Defaults to ``{LOCAL_CACHE}/graphcast``.
+    """
+    cache_dir = cache_dir or _default_cache_dir()
+    _enable_compilation_cache(os.path.join(cache_dir, "jax"))
+
     # load checkpoint:
     with open(checkpoint_path, "rb") as f:
         ckpt = checkpoint.load(f, graphcast.CheckPoint)
@@ -626,7 +728,7 @@ def load_stepper(
     ):
         """Constructs and wraps the GraphCast Predictor."""
         # Deeper one-step predictor.
-        predictor = CachedGraphcast(model_config, task_config)
+        predictor = CachedGraphcast(model_config, task_config, cache_dir=cache_dir)
 
         # Modify inputs/outputs to `graphcast.GraphCast` to handle conversion to
         # from/to float32 to/from BFloat16
@@ -675,6 +777,7 @@ def load_stepper(
         eval_forcings,
         task_config,
         device=device,
+        nbytes=sum(x.nbytes for x in jax.tree_util.tree_leaves(params)),
     )
     return stepper
 
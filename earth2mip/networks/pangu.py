@@ -27,20 +27,76 @@ adapted from https://raw.githubusercontent.com/ecmwf-lab/ai-models-panguweather/
 # nor does it submit to any jurisdiction.
 """
 # %%
+import collections
 import datetime
 import logging
 import os
+from typing import Dict, List, Optional, Tuple
 
 import numpy as np
 import onnxruntime as ort
 import torch
 
 import earth2mip.grid
-from earth2mip import networks
+from earth2mip import networks, time_loop
 
 logger = logging.getLogger(__file__)
 
 
+def _default_device() -> torch.device:
+    if torch.cuda.is_available():
+        return torch.device("cuda", torch.cuda.current_device())
+    return torch.device("cpu")
+
+
+def create_session(
+    path: str,
+    device: torch.device,
+    intra_op_num_threads: Optional[int] = None,
+    inter_op_num_threads: Optional[int] = None,
+    memory_arena: Optional[bool] = None,
+) -> ort.InferenceSession:
+    """Create an onnxruntime session running on ``device``
+
+    Args:
+        path: the onnx file
+        device: a cuda device or the cpu
+        intra_op_num_threads: the threads used within an operator. Defaults to
+            1 on cuda and to all cores on the cpu.
+        inter_op_num_threads: the threads used to run operators in parallel.
+            Defaults to the onnxruntime default.
+        memory_arena: whether to use the memory arena and reuse memory between
+            runs. Defaults to False on cuda, where the models are large compared
+            to the device memory, and True on the cpu.
+    """
+    device = torch.device(device)
+    on_cuda = device.type == "cuda"
+    if memory_arena is None:
+        memory_arena = not on_cuda
+    if intra_op_num_threads is None:
+        intra_op_num_threads = 1 if on_cuda else 0
+
+    options = ort.SessionOptions()
+    options.enable_cpu_mem_arena = memory_arena
+    options.enable_mem_pattern = memory_arena
+    options.enable_mem_reuse = memory_arena
+    options.intra_op_num_threads = intra_op_num_threads
+    if inter_op_num_threads is not None:
+        options.inter_op_num_threads = inter_op_num_threads
+
+    if on_cuda:
+        device_id = (
+            torch.cuda.current_device() if device.index is None else device.index
+        )
+        providers = [("CUDAExecutionProvider", {"device_id": device_id})]
+    else:
+        providers = ["CPUExecutionProvider"]
+
+    # raises a FileNotFoundError rather than an onnxruntime error
+    os.stat(path)
+    return ort.InferenceSession(path, sess_options=options, providers=providers)
+
+
 class PanguWeather:
     # Download
     download_url = (
@@ -60,74 +116,188 @@ class PanguWeather:
     expver = "pguw"
     # providers=['CUDAExecutionProvider', 'CPUExecutionProvider']
 
-    def __init__(self, path):
+    def __init__(
+        self,
+        path,
+        device: Optional[torch.device] = None,
+        output_buffers: Optional[Dict[str, torch.Tensor]] = None,
+        **session_kwargs,
+    ):
+        """
+        Args:
+            path: the onnx file
+            device: the device to run on. Defaults to the current cuda device,
+                or the cpu if cuda is not available.
+            output_buffers: the output buffers, which are allocated on the
+                first call and reused by later calls. Models which are run one
+                after the other, like the 6 and 24 hour models, can share them.
+            **session_kwargs: passed to :func:`create_session`
+        """
         self.path = path
-        options = ort.SessionOptions()
-        options.enable_cpu_mem_arena = False
-        options.enable_mem_pattern = False
-        options.enable_mem_reuse = False
-        options.intra_op_num_threads = 1
-
-        # That will trigger a FileNotFoundError
-        self.device_index = torch.cuda.current_device()
-
-        os.stat(self.path)
-        providers = [
-            (
-                "CUDAExecutionProvider",
-                {
-                    "device_id": self.device_index,
-                },
+        self.device = torch.device(device) if device else _default_device()
+        if self.device.type == "cuda" and self.device.index is None:
+            self.device = torch.device("cuda", torch.cuda.current_device())
+        self.ort_session = create_session(path, self.device, **session_kwargs)
+        # the weights are most of the file, and of the memory of the session
+        self.nbytes = os.path.getsize(path)
+        # from https://onnxruntime.ai/docs/api/python/api_summary.html
+        # one binding per set of input and output tensors, so a member is only
+        # bound the first time it runs, and can be bound while another one runs
+        self.bindings = collections.OrderedDict()
+        self.max_bindings = 64
+        self.output_buffers = {} if output_buffers is None else output_buffers
+        # onnx exports with a leading batch dimension run the whole batch at once
+        self.batched = len(self.ort_session.get_inputs()[0].shape) == 5
+        self._run_options = ort.RunOptions()
+        if self.device.type == "cuda":
+            # return before the outputs are ready, see run_batch
+            self._run_options.add_run_config_entry(
+                "disable_synchronize_execution_providers", "1"
             )
-        ]
 
-        self.ort_session = ort.InferenceSession(
-            self.path,
-            sess_options=options,
-            providers=providers,
+    def _bind(self, bind, name, x):
+        bind(
+            name=name,
+            device_type=self.device.type,
+            device_id=self.device.index or 0,
+            element_type=np.float32,
+            shape=tuple(x.shape),
+            buffer_ptr=x.data_ptr(),
         )
 
+    def _buffer(self, name, like):
+        x = self.output_buffers.get(name)
+        if (
+            x is None
+            or x.shape != like.shape
+            or x.device != like.device
+            or x.data_ptr() == like.data_ptr()
+        ):
+            x = torch.empty_like(like, memory_format=torch.contiguous_format)
+            self.output_buffers[name] = x
+        return x
+
+    def _binding(self, fields_pl, fields_sfc, output, output_sfc):
+        """The IO binding of these tensors, bound on first use"""
+        tensors = [fields_pl, fields_sfc, output, output_sfc]
+        # bindings hold pointers, so views of the same memory share one
+        key = tuple((x.data_ptr(), tuple(x.shape)) for x in tensors)
+        binding = self.bindings.get(key)
+        if binding is not None:
+            self.bindings.move_to_end(key)
+            return binding
+
+        binding = self.ort_session.io_binding()
+        self._bind(binding.bind_input, "input", fields_pl)
+        self._bind(binding.bind_input, "input_surface", fields_sfc)
+        self._bind(binding.bind_output, "output", output)
+        self._bind(binding.bind_output, "output_surface", output_sfc)
+        self.bindings[key] = binding
+        if len(self.bindings) > self.max_bindings:
+            self.bindings.popitem(last=False)
+        return binding
+
+    def _launch(self, fields_pl, fields_sfc, output, output_sfc):
+        """Run the model without waiting for the outputs on cuda"""
+        binding = self._binding(fields_pl, fields_sfc, output, output_sfc)
+        self.ort_session.run_with_iobinding(binding, self._run_options)
+        return binding
+
+    def _sync_inputs(self):
+        # onnxruntime runs on its own stream, which does not wait for torch
+        if self.device.type == "cuda":
+            torch.cuda.current_stream(self.device).synchronize()
+
     def __call__(self, fields_pl, fields_sfc):
+        """Run the model
+
+        The outputs are written into the output buffers, so they are only
+        valid until the next call of a model sharing the buffers.
+        """
         assert fields_pl.dtype == torch.float32  # noqa
         assert fields_sfc.dtype == torch.float32  # noqa
-        # from https://onnxruntime.ai/docs/api/python/api_summary.html
-        binding = self.ort_session.io_binding()
+        fields_pl = fields_pl.contiguous()
+        fields_sfc = fields_sfc.contiguous()
+        output = self._buffer("output", like=fields_pl)
+        output_sfc = self._buffer("output_surface", like=fields_sfc)
+        self._sync_inputs()
+        self._launch(fields_pl, fields_sfc, output, output_sfc).synchronize_outputs()
+        return output, output_sfc
 
-        def bind_input(name, x):
-            x = x.contiguous()
+    def run_batch(self, fields_pl, fields_sfc, output, output_sfc):
+        """Run a batch of inputs into ``output`` and ``output_sfc``
 
-            binding.bind_input(
-                name=name,
-                device_type="cuda",
-                device_id=self.device_index,
-                element_type=np.float32,
-                shape=tuple(x.shape),
-                buffer_ptr=x.data_ptr(),
-            )
+        Models without a batch dimension run one member after the other, and
+        on cuda the inputs of the next member are bound while the previous
+        one runs.
 
-        def bind_output(name, like):
-            x = torch.empty_like(like).contiguous()
-            binding.bind_output(
-                name=name,
-                device_type="cuda",
-                device_id=self.device_index,
-                element_type=np.float32,
-                shape=tuple(x.shape),
-                buffer_ptr=x.data_ptr(),
+        Args:
+            fields_pl: (batch, variable, level, lat, lon)
+            fields_sfc: (batch, variable, lat, lon)
+            output: with the shape of ``fields_pl``. Each member should be
+                contiguous, otherwise it is written to a buffer and copied.
+            output_sfc: with the shape of ``fields_sfc``
+        """
+        assert fields_pl.dtype == torch.float32  # noqa
+        assert fields_sfc.dtype == torch.float32  # noqa
+        if self.batched:
+            members = [(fields_pl, fields_sfc, output, output_sfc)]
+        else:
+            members = list(zip(fields_pl, fields_sfc, output, output_sfc))
+
+        copies = []
+
+        def contiguous_input(name, x, k):
+            if x.is_contiguous():
+                return x
+            # copied into a buffer rather than a new tensor, so the binding of
+            # the member is reused by the next call
+            buffer = self._buffer(f"{name}_{k}", x)
+            buffer.copy_(x)
+            return buffer
+
+        def contiguous_output(name, out, k):
+            if out.is_contiguous():
+                return out
+            # one buffer per member, since the members run asynchronously
+            buffer = self._buffer(f"{name}_{k}", out)
+            copies.append((out, buffer))
+            return buffer
+
+        members = [
+            (
+                contiguous_input("input", pl, k),
+                contiguous_input("input_surface", sfc, k),
+                contiguous_output("output", out, k),
+                contiguous_output("output_surface", out_sfc, k),
             )
-            return x
-
-        bind_input("input", fields_pl)
-        bind_input("input_surface", fields_sfc)
-        output = bind_output("output", like=fields_pl)
-        output_sfc = bind_output("output_surface", like=fields_sfc)
-        self.ort_session.run_with_iobinding(binding)
-        return output, output_sfc
+            for k, (pl, sfc, out, out_sfc) in enumerate(members)
+        ]
+        self._sync_inputs()
+        binding = None
+        for member in members:
+            binding = self._launch(*member)
+        if binding is not None:
+            # the members run in order on one stream
+            binding.synchronize_outputs()
+        for out, buffer in copies:
+            out.copy_(buffer)
 
 
 class PanguStacked:
+    """Runs a :class:`PanguWeather` model on stacked (batch, channel, lat, lon)
+    tensors
+
+    The model writes into two buffers, which are used in turn by
+    :meth:`_forward`, so that the next input, usually the previous output,
+    never shares a buffer with the output and the bindings of both are reused.
+    :meth:`forward` returns a copy.
+    """
+
     def __init__(self, model: PanguWeather):
         self.model = model
+        self._outputs: Dict[Tuple, List[torch.Tensor]] = {}
+        self._next_output = 0
 
     def channel_names(self):
         variables, levels = self.model.param_level_pl
@@ -146,23 +316,43 @@ class PanguStacked:
     def to(self):
         pass
 
+    @property
+    def nbytes(self) -> int:
+        return self.model.nbytes
+
     def forward(self, x):
-        assert x.shape[0] == 1  # noqa
+        return self._forward(x).clone()
+
+    def _forward(self, x):
+        """The output in one of the buffers, valid until the next but one call"""
         assert x.shape[1] == len(self.channel_names())  # noqa
-        pl_shape = (5, 13, 721, 1440)
+        variables, levels = self.model.param_level_pl
+        pl_shape = (len(variables), len(levels))
         nchan = pl_shape[0] * pl_shape[1]
-        pl = x[:, :nchan]
-        surface = x[:, nchan:]
-        pl = pl.resize(*pl_shape)
-        sl = surface[0]
-        plo, slo = self.model(pl, sl)
-        return torch.cat(
-            [
-                plo.resize(1, nchan, 721, 1440),
-                slo.resize(1, x.size(1) - nchan, 721, 1440),
-            ],
-            dim=1,
+
+        # views of the members, copied only if a member is not contiguous
+        x = x.contiguous()
+        out = self._output(x)
+        self.model.run_batch(
+            x[:, :nchan].unflatten(1, pl_shape),
+            x[:, nchan:],
+            out[:, :nchan].unflatten(1, pl_shape),
+            out[:, nchan:],
         )
+        return out
+
+    def _output(self, x: torch.Tensor) -> torch.Tensor:
+        key = (x.shape, x.device)
+        if key not in self._outputs:
+            # only keep the buffers of the current batch size
+            self._outputs.clear()
+            self._outputs[key] = [torch.empty_like(x) for _ in range(2)]
+        outputs = self._outputs[key]
+        if outputs[self._next_output].data_ptr() == x.data_ptr():
+            self._next_output = 1 - self._next_output
+        out = outputs[self._next_output]
+        self._next_output = 1 - self._next_output
+        return out
 
 
 class PanguInference(torch.nn.Module):
@@ -176,6 +366,24 @@ class PanguInference(torch.nn.Module):
         self.model_6 = model_6
         self.model_24 = model_24
         self.source = None
+        self.output_frequency = 1
+
+    def with_output_frequency(self, output_frequency: int) -> "PanguInference":
+        """A copy of this loop which only yields outputs every
+        ``output_frequency`` steps
+
+        The output of the other steps is None. If the outputs are daily
+        (``output_frequency`` is a multiple of 4), only the 24 hour model is
+        run, since the daily states do not depend on the 6 hour model.
+        """
+        if output_frequency < 1:
+            raise ValueError(
+                f"output_frequency must be at least 1. Got {output_frequency}."
+            )
+        inference = PanguInference(self.model_6, self.model_24)
+        inference.source = self.source
+        inference.output_frequency = output_frequency
+        return inference
 
     def to(self, device):
         return self
@@ -201,7 +409,12 @@ class PanguInference(torch.nn.Module):
 
     @property
     def device(self) -> torch.device:
-        return torch.device("cuda")  # Only supports cuda
+        return self.model_6.model.device
+
+    @property
+    def nbytes(self) -> int:
+        """The size of the onnx files, used by :mod:`earth2mip.model_cache`"""
+        return self.model_6.nbytes + self.model_24.nbytes
 
     def normalize(self, x):
         # No normalization for pangu
@@ -232,100 +445,129 @@ class PanguInference(torch.nn.Module):
             raise NotImplementedError("Restart capability not implemented.")
         # do not implement restart capability
         restart_data = None
+        time = time_loop.as_time(time)
+        # raises if the number of times does not match the batch
+        time_loop.batch_times(time, x.shape[0])
 
+        daily = self.output_frequency % 4 == 0
         with torch.no_grad():
             x0 = x[:, -1].clone()
             yield time, x0, restart_data
             time0 = time
+            k = 0
             while True:
                 x1 = x0
                 time1 = time0
                 for i in range(3):
-                    time1 += datetime.timedelta(hours=6)
+                    time1 = time_loop.add_time(time1, datetime.timedelta(hours=6))
+                    k += 1
 
-                    if self.source:
+                    if self.source and (not daily or i == 0):
+                        # the first step adds the source to x0 in place, which
+                        # the 24 hour model sees too
                         dt = torch.tensor(self.time_step.total_seconds())
                         x1 += self.source(x1, time1) * dt
-                    x1 = self.model_6(x1)
-                    yield time1, x1, restart_data
+                    if daily:
+                        yield time1, None, restart_data
+                        continue
+                    x1 = self.model_6._forward(x1)
+                    out = x1.clone() if k % self.output_frequency == 0 else None
+                    yield time1, out, restart_data
 
-                time0 += datetime.timedelta(hours=24)
+                k += 1
+
+                time0 = time_loop.add_time(time0, datetime.timedelta(hours=24))
                 if self.source:
                     dt = torch.tensor(self.time_step.total_seconds())
                     x0 += self.source(x0, time0) * 4 * dt
-                x0 = self.model_24(x0)
-                yield time0, x0, restart_data
+                x0 = self.model_24._forward(x0)
+                # the state stays in the buffers of the models, and the
+                # outputs are copies, which stay valid
+                out = x0.clone() if k % self.output_frequency == 0 else None
+                yield time0, out, restart_data
+
 
+def load(package, *, pretrained=True, device=None, **session_kwargs):
+    """Load the sub-stepped pangu weather inference
 
-def load(package, *, pretrained=True, device="doesn't matter"):
-    """Load the sub-stepped pangu weather inference"""
+    Args:
+        device: the device to run on, see :class:`PanguWeather`
+        **session_kwargs: passed to :func:`create_session`, e.g. the number of
+            threads on the cpu
+    """
     assert pretrained  # noqa
 
     p6 = package.get("pangu_weather_6.onnx")
     p24 = package.get("pangu_weather_24.onnx")
 
-    model_6 = PanguStacked(PanguWeather(p6))
-    model_24 = PanguStacked(PanguWeather(p24))
-    return PanguInference(model_6, model_24)
+    # the models run one after the other, so they share their output buffers
+    pangu_6 = PanguWeather(p6, device, **session_kwargs)
+    pangu_24 = PanguWeather(
+        p24, pangu_6.device, output_buffers=pangu_6.output_buffers, **session_kwargs
+    )
+    return PanguInference(PanguStacked(pangu_6), PanguStacked(pangu_24))
 
 
 def load_single_model(
-    package, *, time_step_hours: int = 24, pretrained=True, device="cuda:0"
+    package,
+    *,
+    time_step_hours: int = 24,
+    pretrained=True,
+    device="cuda:0",
+    **session_kwargs,
 ):
     """Load a single time-step pangu weather"""
     assert pretrained  # noqa
 
     if time_step_hours == 6:
-        return load_6(package, pretrained=pretrained, device=device)
+        return load_6(package, pretrained=pretrained, device=device, **session_kwargs)
     elif time_step_hours == 24:
-        return load_24(package, pretrained=pretrained, device=device)
+        return load_24(package, pretrained=pretrained, device=device, **session_kwargs)
     else:
         raise ValueError(f"time_step_hours must be 6 or 24, got {time_step_hours}")
 
 
-def load_24(package, *, pretrained=True, device="cuda:0"):
+def load_24(package, *, pretrained=True, device="cuda:0", **session_kwargs):
     """Load a 24 hour time-step pangu weather"""
     assert pretrained  # noqa
 
-    with torch.cuda.device(device):
-        p = package.get("pangu_weather_24.onnx")
-        model = PanguStacked(PanguWeather(p))
-        channel_names = model.channel_names()
-        center = np.zeros([len(channel_names)])
-        scale = np.ones([len(channel_names)])
-        grid = earth2mip.grid.equiangular_lat_lon_grid(721, 1440)
-        dt = datetime.timedelta(hours=24)
-        inference = networks.Inference(
-            model,
-            center=center,
-            scale=scale,
-            grid=grid,
-            channel_names=channel_names,
-            time_step=dt,
-        )
-        inference.to(device)
-        return inference
+    p = package.get("pangu_weather_24.onnx")
+    model = PanguStacked(PanguWeather(p, device, **session_kwargs))
+    channel_names = model.channel_names()
+    center = np.zeros([len(channel_names)])
+    scale = np.ones([len(channel_names)])
+    grid = earth2mip.grid.equiangular_lat_lon_grid(721, 1440)
+    dt = datetime.timedelta(hours=24)
+    inference = networks.Inference(
+        model,
+        center=center,
+        scale=scale,
+        grid=grid,
+        channel_names=channel_names,
+        time_step=dt,
+    )
+    inference.to(device)
+    return inference
 
 
-def load_6(package, *, pretrained=True, device="cuda:0"):
+def load_6(package, *, pretrained=True, device="cuda:0", **session_kwargs):
     """Load a 6 hour time-step pangu weather"""
     assert pretrained  # noqa
 
-    with torch.cuda.device(device):
-        p = package.get("pangu_weather_6.onnx")
-        model = PanguStacked(PanguWeather(p))
-        channel_names = model.channel_names()
-        center = np.zeros([len(channel_names)])
-        scale = np.ones([len(channel_names)])
-        grid = earth2mip.grid.equiangular_lat_lon_grid(721, 1440)
-        dt = datetime.timedelta(hours=6)
-        inference = networks.Inference(
-            model,
-            center=center,
-            scale=scale,
-            grid=grid,
-            channel_names=channel_names,
-            time_step=dt,
-        )
-        inference.to(device)
-        return inference
+    p = package.get("pangu_weather_6.onnx")
+    model = PanguStacked(PanguWeather(p, device, **session_kwargs))
+    channel_names = model.channel_names()
+    center = np.zeros([len(channel_names)])
+    scale = np.ones([len(channel_names)])
+    grid = earth2mip.grid.equiangular_lat_lon_grid(721, 1440)
+    dt = datetime.timedelta(hours=6)
+    inference = networks.Inference(
+        model,
+        center=center,
+        scale=scale,
+        grid=grid,
+        channel_names=channel_names,
+        time_step=dt,
+    )
+    inference.to(device)
+    return inference
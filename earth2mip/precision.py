@@ -0,0 +1,187 @@
+# SPDX-FileCopyrightText: Copyright (c) 2023 NVIDIA CORPORATION & AFFILIATES.
+# SPDX-FileCopyrightText: All rights reserved.
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Compare the accuracy and speed of precision policies
+
+:func:`precision_report` runs a short rollout of a
+:class:`earth2mip.networks.Inference` with every policy and compares its
+outputs with a float32 rollout. The error is the root mean square difference
+in units of the channel standard deviation (the ``scale`` of the model),
+averaged over the channels.
+
+Usage::
+
+    python -m earth2mip.precision sfno_73ch --start-time 2018-01-01 --steps 8
+"""
+import argparse
+import dataclasses
+import datetime
+import time
+from typing import List, Optional
+
+import torch
+
+from earth2mip import _cli_utils, initial_conditions
+from earth2mip.networks import Inference
+from earth2mip.schema import InitialConditionSource, Precision, PrecisionPolicy
+
+__all__ = ["PrecisionResult", "precision_report", "format_report"]
+
+DEFAULT_POLICIES = [
+    PrecisionPolicy(autocast=Precision.float32, state=Precision.float32),
+    PrecisionPolicy(autocast=Precision.bfloat16, state=Precision.float32),
+    PrecisionPolicy(autocast=Precision.bfloat16, state=Precision.bfloat16),
+    PrecisionPolicy(autocast=Precision.float16, state=Precision.float32),
+]
+
+
+@dataclasses.dataclass
+class PrecisionResult:
+    """The accuracy and speed of one precision policy
+
+    Attributes:
+        precision: the policy
+        seconds_per_step: the mean time of a step, without the first one
+        state_bytes: the memory of the state stored between steps
+        error: the normalized RMSE against float32 after every step
+    """
+
+    precision: PrecisionPolicy
+    seconds_per_step: float
+    state_bytes: int
+    error: List[float]
+
+
+def _rollout(
+    model: Inference, x: torch.Tensor, initial_time: datetime.datetime, n: int
+):
+    outputs = []
+    seconds = []
+    state_bytes = 0
+    iterator = model(initial_time, x)
+    next(iterator)
+    for _ in range(n):
+        start = time.perf_counter()
+        _, out, restart = next(iterator)
+        if x.device.type == "cuda":
+            torch.cuda.synchronize(x.device)
+        seconds.append(time.perf_counter() - start)
+        state = restart["x"]
+        state_bytes = state.numel() * state.element_size()
+        outputs.append(out)
+    iterator.close()
+    # the first step includes warm-up costs like the cudnn autotuner
+    per_step = sum(seconds[1:]) / (n - 1) if n > 1 else seconds[0]
+    return outputs, per_step, state_bytes
+
+
+def _error(out: torch.Tensor, reference: torch.Tensor, scale: torch.Tensor) -> float:
+    diff = (out.cpu() - reference) / scale
+    # mean over the channels of the rms error over all other dimensions
+    rmse = diff.transpose(0, 1).flatten(1).pow(2).mean(1).sqrt()
+    return rmse.mean().item()
+
+
+def precision_report(
+    model: Inference,
+    x: torch.Tensor,
+    initial_time: datetime.datetime,
+    n_steps: int = 8,
+    policies: Optional[List[PrecisionPolicy]] = None,
+) -> List[PrecisionResult]:
+    """Run ``n_steps`` of ``model`` with every policy in ``policies``
+
+    The precision of ``model`` is restored afterwards.
+
+    Args:
+        model: the model to compare the policies of
+        x: the initial condition, shape (batch, history, channel, lat, lon)
+        initial_time: the initial time
+        n_steps: the length of the rollout
+        policies: the policies to compare. Defaults to float32, bfloat16
+            autocast with float32 and bfloat16 state, and float16 autocast.
+
+    Returns:
+        one result per policy
+    """
+    policies = DEFAULT_POLICIES if policies is None else policies
+    original = model.precision
+    scale = model.scale.cpu()
+    results = []
+    try:
+        model.set_precision(PrecisionPolicy())
+        reference, _, _ = _rollout(model, x, initial_time, n_steps)
+        reference = [out.cpu() for out in reference]
+
+        for policy in policies:
+            model.set_precision(policy)
+            outputs, per_step, state_bytes = _rollout(model, x, initial_time, n_steps)
+            error = [_error(out, ref, scale) for out, ref in zip(outputs, reference)]
+            results.append(PrecisionResult(policy, per_step, state_bytes, error))
+    finally:
+        model.set_precision(original)
+    return results
+
+
+def format_report(results: List[PrecisionResult]) -> str:
+    """Format ``results`` as csv, with the speedup relative to the first row"""
+    lines = ["autocast,state,seconds_per_step,speedup,state_bytes,error_final"]
+    for result in results:
+        speedup = results[0].seconds_per_step / result.seconds_per_step
+        lines.append(
+            f"{result.precision.autocast.value},{result.precision.state.value},"
+            f"{result.seconds_per_step:.4f},{speedup:.2f},{result.state_bytes},"
+            f"{result.error[-1]:.3g}"
+        )
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    _cli_utils.add_model_args(parser, required=True)
+    parser.add_argument(
+        "--start-time", default="2018-01-01", type=datetime.datetime.fromisoformat
+    )
+    parser.add_argument("--steps", type=int, default=8)
+    parser.add_argument(
+        "--initial-condition-source",
+        type=InitialConditionSource,
+        default=InitialConditionSource.era5,
+    )
+    parser.add_argument(
+        "--device", default="cuda" if torch.cuda.is_available() else "cpu"
+    )
+    args = parser.parse_args()
+
+    model = _cli_utils.model_from_args(args, device=args.device)
+    if not isinstance(model, Inference):
+        raise ValueError(f"{type(model).__name__} has no precision policy.")
+    data_source = initial_conditions.get_data_source(
+        model.in_channel_names,
+        initial_condition_source=args.initial_condition_source,
+    )
+    x = initial_conditions.get_initial_condition_for_model(
+        model,
+        data_source,
+        args.start_time,
+        channel_to_modify=None,
+        modulating_factor=None,
+    )
+    results = precision_report(model, x, args.start_time, n_steps=args.steps)
+    print(format_report(results))
+
+
+if __name__ == "__main__":
+    main()
@@ -20,7 +20,7 @@ import numpy as np
 import pandas
 import torch
 
-from earth2mip import grid
+from earth2mip import geometry, grid
 
 
 class TempestRegridder(torch.nn.Module):
@@ -69,6 +69,20 @@ class RegridLatLon(torch.nn.Module):
         self._lon_index = pandas.Index(src_grid.lon).get_indexer(dest_grid.lon)
         assert not np.any(self._lon_index == -1)  # noqa
 
+        # crops, e.g. from 721 to 720 latitudes, select a view
+        self._lat_slice = _as_slice(self._lat_index)
+        self._lon_slice = _as_slice(self._lon_index)
+
+    @property
+    def lat_index(self) -> np.ndarray:
+        """The source latitude index of every destination latitude"""
+        return self._lat_index
+
+    @property
+    def lon_index(self) -> np.ndarray:
+        """The source longitude index of every destination longitude"""
+        return self._lon_index
+
     def forward(self, x):
         if x.shape[-2:] != self._src_grid.shape:
             raise ValueError(
@@ -76,11 +90,67 @@ class RegridLatLon(torch.nn.Module):
                 f"{self._src_grid.shape}"
             )
 
+        if self._lat_slice is not None and self._lon_slice is not None:
+            return x[..., self._lat_slice, self._lon_slice]
         return x[..., self._lat_index, :][..., self._lon_index]
 
 
+def _as_slice(index: np.ndarray):
+    """``index`` as a slice if it is contiguous and increasing, else None"""
+    if index.size and np.array_equal(index, np.arange(index[0], index[0] + index.size)):
+        return slice(int(index[0]), int(index[0]) + index.size)
+    return None
+
+
+class RegridBilinear(torch.nn.Module):
+    """Bilinear interpolation between lat-lon grids
+
+    Destination points outside of the source grid, for example the poles of a
+    grid without them, take the value of the nearest source latitude.
+    """
+
+    def __init__(self, src_grid: grid.LatLonGrid, dest_grid: grid.LatLonGrid):
+        super().__init__()
+        self._src_grid = src_grid
+        self._dest_grid = dest_grid
+
+        i0, i1, fi = geometry.linear_weights(src_grid.lat, dest_grid.lat)
+        periodic = geometry.is_periodic(np.asarray(src_grid.lon))
+        j0, j1, fj = geometry.linear_weights(
+            src_grid.lon, dest_grid.lon, periodic=periodic
+        )
+        self.register_buffer("lat_index", torch.from_numpy(np.stack([i0, i1])))
+        self.register_buffer("lon_index", torch.from_numpy(np.stack([j0, j1])))
+        self.register_buffer("lat_weight", torch.from_numpy(fi).float()[:, None])
+        self.register_buffer("lon_weight", torch.from_numpy(fj).float())
+
+    def forward(self, x):
+        if x.shape[-2:] != self._src_grid.shape:
+            raise ValueError(
+                f"Input shape {x.shape} does not match grid shape"
+                f"{self._src_grid.shape}"
+            )
+        lat0 = x.index_select(-2, self.lat_index[0])
+        lat1 = x.index_select(-2, self.lat_index[1])
+        x = torch.lerp(lat0, lat1, self.lat_weight.to(x.dtype))
+        lon0 = x.index_select(-1, self.lon_index[0])
+        lon1 = x.index_select(-1, self.lon_index[1])
+        return torch.lerp(lon0, lon1, self.lon_weight.to(x.dtype))
+
+
+def _contains(coords, points) -> bool:
+    return not np.any(pandas.Index(coords).get_indexer(points) == -1)
+
+
 def get_regridder(src: grid.LatLonGrid, dest: grid.LatLonGrid) -> torch.nn.Module:
+    """A regridder from ``src`` to ``dest``
+
+    Selects the points of ``dest`` if they are all nodes of ``src``, and
+    interpolates bilinearly otherwise.
+    """
     if src == dest:
         return Identity()
-    else:
+    elif _contains(src.lat, dest.lat) and _contains(src.lon, dest.lon):
         return RegridLatLon(src, dest)
+    else:
+        return RegridBilinear(src, dest)
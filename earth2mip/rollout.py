@@ -0,0 +1,122 @@
+# SPDX-FileCopyrightText: Copyright (c) 2023 NVIDIA CORPORATION & AFFILIATES.
+# SPDX-FileCopyrightText: All rights reserved.
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Run a time loop into a preallocated buffer
+
+:func:`rollout` writes every output step of a time loop into one array, either
+a tensor or a (memory mapped) numpy array, so the memory of a rollout is fixed
+up front and long rollouts can be stored on disk.
+"""
+import os
+from typing import Optional, Union
+
+import numpy as np
+import torch
+import xarray
+
+from earth2mip.time_loop import TimeLoop, TimeT, batch_times, is_per_sample
+
+__all__ = ["rollout"]
+
+OutT = Union[torch.Tensor, np.ndarray, str, os.PathLike]
+
+
+def _numpy_dtype(dtype: torch.dtype) -> np.dtype:
+    return torch.empty((), dtype=dtype).numpy().dtype
+
+
+def _allocate(out: Optional[OutT], shape, dtype: torch.dtype):
+    if out is None:
+        return torch.empty(shape, dtype=dtype)
+    if isinstance(out, (str, os.PathLike)):
+        return np.lib.format.open_memmap(
+            out, mode="w+", dtype=_numpy_dtype(dtype), shape=shape
+        )
+    if tuple(out.shape) != tuple(shape):
+        raise ValueError(f"out has shape {tuple(out.shape)}. Expected {shape}.")
+    return out
+
+
+def _write(out, i: int, data: torch.Tensor):
+    if isinstance(out, torch.Tensor):
+        out[i].copy_(data)
+    else:
+        # copy straight into the array without an intermediate host copy
+        torch.from_numpy(out[i]).copy_(data)
+
+
+def rollout(
+    time_loop: TimeLoop,
+    x: torch.Tensor,
+    n_steps: int,
+    stride: int = 1,
+    *,
+    time: TimeT,
+    out: Optional[OutT] = None,
+) -> xarray.DataArray:
+    """Run ``n_steps`` of ``time_loop`` and store every ``stride``-th output
+
+    The outputs are written into ``out`` as they are produced. Storing the
+    initial condition and the outputs at steps ``stride, 2 * stride, ...``
+    needs an array of shape ``(n_steps // stride + 1, batch, channel, lat,
+    lon)``.
+
+    Args:
+        time_loop: the time loop to run
+        x: the initial condition, see :class:`earth2mip.time_loop.TimeLoop`
+        n_steps: the number of time steps to run
+        stride: store every ``stride``-th step
+        time: the initial time, or one initial time per sample
+        out: where to store the outputs. One of
+
+            - None: a new CPU tensor
+            - a tensor, for example in pinned memory or on the device
+            - a numpy array, including a ``numpy.memmap``
+            - a path: a ``.npy`` file which is memory mapped
+
+    Returns:
+        a DataArray with dimensions (time, batch, channel, lat, lon) backed by
+        ``out``. Memory mapped outputs are only read when accessed. A tensor
+        on the device is copied to the host.
+    """
+    if stride < 1:
+        raise ValueError(f"stride must be at least 1. Got {stride}.")
+
+    n_out = n_steps // stride + 1
+    times = []
+    for k, (valid_time, data, _) in enumerate(time_loop(time, x)):
+        if k % stride == 0:
+            if not times:
+                out = _allocate(out, (n_out, *data.shape), data.dtype)
+            _write(out, len(times), data)
+            times.append(valid_time)
+        if k == n_steps:
+            break
+
+    if hasattr(out, "flush"):
+        out.flush()
+    if isinstance(out, torch.Tensor):
+        out = out.cpu().numpy()
+
+    coords = dict(lat=time_loop.grid.lat, lon=time_loop.grid.lon)
+    coords["channel"] = time_loop.out_channel_names
+    if is_per_sample(time):
+        valid_times = [batch_times(t, out.shape[1]) for t in times]
+        coords["valid_time"] = (("time", "batch"), np.array(valid_times))
+    else:
+        coords["time"] = times
+    return xarray.DataArray(
+        out, dims=["time", "batch", "channel", "lat", "lon"], coords=coords
+    )
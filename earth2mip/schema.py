@@ -16,7 +16,7 @@
 
 import datetime
 from enum import Enum
-from typing import Any, List, Mapping, Optional
+from typing import Any, List, Literal, Mapping, Optional, Union
 
 import pydantic
 
@@ -29,6 +29,9 @@ __all__ = [
     "EnsembleRun",
     "InferenceEntrypoint",
     "PerturbationStrategy",
+    "OutputFormat",
+    "Precision",
+    "PrecisionPolicy",
 ]
 
 
@@ -51,12 +54,35 @@ class InferenceEntrypoint(pydantic.BaseModel):
     kwargs: Mapping[Any, Any] = pydantic.Field(default_factory=dict)
 
 
+class Precision(Enum):
+    float32 = "float32"
+    bfloat16 = "bfloat16"
+    float16 = "float16"
+
+
+class PrecisionPolicy(pydantic.BaseModel):
+    """The floating point precision of a time loop
+
+    Normalization and the outputs of the time loop are always float32.
+
+    Attrs:
+        autocast: the precision the model is autocast to. float32 = no autocast.
+        state: the precision the (normalized) state is stored in between time
+            steps. Lower precisions halve the memory of the state.
+    """
+
+    autocast: Precision = Precision.float32
+    state: Precision = Precision.float32
+
+
 class Model(pydantic.BaseModel):
     """Metadata for using a ERA5 time-stepper model
 
     Attrs:
         entrypoint: if provided, will be used to load a custom time-loop
             implementation.
+        precision: the default precision policy of the model. Can be
+            overridden by ``EnsembleRun.precision``.
 
     """
 
@@ -68,6 +94,7 @@ class Model(pydantic.BaseModel):
     architecture_entrypoint: str = ""
     time_step: datetime.timedelta = datetime.timedelta(hours=6)
     entrypoint: Optional[InferenceEntrypoint] = None
+    precision: PrecisionPolicy = pydantic.Field(default_factory=PrecisionPolicy)
 
 
 class PerturbationStrategy(Enum):
@@ -78,6 +105,11 @@ class PerturbationStrategy(Enum):
     none = "none"
 
 
+class OutputFormat(Enum):
+    netcdf = "netcdf"
+    zarr = "zarr"
+
+
 class EnsembleRun(pydantic.BaseModel):
     """A configuration for running an ensemble weather forecast
 
@@ -87,11 +119,13 @@ class EnsembleRun(pydantic.BaseModel):
         noise_amplitude: The amplitude of the Gaussian noise to add to the initial conditions.
         noise_reddening: The noise reddening amplitude, 2.0 was the defualt set by A.G. work.
         simulation_length: The length of the simulation in timesteps.
-        output_frequency: The frequency at which to write the output to file, in timesteps.
-        use_cuda_graphs: Whether to use CUDA graphs to optimize the computation.
+        output_frequency: The frequency at which to write the output to file, in timesteps. At least 1.
+        compile_model: Whether to run the time steps of the model through ``torch.compile``. Only supported by ``earth2mip.networks.Inference``.
+        use_cuda_graphs: Whether to use CUDA graphs to optimize the computation. Implies ``compile_model``.
         seed: The random seed for the simulation.
-        ensemble_batch_size: The batch size to use for the ensemble.
-        autocast_fp16: Whether to use automatic mixed precision (AMP) with FP16 data types.
+        ensemble_batch_size: The batch size to use for the ensemble. "auto" = the largest batch size for which one time step fits in memory, see earth2mip.batch_size.
+        ensemble_batch_size_headroom: The fraction of device memory left free when ``ensemble_batch_size`` is "auto".
+        precision: The precision policy of the model, for example ``{"autocast": "bfloat16"}``. None = the default of the model, see ``Model.precision``.
         perturbation_strategy: The strategy to use for perturbing the initial conditions.
         perturbation_channels: channel(s) perturbed by the initial condition perturbation strategy, None = all channels
         forecast_name (optional): The name of the forecast to use (alternative to `weather_event`).
@@ -102,6 +136,10 @@ class EnsembleRun(pydantic.BaseModel):
         grf_noise_alpha: tuning parameter of the Gaussian random field, see ensemble_utils.generate_noise_grf for details
         grf_noise_sigma: tuning parameter of the Gaussian random field, see ensemble_utils.generate_noise_grf for details
         grf_noise_tau: tuning parameter of the Gaussian random field, see ensemble_utils.generate_noise_grf for details
+        output_format: netcdf writes one ``ensemble_out_{rank}.nc`` file per rank. zarr writes all ranks into a single ``ensemble_out.zarr`` store.
+        output_queue_depth: The maximum number of output steps (or checkpoints)
+            waiting to be written by the background writer thread. 0 = write
+            synchronously.
 
     """  # noqa
 
@@ -112,11 +150,15 @@ class EnsembleRun(pydantic.BaseModel):
     perturbation_channels: Optional[List[str]] = None
     noise_reddening: float = 2.0
     noise_amplitude: float = 0.05
-    output_frequency: int = 1
+    output_frequency: int = pydantic.Field(1, ge=1)
     output_grid: Optional[Grid] = None
     ensemble_members: int = 1
     seed: int = 1
-    ensemble_batch_size: int = 1
+    ensemble_batch_size: Union[int, Literal["auto"]] = 1
+    ensemble_batch_size_headroom: float = 0.2
+    compile_model: bool = False
+    use_cuda_graphs: bool = False
+    precision: Optional[PrecisionPolicy] = None
     # alternatives for specifiying forecast
     forecast_name: Optional[str] = None
     weather_event: Optional[weather_events.WeatherEvent] = None
@@ -127,6 +169,8 @@ class EnsembleRun(pydantic.BaseModel):
     grf_noise_alpha: float = 2.0
     grf_noise_sigma: float = 5.0
     grf_noise_tau: float = 2.0
+    output_format: OutputFormat = OutputFormat.netcdf
+    output_queue_depth: int = 2
     
     def get_weather_event(self) -> weather_events.WeatherEvent:
         if self.forecast_name:
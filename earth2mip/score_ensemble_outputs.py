@@ -29,6 +29,8 @@ from earth2mip.initial_conditions import hdf5
 
 logger = logging.getLogger(__file__)
 
+ZARR_OUTPUT = "ensemble_out.zarr"
+
 
 def save_dataset(out, path):
     out.to_zarr(path + ".zarr", mode="w")
@@ -41,8 +43,19 @@ def _open(f, domain, chunks={"time": 1}):
     return ds.assign_coords(root.coords)
 
 
+def _open_zarr(path, group, chunks={"time": 1}):
+    root = xarray.open_zarr(path)
+    ds = xarray.open_zarr(path, group=group, chunks=chunks)
+    ds.attrs.update(root.attrs)
+    return ds.assign_coords(root.coords)
+
+
 def open_ensemble(path, group):
     path = pathlib.Path(path)
+    zarr_path = path / ZARR_OUTPUT
+    if zarr_path.exists():
+        # all ranks share one store, so there is nothing to concatenate
+        return _open_zarr(zarr_path.as_posix(), group)
     ensemble_files = sorted(list(path.glob("ensemble_out_*.nc")))
     return xarray.concat([_open(f, group) for f in ensemble_files], dim="ensemble")
 
@@ -55,8 +68,12 @@ def open_verification(time):
 
 
 def read_weather_event(dir):
-    ncfile = os.path.join(dir, "ensemble_out_0.nc")
-    ds = xarray.open_dataset(ncfile)
+    zarr_path = os.path.join(dir, ZARR_OUTPUT)
+    if os.path.exists(zarr_path):
+        ds = xarray.open_zarr(zarr_path)
+    else:
+        ncfile = os.path.join(dir, "ensemble_out_0.nc")
+        ds = xarray.open_dataset(ncfile)
     weather_event = weather_events.WeatherEvent.parse_raw(ds.weather_event)
     return weather_event
 
@@ -147,7 +147,11 @@ def run_over_initial_times(
         f"Working on shard {shard+1}/{n_shards}. {len(initial_times)} initial times to run."
     )
 
-    n_ensemble_batches = config.ensemble_members // config.ensemble_batch_size
+    if config.ensemble_batch_size == "auto":
+        # the batch size is chosen by each run, so split by members
+        n_ensemble_batches = config.ensemble_members
+    else:
+        n_ensemble_batches = config.ensemble_members // config.ensemble_batch_size
     ranks_per_time = min(n_ensemble_batches, dist.world_size)
     ranks_per_time = ranks_per_time - dist.world_size % ranks_per_time
 
@@ -16,8 +16,19 @@
 
 import dataclasses
 import datetime
-from typing import Any, Iterator, List, Optional, Protocol, Tuple, TypeVar
-
+from typing import (
+    Any,
+    Iterator,
+    List,
+    Optional,
+    Protocol,
+    Sequence,
+    Tuple,
+    TypeVar,
+    Union,
+)
+
+import numpy as np
 import pandas as pd
 import torch
 
@@ -25,6 +36,64 @@ import earth2mip.grid
 
 ChannelNameT = str
 
+#: One time for the whole batch or one time per sample
+TimeT = Union[datetime.datetime, Sequence[datetime.datetime]]
+
+
+def as_time(time: Any) -> Optional[TimeT]:
+    """Convert per-sample times, e.g. a datetime64 array, to a list of datetimes
+
+    Scalars, e.g. a ``np.datetime64``, are converted to a datetime. Datetimes
+    and None are returned unchanged.
+    """
+    if time is None or isinstance(time, datetime.datetime):
+        return time
+    times = list(pd.to_datetime(np.asarray(time).ravel()).to_pydatetime())
+    return times if is_per_sample(time) else times[0]
+
+
+def is_per_sample(time: Any) -> bool:
+    """Whether ``time`` holds one time per sample
+
+    None and scalars are one time for the whole batch.
+    """
+    if time is None or isinstance(time, datetime.datetime):
+        return False
+    return np.ndim(time) > 0
+
+
+def batch_times(time: Any, batch_size: int) -> List[datetime.datetime]:
+    """One datetime per sample of a batch of ``batch_size``"""
+    if not is_per_sample(time):
+        return [as_time(time)] * batch_size
+    time = as_time(time)
+    if len(time) != batch_size:
+        raise ValueError(f"Got {len(time)} times for a batch of {batch_size} samples.")
+    return time
+
+
+def add_time(time: TimeT, dt: datetime.timedelta) -> TimeT:
+    """``time + dt`` for single or per-sample times"""
+    if is_per_sample(time):
+        return [t + dt for t in time]
+    return time + dt
+
+
+def with_output_frequency(time_loop: "TimeLoop", output_frequency: int) -> "TimeLoop":
+    """``time_loop`` yielding outputs only every ``output_frequency`` steps
+
+    A hint for loops whose outputs are only consumed every few steps. Loops
+    with a ``with_output_frequency`` method return a copy which yields None as
+    the output of the other steps, and may skip computing them. Other loops are
+    returned unchanged, so callers must only use the outputs of the steps they
+    asked for.
+    """
+    if getattr(time_loop, "output_frequency", 1) == output_frequency:
+        return time_loop
+    if hasattr(time_loop, "with_output_frequency"):
+        return time_loop.with_output_frequency(output_frequency)
+    return time_loop
+
 
 @dataclasses.dataclass
 class GeoTensorInfo:
@@ -50,6 +119,9 @@ class TimeLoop(Protocol):
     device. While torch modules can be moved between devices easily, this is not
     true for all frameworks.
 
+    Loops may implement ``with_output_frequency(n)``, returning a copy which
+    only yields outputs every ``n`` steps, see :func:`with_output_frequency`.
+
     Attributes:
         in_channel_names:
         out_channel_names:
@@ -72,8 +144,8 @@ class TimeLoop(Protocol):
     dtype: torch.dtype = torch.float32
 
     def __call__(
-        self, time: datetime.datetime, x: torch.Tensor, restart: Optional[Any] = None
-    ) -> Iterator[Tuple[datetime.datetime, torch.Tensor, Any]]:
+        self, time: TimeT, x: torch.Tensor, restart: Optional[Any] = None
+    ) -> Iterator[Tuple[TimeT, torch.Tensor, Any]]:
         """
         Args:
             x: an initial condition. has shape (B, n_history_levels,
@@ -83,6 +155,9 @@ class TimeLoop(Protocol):
                 -i]`` is the data correspond to ``time - (i-1) *
                 self.history_time_step``.
             time: the datetime to start with, by default assumed to be in UTC.
+                Either one datetime for the whole batch or a sequence of B
+                datetimes, one per sample, so that different initial times can
+                be run in one batch.
             restart: if provided this restart information (typically some torch
                 Tensor) can be used to restart the time loop
 
@@ -90,7 +165,8 @@ class TimeLoop(Protocol):
             (time, output, restart) tuples. ``output`` is a tensor with
                 shape (B, len(out_channel_names), Y, X) which will be used for
                 diagnostics. Restart data should encode the state of the time
-                loop.
+                loop. ``time`` is a list of per-sample datetimes if per-sample
+                times were passed.
         """
         pass
 
@@ -146,10 +222,11 @@ class TimeStepper(Protocol[StateT]):
     def time_step(self) -> datetime.timedelta:
         pass
 
-    def initialize(self, x: torch.Tensor, time: datetime.datetime) -> StateT:
+    def initialize(self, x: torch.Tensor, time: TimeT) -> StateT:
         """
 
-        x is described by ``self.input_info``
+        x is described by ``self.input_info``. ``time`` is a datetime or a
+        sequence of per-sample datetimes, see :meth:`TimeLoop.__call__`.
         """
         pass
 
@@ -198,9 +275,18 @@ class TimeStepperLoop(TimeLoop):
     def dtype(self) -> torch.dtype:
         return self.stepper.dtype
 
+    @property
+    def nbytes(self) -> Optional[int]:
+        """The memory of the stepper if it reports it, see
+        :func:`earth2mip.model_cache.model_nbytes`"""
+        return getattr(self.stepper, "nbytes", None)
+
     def __call__(
-        self, time: datetime.datetime, x: torch.Tensor, restart: Optional[Any] = None
-    ) -> Iterator[Tuple[datetime.datetime, torch.Tensor, Any]]:
+        self, time: TimeT, x: torch.Tensor, restart: Optional[Any] = None
+    ) -> Iterator[Tuple[TimeT, torch.Tensor, Any]]:
+        time = as_time(time)
+        # raises if the number of times does not match the batch
+        batch_times(time, x.shape[0])
         if restart is None:
             state = self.stepper.initialize(x, time)
         else:
@@ -225,6 +311,6 @@ class TimeStepperLoop(TimeLoop):
 
         while True:
             state, output = self.stepper.step(state)
-            time += self.time_step
+            time = add_time(time, self.time_step)
             assert output.ndim == 4  # noqa
             yield time, output, state
@@ -17,7 +17,7 @@
 import datetime
 import json
 from enum import Enum
-from typing import List, Literal, Optional, Union
+from typing import List, Literal, Optional, Tuple, Union
 
 from pydantic import BaseModel
 
@@ -47,10 +47,24 @@ class WeatherEventProperties(BaseModel):
 
 
 class Diagnostic(BaseModel):
+    """
+    Attributes:
+        type: one of the keys of ``earth2mip.diagnostics.DiagnosticTypes``
+        nbins: the number of bins of "histogram" and "quantile" diagnostics
+        bin_range: the (min, max) of the histogram bins. If None, the range of
+            the first ensemble batch at each output time, widened by half its
+            span on both sides, is used. Values outside the range are counted
+            in the outermost bins.
+        quantiles: the quantiles computed by "quantile" diagnostics
+
+    """
+
     type: str
     function: str = ""
     channels: List[str]
     nbins: int = 10
+    bin_range: Optional[Tuple[float, float]] = None
+    quantiles: List[float] = [0.1, 0.5, 0.9]
 
 
 class Window(BaseModel):
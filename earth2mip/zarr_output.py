@@ -0,0 +1,186 @@
+# SPDX-FileCopyrightText: Copyright (c) 2023 NVIDIA CORPORATION & AFFILIATES.
+# SPDX-FileCopyrightText: All rights reserved.
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""A netCDF4-like interface for writing ensemble outputs to a zarr store
+
+The diagnostics in :mod:`earth2mip.diagnostics` are written against the
+``netCDF4.Group`` API. :class:`ZarrGroup` implements the subset of that API
+they use, so the same code can write one zarr store shared by all ranks.
+
+Every rank opens the same store. Creating groups, dimensions and variables is
+idempotent and does not write to existing ones. One rank initializes the store
+and writes the shared attributes and coordinates, then the other ranks open
+the existing variables. The ensemble and time dimensions are chunked so that
+every write from ``run_ensembles`` covers whole chunks, which lets ranks write
+disjoint chunks without any locking.
+"""
+from typing import Any, Mapping, Optional, Tuple, Union
+
+import numpy as np
+import zarr
+
+__all__ = ["ZarrGroup"]
+
+# used by xarray to name the dimensions of a zarr array
+_DIMENSION_KEY = "_ARRAY_DIMENSIONS"
+
+
+class ZarrVariable:
+    """Wraps a zarr array. Attributes set on this object are stored in the
+    array's ``.zattrs``."""
+
+    def __init__(self, array: zarr.Array):
+        object.__setattr__(self, "_array", array)
+
+    def __setattr__(self, name, value):
+        self._array.attrs[name] = value
+
+    def __getattr__(self, name):
+        try:
+            return self._array.attrs[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __getitem__(self, index):
+        return self._array[self._index(index)]
+
+    def __setitem__(self, index, value):
+        self._array[self._index(index)] = np.asarray(value)
+
+    def _index(self, index):
+        # netCDF4 allows ``v[:]`` for scalar variables
+        if self._array.ndim == 0:
+            return ...
+        return index
+
+    @property
+    def shape(self):
+        return self._array.shape
+
+
+class ZarrGroup:
+    """Wraps a zarr group with the subset of the ``netCDF4.Group`` API used by
+    :func:`earth2mip.netcdf.initialize_netcdf`
+
+    Args:
+        group: the zarr group
+        dimensions: sizes of dimensions that must be known up front. zarr
+            arrays cannot have unlimited dimensions, so the size of ``time``
+            must be passed here. These override the sizes passed to
+            ``createDimension``.
+        chunks: the chunk size of each dimension. Dimensions not listed are
+            stored in a single chunk.
+        parent: the parent group, used to look up dimensions.
+
+    Example:
+        >>> nc = ZarrGroup.open("out.zarr", dimensions={"time": 3})
+        >>> nc.createDimension("time", None)
+        >>> v = nc.createVariable("time", np.float32, ("time",))
+        >>> v.units = "hours since 2018-01-01"
+    """
+
+    def __init__(
+        self,
+        group: zarr.Group,
+        dimensions: Optional[Mapping[str, int]] = None,
+        chunks: Optional[Mapping[str, int]] = None,
+        parent: Optional["ZarrGroup"] = None,
+    ):
+        object.__setattr__(self, "_group", group)
+        object.__setattr__(self, "_parent", parent)
+        object.__setattr__(self, "_fixed_dimensions", dict(dimensions or {}))
+        object.__setattr__(self, "_chunks", dict(chunks or {}))
+        object.__setattr__(self, "dimensions", {})
+
+    @classmethod
+    def open(cls, path: str, mode: str = "a", **kwargs) -> "ZarrGroup":
+        return cls(zarr.open_group(path, mode=mode), **kwargs)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+    def __setattr__(self, name, value):
+        self._group.attrs[name] = value
+
+    @property
+    def variables(self):
+        return {name: self[name] for name in self._group.array_keys()}
+
+    def sync(self):
+        # chunks are written to the store directly, nothing is buffered
+        pass
+
+    def __getattr__(self, name):
+        try:
+            return self._group.attrs[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __getitem__(self, name) -> Union["ZarrGroup", ZarrVariable]:
+        if name in self._group.group_keys():
+            return self._child(self._group[name])
+        return ZarrVariable(self._group[name])
+
+    def _child(self, group: zarr.Group) -> "ZarrGroup":
+        return ZarrGroup(group, self._fixed_dimensions, self._chunks, parent=self)
+
+    def _dimension_size(self, name: str) -> int:
+        if name in self._fixed_dimensions:
+            return self._fixed_dimensions[name]
+        group = self
+        while group is not None:
+            if name in group.dimensions:
+                return group.dimensions[name]
+            group = group._parent
+        raise KeyError(f"Dimension {name} not found.")
+
+    def createVLType(self, datatype, name):
+        # zarr stores strings as attributes, nothing to register
+        pass
+
+    def createDimension(self, name: str, size: Optional[int]):
+        if size is None and name not in self._fixed_dimensions:
+            raise ValueError(
+                f"zarr does not support unlimited dimensions. Pass the size of "
+                f"{name} in ``dimensions``."
+            )
+        self.dimensions[name] = size
+
+    def createGroup(self, name: str) -> "ZarrGroup":
+        return self._child(self._group.require_group(name))
+
+    def createVariable(
+        self, name: str, datatype: Any, dimensions: Union[str, Tuple[str, ...]] = ()
+    ) -> ZarrVariable:
+        if isinstance(dimensions, str):
+            dimensions = (dimensions,)
+        shape = tuple(self._dimension_size(d) for d in dimensions)
+        chunks = tuple(self._chunks.get(d, n) for d, n in zip(dimensions, shape))
+        dtype = np.dtype(datatype)
+        fill_value = np.nan if dtype.kind == "f" else None
+        array = self._group.require_dataset(
+            name,
+            shape=shape,
+            chunks=chunks or True,
+            dtype=dtype,
+            fill_value=fill_value,
+            exact=True,
+        )
+        if array.attrs.get(_DIMENSION_KEY) != list(dimensions):
+            array.attrs[_DIMENSION_KEY] = list(dimensions)
+        return ZarrVariable(array)
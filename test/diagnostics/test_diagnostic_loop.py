@@ -14,6 +14,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 import datetime
+import threading
 
 import pytest
 import torch
@@ -61,3 +62,89 @@ def test_diagnostic_loop_ws(device, diag_concat):
 
         if k > 3:
             break
+
+
+class Count(WindSpeed):
+    def __init__(self, level, grid):
+        super().__init__(level, grid)
+        self.calls = 0
+
+    def __call__(self, x):
+        self.calls += 1
+        return super().__call__(x)
+
+
+def _model(grid):
+    return Inference(
+        Identity(),
+        center=[0, 0, 0, 0],
+        scale=[1, 1, 1, 1],
+        grid=grid,
+        channel_names=["u10m", "tcwv", "u100m", "v100m"],
+    )
+
+
+@pytest.mark.parametrize("concurrent", [True, False])
+def test_diagnostic_loop_output_frequency(concurrent):
+    grid = equiangular_lat_lon_grid(8, 16)
+    diagnostics = [Count("100m", grid), WindSpeed("100m", grid)]
+    diag_model = DiagnosticTimeLoop(
+        diagnostics=diagnostics,
+        model=_model(grid),
+        output_frequency=3,
+        concurrent=concurrent,
+    )
+    x = torch.rand([1, 1, 4, 8, 16])
+    ws_truth = torch.sqrt(torch.sum(x[:, 0, 2:] ** 2, dim=1, keepdim=True))
+
+    time = datetime.datetime(2018, 1, 1)
+    restarts = []
+    for k, (_, data, restart) in enumerate(diag_model(time, x)):
+        restarts.append(restart)
+        if k % 3:
+            assert data is None
+        else:
+            torch.testing.assert_close(data[:, 4:5], ws_truth)
+            torch.testing.assert_close(data[:, 5:6], ws_truth)
+        if k == 6:
+            break
+    assert diagnostics[0].calls == 3
+
+    # restarts run the diagnostics on the same steps
+    iterator = diag_model(None, None, restart=restarts[2])
+    assert next(iterator)[1] is None
+    assert next(iterator)[1] is not None
+
+
+def test_diagnostic_loop_stops_threads():
+    grid = equiangular_lat_lon_grid(8, 16)
+    diagnostics = [WindSpeed("100m", grid), WindSpeed("100m", grid)]
+    diag_model = DiagnosticTimeLoop(diagnostics, _model(grid), concurrent=True)
+    x = torch.rand([1, 1, 4, 8, 16])
+    n_threads = threading.active_count()
+
+    iterator = diag_model(datetime.datetime(2018, 1, 1), x)
+    next(iterator)
+    assert threading.active_count() > n_threads
+    iterator.close()
+    assert threading.active_count() == n_threads
+
+
+def test_diagnostic_loop_mixed_grids():
+    # the model includes the south pole, the diagnostic does not
+    model_grid = equiangular_lat_lon_grid(9, 16)
+    diagnostic_grid = equiangular_lat_lon_grid(8, 16, includes_south_pole=False)
+    diag_model = DiagnosticTimeLoop(
+        diagnostics=[WindSpeed("100m", diagnostic_grid)], model=_model(model_grid)
+    )
+    assert diag_model.grid == model_grid
+
+    x = torch.rand([1, 1, 4, 9, 16])
+    _, data, _ = next(diag_model(datetime.datetime(2018, 1, 1), x))
+    assert data.shape == (1, 5, 9, 16)
+    torch.testing.assert_close(data[:, :4], x[:, 0])
+
+    ws_truth = torch.sqrt(torch.sum(x[:, 0, 2:, :8] ** 2, dim=1))
+    torch.testing.assert_close(data[:, 4, :8], ws_truth)
+    # the missing pole is filled from the nearest latitude
+    torch.testing.assert_close(data[:, 4, 8], ws_truth[:, 7])
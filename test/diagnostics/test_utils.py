@@ -16,7 +16,11 @@
 import pytest
 import torch
 
-from earth2mip.diagnostic.utils import filter_channels
+from earth2mip.diagnostic.utils import (
+    filter_channels,
+    get_channel_index,
+    select_channels,
+)
 
 
 @pytest.mark.parametrize("device", ["cpu"])
@@ -29,3 +33,14 @@ def test_filter_channels(device):
     input = torch.randn(3, 5, 5).to(device)
     output = filter_channels(input, ["a", "b", "c"], ["c"])
     assert torch.allclose(input[2:], output)
+
+
+def test_get_channel_index():
+    assert get_channel_index(["a", "b", "c"], ["b", "c"]) == slice(1, 3)
+    index = get_channel_index(["a", "b", "c"], ["c", "a"])
+    assert index.tolist() == [2, 0]
+
+    input = torch.randn(2, 3, 4, 5)
+    torch.testing.assert_close(select_channels(input, index), input[:, [2, 0]])
+    with pytest.raises(ValueError):
+        get_channel_index(["a"], ["b"])
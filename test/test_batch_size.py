@@ -0,0 +1,180 @@
+# SPDX-FileCopyrightText: Copyright (c) 2023 NVIDIA CORPORATION & AFFILIATES.
+# SPDX-FileCopyrightText: All rights reserved.
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import datetime
+import json
+from test.test_end_to_end import get_data_source
+
+import pytest
+import torch
+import xarray
+
+from earth2mip import batch_size, inference_ensemble, schema, weather_events
+from earth2mip._channel_stds import channel_stds
+from earth2mip.networks import persistence
+
+
+class BatchLoop:
+    """Yields the initial condition and one step, recording the batch sizes"""
+
+    def __init__(self):
+        self.batch_sizes = []
+
+    def __call__(self, time, x, restart=None):
+        self.batch_sizes.append(x.shape[0])
+        yield time, x[:, -1], None
+        yield time + datetime.timedelta(hours=6), x[:, -1], None
+
+
+@pytest.fixture()
+def fake_memory(monkeypatch):
+    """100 bytes per member of the last batch, on top of a 50 byte baseline"""
+
+    def measure(model, time, x):
+        return batch_size.Measurement(
+            batch_size=x.shape[0], baseline=50, peak=50 + 100 * x.shape[0], seconds=1
+        )
+
+    monkeypatch.setattr(batch_size, "_measure", measure)
+
+
+@pytest.mark.parametrize(
+    "max_batch_size, memory_limit, expected, tried",
+    [
+        # 4 members need 450 bytes, 8 members would need 850
+        (16, 500, 4, [1, 2, 4]),
+        (3, 500, 3, [1, 2, 3]),
+        (16, 100, 1, [1]),
+    ],
+)
+def test_probe_batch_size(fake_memory, max_batch_size, memory_limit, expected, tried):
+    x = torch.zeros(1, 1, 2, 4, 8)
+    probe = batch_size.probe_batch_size(
+        BatchLoop(),
+        x,
+        datetime.datetime(2018, 1, 1),
+        max_batch_size=max_batch_size,
+        headroom=0.0,
+        memory_limit=memory_limit,
+    )
+    assert probe.batch_size == expected
+    assert [m.batch_size for m in probe.measurements] == tried
+    assert probe.to_dict()["measurements"][0]["peak"] == 150
+
+
+def test_probe_batch_size_headroom(fake_memory):
+    x = torch.zeros(1, 1, 2, 4, 8)
+    probe = batch_size.probe_batch_size(
+        BatchLoop(),
+        x,
+        datetime.datetime(2018, 1, 1),
+        max_batch_size=16,
+        headroom=0.5,
+        memory_limit=1000,
+    )
+    assert probe.limit == 500
+    assert probe.batch_size == 4
+
+
+def test_probe_batch_size_cpu():
+    model = BatchLoop()
+    x = torch.zeros(1, 1, 2, 4, 8)
+    probe = batch_size.probe_batch_size(
+        model, x, datetime.datetime(2018, 1, 1), max_batch_size=5
+    )
+    # a few small tensors always fit into the memory of the machine
+    assert probe.batch_size == 5
+    assert model.batch_sizes == [1, 2, 4, 5]
+    for m in probe.measurements:
+        assert m.peak >= m.baseline > 0
+
+
+def test_inference_ensemble_auto_batch_size(tmp_path):
+    inference = persistence(package=None)
+    data_source = get_data_source(inference)
+    for c in inference.out_channel_names:
+        channel_stds[c] = 0.0
+    config = schema.EnsembleRun(
+        weather_model="dummy",
+        simulation_length=2,
+        ensemble_members=3,
+        ensemble_batch_size="auto",
+        output_path=tmp_path.as_posix(),
+        weather_event=schema.WeatherEvent(
+            properties=weather_events.WeatherEventProperties(
+                name="test", start_time=datetime.datetime(2018, 1, 1)
+            ),
+            domains=[
+                weather_events.Window(
+                    name="globe",
+                    diagnostics=[
+                        weather_events.Diagnostic(
+                            type="raw", channels=inference.out_channel_names
+                        )
+                    ],
+                )
+            ],
+        ),
+    )
+    inference_ensemble.run_inference(
+        inference, config, data_source=data_source, progress=False
+    )
+
+    ds = xarray.open_dataset(tmp_path / "ensemble_out_0.nc")
+    assert ds.attrs["ensemble_batch_size"] == 3
+    record = json.loads(ds.attrs["ensemble_batch_size_probe"])
+    assert record["batch_size"] == 3
+    assert [m["batch_size"] for m in record["measurements"]] == [1, 2, 3]
+
+
+def test_inference_ensemble_auto_batch_size_rerun(tmp_path):
+    inference = persistence(package=None)
+    data_source = get_data_source(inference)
+    for c in inference.out_channel_names:
+        channel_stds[c] = 0.0
+
+    def run(**kwargs):
+        config = schema.EnsembleRun(
+            weather_model="dummy",
+            simulation_length=2,
+            output_format="zarr",
+            output_path=tmp_path.as_posix(),
+            weather_event=schema.WeatherEvent(
+                properties=weather_events.WeatherEventProperties(
+                    name="test", start_time=datetime.datetime(2018, 1, 1)
+                ),
+                domains=[
+                    weather_events.Window(
+                        name="globe",
+                        diagnostics=[
+                            weather_events.Diagnostic(
+                                type="raw", channels=inference.out_channel_names
+                            )
+                        ],
+                    )
+                ],
+            ),
+            **kwargs,
+        )
+        inference_ensemble.run_inference(
+            inference, config, data_source=data_source, progress=False
+        )
+        return xarray.open_zarr(tmp_path / "ensemble_out.zarr", group="globe")
+
+    run(ensemble_members=2, ensemble_batch_size=2)
+    # the batch size record in the restart directory is not a restart, so the
+    # outputs of the previous run are replaced
+    ds = run(ensemble_members=3, ensemble_batch_size="auto", restart_frequency=1)
+    assert ds.sizes["ensemble"] == 3
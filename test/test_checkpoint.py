@@ -0,0 +1,86 @@
+# SPDX-FileCopyrightText: Copyright (c) 2023 NVIDIA CORPORATION & AFFILIATES.
+# SPDX-FileCopyrightText: All rights reserved.
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import pytest
+import torch
+
+from earth2mip import checkpoint
+from earth2mip.model_registry import Package
+
+
+def _training_checkpoint(model):
+    state = {"module." + k: v for k, v in model.state_dict().items()}
+    return {"model_state": state, "optimizer_state": {"lr": 0.1}}
+
+
+@pytest.mark.parametrize("zipfile", [True, False])
+def test_load_state_dict(tmp_path, zipfile):
+    model = torch.nn.Linear(3, 3)
+    path = tmp_path / "weights.tar"
+    torch.save(
+        _training_checkpoint(model), path, _use_new_zipfile_serialization=zipfile
+    )
+    state_dict = checkpoint.load_state_dict(
+        path, key="model_state", strip_prefix="module."
+    )
+    assert list(state_dict) == ["weight", "bias"]
+    torch.testing.assert_close(state_dict["weight"], model.weight.detach())
+
+
+def test_load_module_shares_memory(tmp_path):
+    path = tmp_path / "weights.pt"
+    torch.save(torch.nn.Linear(3, 3).state_dict(), path)
+    state_dict = checkpoint.load_state_dict(path)
+
+    model = checkpoint.load_module(torch.nn.Linear(3, 3), state_dict)
+    assert model.weight.data_ptr() == state_dict["weight"].data_ptr()
+    assert isinstance(model.weight, torch.nn.Parameter)
+
+
+def test_load_without_mmap(tmp_path, monkeypatch):
+    # torch < 2.1 supports neither mmap nor assign
+    monkeypatch.setattr(checkpoint, "_HAS_MMAP", False)
+    monkeypatch.setattr(checkpoint, "_HAS_ASSIGN", False)
+    model = torch.nn.Linear(3, 3)
+    path = tmp_path / "weights.pt"
+    torch.save(model.state_dict(), path)
+
+    loaded = checkpoint.load_module(
+        torch.nn.Linear(3, 3), checkpoint.load_state_dict(path)
+    )
+    torch.testing.assert_close(loaded.weight, model.weight)
+
+
+def test_convert(tmp_path):
+    model = torch.nn.Linear(3, 3)
+    path = tmp_path / "weights.tar"
+    torch.save(_training_checkpoint(model), path)
+    package = Package(tmp_path.as_posix(), seperator="/")
+
+    # the original checkpoint
+    state_dict = checkpoint.load_package_state_dict(
+        package, "weights.tar", key="model_state", strip_prefix="module."
+    )
+    assert list(state_dict) == ["weight", "bias"]
+
+    out = checkpoint.convert(str(path), key="model_state", strip_prefix="module.")
+    assert out == str(tmp_path / "weights.pt")
+
+    # prefers the converted checkpoint
+    path.unlink()
+    state_dict = checkpoint.load_package_state_dict(
+        package, "weights.tar", key="model_state", strip_prefix="module."
+    )
+    torch.testing.assert_close(state_dict, model.state_dict())
@@ -17,14 +17,16 @@
 import pathlib
 
 import netCDF4 as nc
+import numpy as np
 import pytest
 import torch
 
 import earth2mip.grid
 from earth2mip import netcdf, weather_events
+from earth2mip.diagnostics import _quantiles_from_counts
 
 
-@pytest.mark.parametrize("cls", ["raw"])
+@pytest.mark.parametrize("cls", ["raw", "mean", "variance", "histogram", "quantile"])
 def test_diagnostic(cls: str, tmp_path: pathlib.Path):
     domain = weather_events.Window(
         name="Test",
@@ -57,6 +59,7 @@ def test_diagnostic(cls: str, tmp_path: pathlib.Path):
             batch_id = 0
             batch_size = n_ensemble
             diagnostic.update(data, time_index, batch_id, batch_size)
+        netcdf.finalize_netcdf([total_diagnostics])
 
         if cls == "skill":
             assert "tcwv" in ncfile["Test"]["skill"].variables
@@ -64,3 +67,87 @@ def test_diagnostic(cls: str, tmp_path: pathlib.Path):
             assert "tcwv" in ncfile["Test"].variables
         else:
             assert "tcwv" in ncfile["Test"][cls].variables
+
+
+def _reduce(diagnostic_type, batches, **kwargs):
+    """Stream ``batches`` of shape (ensemble, channel, lat, lon) into one output
+    time and return the written field of channel "a"
+    """
+    return _reduce_times(diagnostic_type, [batches], **kwargs)[0]
+
+
+def _reduce_times(diagnostic_type, batches_per_time, **kwargs):
+    """Like ``_reduce`` with a list of batches for every output time"""
+    lat = np.array([10.0, 0.0])
+    lon = np.array([0.0, 1.0, 2.0])
+    grid = earth2mip.grid.LatLonGrid(lat=lat.tolist(), lon=lon.tolist())
+    domain = weather_events.Window(
+        name="Test",
+        diagnostics=[
+            weather_events.Diagnostic(type=diagnostic_type, channels=["a"], **kwargs)
+        ],
+    )
+    with nc.Dataset("inmemory.nc", "w", diskless=True) as ncfile:
+        (diagnostic,) = netcdf.initialize_netcdf(
+            ncfile, [domain], grid, 4, torch.device("cpu")
+        )[0]
+        for time_index, batches in enumerate(batches_per_time):
+            for batch_id, batch in enumerate(batches):
+                diagnostic.update(batch, time_index, batch_id, batch.shape[0])
+        netcdf.finalize_netcdf([[diagnostic]])
+        return ncfile["Test"][diagnostic_type]["a"][:].data
+
+
+@pytest.mark.parametrize("batch_sizes", [[6], [1, 2, 3], [4, 2]])
+def test_streaming_moments_match_numpy(batch_sizes):
+    torch.manual_seed(0)
+    x = torch.randn(sum(batch_sizes), 1, 2, 3) * 3 + 10
+    batches = torch.split(x, batch_sizes)
+    np.testing.assert_allclose(
+        _reduce("mean", batches), x.mean(0)[0].numpy(), rtol=1e-5
+    )
+    np.testing.assert_allclose(
+        _reduce("variance", batches), x.var(0)[0].numpy(), rtol=1e-4
+    )
+
+
+def test_streaming_histogram():
+    x = torch.tensor([0.5, 1.5, 1.7, 3.9, -2.0, float("nan")])
+    x = x[:, None, None, None].expand(-1, 1, 2, 3)
+    counts = _reduce("histogram", torch.split(x, [2, 4]), nbins=4, bin_range=(0.0, 4.0))
+    # -2.0 falls into the first bin and nan is not counted
+    np.testing.assert_array_equal(counts[:, 0, 0], [2, 2, 0, 1])
+
+
+def test_streaming_quantile():
+    torch.manual_seed(0)
+    x = torch.rand(2000, 1, 2, 3)
+    q = _reduce(
+        "quantile",
+        torch.split(x, 500),
+        nbins=50,
+        bin_range=(0.0, 1.0),
+        quantiles=[0.1, 0.5, 0.9],
+    )
+    expected = torch.quantile(x[:, 0], torch.tensor([0.1, 0.5, 0.9]), dim=0)
+    np.testing.assert_allclose(q, expected.numpy(), atol=0.02)
+
+
+def test_streaming_quantile_bins_per_time():
+    # the spread grows with the lead time, so the bins of the first output time
+    # would not cover the later ones
+    torch.manual_seed(0)
+    x = torch.rand(2000, 1, 2, 3)
+    times = [[0.01 * x], [x], [10 * x]]
+    q = _reduce_times("quantile", times, nbins=50, quantiles=[0.1, 0.5, 0.9])
+    expected = torch.quantile(x[:, 0], torch.tensor([0.1, 0.5, 0.9]), dim=0)
+    for k, scale in enumerate([0.01, 1, 10]):
+        np.testing.assert_allclose(q[k], scale * expected.numpy(), atol=0.04 * scale)
+
+
+def test_quantiles_from_counts():
+    # 10 members evenly spread over [0, 10)
+    counts = torch.ones(1, 10, 1, dtype=torch.int32)
+    edges = torch.linspace(0, 10, 11)[None]
+    q = _quantiles_from_counts(counts, edges, [0.0, 0.25, 0.5, 1.0])
+    np.testing.assert_allclose(q[0, :, 0], [0.0, 2.5, 5.0, 10.0])
@@ -0,0 +1,108 @@
+# SPDX-FileCopyrightText: Copyright (c) 2023 NVIDIA CORPORATION & AFFILIATES.
+# SPDX-FileCopyrightText: All rights reserved.
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import datetime
+import os
+
+import numpy as np
+import torch
+import xarray
+
+from earth2mip.networks import dlwp
+
+CS_SHAPE = (6, 2, 2)
+LL_SHAPE = (3, 4)
+
+
+def _write_map(path, dense):
+    i, j = np.nonzero(dense)
+    ds = xarray.Dataset(
+        {
+            "row": ("n_s", i + 1),
+            "col": ("n_s", j + 1),
+            "S": ("n_s", dense[i, j]),
+            "frac_a": ("n_a", np.ones(dense.shape[1])),
+            "frac_b": ("n_b", np.ones(dense.shape[0])),
+        }
+    )
+    ds.to_netcdf(path)
+
+
+def _dense_map(n_b, n_a, rng):
+    dense = rng.uniform(size=(n_b, n_a))
+    dense[dense < 0.5] = 0
+    return dense
+
+
+def test_load_remap_cache(tmp_path):
+    rng = np.random.default_rng(0)
+    dense = _dense_map(24, 12, rng)
+    # the last column is empty, so the shape must come from the dimensions
+    dense[:, -1] = 0
+    path = str(tmp_path / "map.nc")
+    _write_map(path, dense)
+
+    M = dlwp._load_remap(path)
+    assert M.layout == torch.sparse_csr
+    np.testing.assert_allclose(M.to_dense().numpy(), dense, rtol=1e-6)
+    assert os.path.exists(path + ".csr.pt")
+
+    cached = dlwp._load_remap(path)
+    assert torch.equal(cached.to_dense(), M.to_dense())
+
+
+class Model(torch.nn.Module):
+    def forward(self, x):
+        # the 7 channels of both input times, without tisr and static fields
+        n = len(dlwp.CHANNELS)
+        return torch.cat([x[:, :n], x[:, n + 1 : 2 * n + 1]], dim=1)
+
+
+def test_dlwp_wrapper(tmp_path):
+    rng = np.random.default_rng(0)
+    n_cs, n_ll = np.prod(CS_SHAPE), np.prod(LL_SHAPE)
+    to_cs, to_ll = _dense_map(n_cs, n_ll, rng), _dense_map(n_ll, n_cs, rng)
+    _write_map(tmp_path / "ll_to_cs.nc", to_cs)
+    _write_map(tmp_path / "cs_to_ll.nc", to_ll)
+
+    lat = rng.uniform(-90, 90, size=CS_SHAPE)
+    lon = rng.uniform(0, 360, size=CS_SHAPE)
+    lsm = rng.uniform(size=(1, *CS_SHAPE))
+    z = rng.uniform(size=(1, *CS_SHAPE))
+    model = dlwp._DLWPWrapper(
+        Model(),
+        lsm,
+        lon,
+        lat,
+        z,
+        str(tmp_path / "ll_to_cs.nc"),
+        str(tmp_path / "cs_to_ll.nc"),
+        ll_shape=LL_SHAPE,
+    )
+
+    x = torch.randn(2, 2, len(dlwp.CHANNELS), *LL_SHAPE)
+    time = datetime.datetime(2018, 1, 1)
+    inputs = model.prepare_input(x, time)
+    n = len(dlwp.CHANNELS)
+    assert inputs.shape == (2, 2 * (n + 1) + 2, *CS_SHAPE)
+    torch.testing.assert_close(
+        inputs[:, -2], torch.tensor(lsm).float().expand(2, -1, -1, -1)
+    )
+
+    y = model(x, time)
+    expected = x.flatten(-2).double() @ torch.tensor(to_cs.T @ to_ll.T)
+    torch.testing.assert_close(
+        y.double(), expected.reshape(x.shape), rtol=1e-5, atol=1e-5
+    )
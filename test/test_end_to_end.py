@@ -31,9 +31,11 @@ import earth2mip.networks.dlwp
 from earth2mip import (
     inference_ensemble,
     inference_medium_range,
+    networks,
     schema,
     score_ensemble_outputs,
     weather_events,
+    zarr_output,
 )
 from earth2mip._channel_stds import channel_stds
 from earth2mip.inference_ensemble import run_basic_inference
@@ -64,7 +66,8 @@ class get_data_source:
         return self.arr
 
 
-def test_inference_ensemble(tmp_path):
+@pytest.mark.parametrize("output_format", ["netcdf", "zarr"])
+def test_inference_ensemble(tmp_path, output_format):
     inference = persistence(package=None)
     data_source = get_data_source(inference)
     time = datetime.datetime(2018, 1, 1)
@@ -74,6 +77,9 @@ def test_inference_ensemble(tmp_path):
     config = schema.EnsembleRun(
         weather_model="dummy",
         simulation_length=8,
+        ensemble_members=3,
+        ensemble_batch_size=2,
+        output_format=output_format,
         output_path=tmp_path.as_posix(),
         weather_event=schema.WeatherEvent(
             properties=weather_events.WeatherEventProperties(
@@ -97,13 +103,216 @@ def test_inference_ensemble(tmp_path):
         inference, config, data_source=data_source, progress=True
     )
 
-    path = tmp_path / "ensemble_out_0.nc"
-    ds = xarray.open_dataset(path.as_posix(), decode_times=False)
+    if output_format == "zarr":
+        path = tmp_path / "ensemble_out.zarr"
+        ds = xarray.open_zarr(path.as_posix(), decode_times=False)
+    else:
+        path = tmp_path / "ensemble_out_0.nc"
+        ds = xarray.open_dataset(path.as_posix(), decode_times=False)
     assert ds.time[0].item() == 0
+    assert ds.time.size == 9
+
+    ensemble = score_ensemble_outputs.open_ensemble(tmp_path, "globe")
+    assert ensemble.sizes["ensemble"] == 3
     out = tmp_path / "out"
     score_ensemble_outputs.main(tmp_path.as_posix(), out.as_posix(), score=False)
 
 
+def test_run_inference_leaves_model_unchanged(tmp_path):
+    # models may be shared by networks.model_cache
+    inference = networks.Inference(
+        Increment(),
+        center=np.zeros(2),
+        scale=np.ones(2),
+        grid=earth2mip.grid.equiangular_lat_lon_grid(5, 8),
+        channel_names=["a", "b"],
+    )
+    config = schema.EnsembleRun(
+        weather_model="dummy",
+        simulation_length=2,
+        ensemble_members=1,
+        ensemble_batch_size=1,
+        precision=schema.PrecisionPolicy(state="bfloat16"),
+        output_path=tmp_path.as_posix(),
+        weather_event=schema.WeatherEvent(
+            properties=weather_events.WeatherEventProperties(
+                name="test", start_time=datetime.datetime(2018, 1, 1)
+            ),
+            domains=[
+                weather_events.Window(
+                    name="globe",
+                    diagnostics=[weather_events.Diagnostic(type="raw", channels=["a"])],
+                )
+            ],
+        ),
+    )
+    inference_ensemble.run_inference(
+        inference,
+        config,
+        perturb=lambda x, rank, batch_id, device: x,
+        data_source=get_data_source(inference),
+        progress=False,
+    )
+    assert inference.precision == schema.PrecisionPolicy()
+    assert not inference.compile_steps
+
+
+def test_run_ensembles_shared_zarr(tmp_path, monkeypatch):
+    """Two ranks writing one zarr store, one after the other"""
+    grid = earth2mip.grid.equiangular_lat_lon_grid(5, 8)
+    inference = networks.Inference(
+        Increment(),
+        center=np.zeros(2),
+        scale=np.ones(2),
+        grid=grid,
+        channel_names=["a", "b"],
+    )
+    domains = [
+        weather_events.Window(
+            name="globe",
+            diagnostics=[weather_events.Diagnostic(type="raw", channels=["a"])],
+        )
+    ]
+    path = tmp_path / "ensemble_out.zarr"
+    nc = zarr_output.ZarrGroup.open(
+        path.as_posix(),
+        mode="w",
+        dimensions={"ensemble": 4, "time": 4},
+        chunks={"ensemble": 2, "time": 1},
+    )
+    times_written = []
+    set_time = inference_ensemble._set_time
+    monkeypatch.setattr(
+        inference_ensemble,
+        "_set_time",
+        lambda nc, k, value: times_written.append(k) or set_time(nc, k, value),
+    )
+
+    x = torch.zeros([1, 1, 2, *grid.shape])
+    for rank in range(2):
+        inference_ensemble.run_ensembles(
+            weather_event=None,
+            model=inference,
+            perturb=lambda x, rank, batch_id, device: x,
+            nc=nc,
+            domains=domains,
+            x=x,
+            n_ensemble=2,
+            n_steps=3,
+            output_frequency=1,
+            output_grid=None,
+            batch_size=2,
+            rank=rank,
+            date_obj=datetime.datetime(2018, 1, 1),
+            restart_frequency=None,
+            output_path=tmp_path.as_posix(),
+            progress=False,
+            ensemble_offset=2 * rank,
+            write_shared=rank == 0,
+        )
+
+    # only the first rank writes the times
+    assert times_written == [0, 1, 2, 3]
+    ds = xarray.open_zarr(path.as_posix(), decode_times=False, consolidated=False)
+    np.testing.assert_array_equal(ds.time, [0, 6, 12, 18])
+    a = zarr_output.ZarrGroup.open(path.as_posix())["globe"]["a"][:]
+    np.testing.assert_array_equal(a[:, :, 0, 0], [[0, 1, 2, 3]] * 4)
+
+
+class Increment(torch.nn.Module):
+    def forward(self, x):
+        return x + 1
+
+
+class Preempted(Exception):
+    pass
+
+
+class PreemptAfter:
+    """Wraps a time loop and raises after ``n`` steps in total"""
+
+    def __init__(self, model, n):
+        self.model = model
+        self.n = n
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+    def __call__(self, time, x, restart=None):
+        for item in self.model(time, x, restart=restart):
+            if self.n == 0:
+                raise Preempted()
+            self.n -= 1
+            yield item
+
+
+@pytest.mark.parametrize("output_format", ["netcdf", "zarr"])
+def test_inference_ensemble_resume(tmp_path, output_format):
+    grid = earth2mip.grid.equiangular_lat_lon_grid(5, 8)
+    inference = networks.Inference(
+        Increment(),
+        center=np.zeros(2),
+        scale=np.ones(2),
+        grid=grid,
+        channel_names=["a", "b"],
+    )
+    data_source = get_data_source(inference)
+    time = datetime.datetime(2018, 1, 1)
+
+    def perturb(x, rank, batch_id, device):
+        return x + torch.randn_like(x)
+
+    def run(model, path):
+        config = schema.EnsembleRun(
+            weather_model="dummy",
+            simulation_length=6,
+            ensemble_members=4,
+            ensemble_batch_size=2,
+            restart_frequency=2,
+            output_format=output_format,
+            output_path=path.as_posix(),
+            weather_event=schema.WeatherEvent(
+                properties=weather_events.WeatherEventProperties(
+                    name="test", start_time=time
+                ),
+                domains=[
+                    weather_events.Window(
+                        name="globe",
+                        diagnostics=[
+                            weather_events.Diagnostic(type="raw", channels=["a", "b"]),
+                            weather_events.Diagnostic(
+                                type="variance", channels=["a", "b"]
+                            ),
+                        ],
+                    )
+                ],
+            ),
+        )
+        inference_ensemble.run_inference(
+            model, config, perturb=perturb, data_source=data_source, progress=False
+        )
+        raw = score_ensemble_outputs.open_ensemble(path, "globe").load()
+        # the netCDF outputs of the ranks are concatenated along "ensemble"
+        variance = score_ensemble_outputs.open_ensemble(path, "globe/variance")
+        return raw, variance.squeeze(drop=True).load()
+
+    expected, expected_variance = run(inference, tmp_path / "expected")
+    for c in ["a", "b"]:
+        np.testing.assert_allclose(
+            expected_variance[c].values,
+            expected[c].var("ensemble", ddof=1).values,
+            rtol=1e-5,
+        )
+
+    # preempt in the middle of the second batch
+    with pytest.raises(Preempted):
+        run(PreemptAfter(inference, 7 + 3), tmp_path / "resumed")
+    resumed, resumed_variance = run(PreemptAfter(inference, 7), tmp_path / "resumed")
+
+    xarray.testing.assert_equal(expected, resumed)
+    xarray.testing.assert_allclose(expected_variance, resumed_variance)
+
+
 def test_checksum_reduce_precision(regtest):
     # Test case 1: Basic example
     arr1 = np.array([1.23456, 2.34567, 3.45678])
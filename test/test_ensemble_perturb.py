@@ -19,9 +19,16 @@ import datetime
 import pytest
 import torch
 
-from earth2mip import networks
-from earth2mip.ensemble_utils import generate_bred_vector, generate_noise_correlated
-from earth2mip.schema import Grid
+import earth2mip.grid
+from earth2mip import ensemble_utils, networks
+from earth2mip._channel_stds import channel_stds
+from earth2mip.ensemble_utils import (
+    generate_bred_vector,
+    generate_noise_correlated,
+    generate_noise_grf,
+)
+from earth2mip.inference_ensemble import get_initializer
+from earth2mip.schema import EnsembleRun, Grid
 
 
 @pytest.mark.slow
@@ -35,6 +42,24 @@ def test_generate_noise_correlated():
     assert torch.mean(noise) < torch.tensor(1e-09).to()
 
 
+@pytest.mark.parametrize("nlat,nlon", [(33, 64), (19, 36)])
+def test_generate_noise_grf(nlat, nlon):
+    torch.manual_seed(0)
+    grid = earth2mip.grid.equiangular_lat_lon_grid(nlat, nlon)
+    shape = (2, 1, 3, nlat, nlon)
+    out = torch.zeros(shape)
+    noise = generate_noise_grf(shape, grid, alpha=2.0, sigma=5.0, tau=2.0, out=out)
+    assert noise is out
+    assert not torch.any(torch.isnan(noise))
+    # every field is sampled independently
+    assert not torch.allclose(noise[0, 0, 0], noise[0, 0, 1])
+
+    ensemble_utils._get_grf_sampler.cache_clear()
+    generate_noise_grf(shape, grid, alpha=2.0, sigma=5.0, tau=2.0, max_batch=4)
+    generate_noise_grf(shape, grid, alpha=2.0, sigma=5.0, tau=2.0)
+    assert ensemble_utils._get_grf_sampler.cache_info().misses == 1
+
+
 class Dummy(torch.nn.Module):
     def forward(self, x, time):
         return 2.5 * torch.abs(x) * (1 - torch.abs(x))
@@ -81,3 +106,75 @@ def test_bred_vector():
     assert noise.device == x.device
     assert noise.shape == x.shape
     assert not torch.any(torch.isnan(noise))
+
+
+@pytest.mark.parametrize("shape", [(2, 3, 8, 16), (1, 2, 9, 15)])
+def test_brown_noise_matches_full_fft(shape):
+    torch.manual_seed(0)
+    noise = ensemble_utils.brown_noise(shape, reddening=2.0, dtype=torch.float64)
+
+    torch.manual_seed(0)
+    white = torch.randn(shape, dtype=torch.float64)
+    S = (
+        torch.abs(torch.fft.fftfreq(shape[-2], dtype=torch.float64)).reshape(-1, 1) ** 2
+        + torch.abs(torch.fft.fftfreq(shape[-1], dtype=torch.float64)) ** 2
+    )
+    S = torch.where(S == 0, 0, 1 / S)
+    S = S / torch.sqrt(torch.mean(S**2))
+    expected = torch.fft.ifft2(torch.fft.fft2(white) * S).real
+
+    torch.testing.assert_close(noise, expected)
+
+
+def test_get_initializer_perturbation_channels(monkeypatch):
+    monkeypatch.setitem(channel_stds, "a", 1.0)
+    monkeypatch.setitem(channel_stds, "b", 1.0)
+    model = networks.Inference(
+        Dummy(),
+        center=[0, 0],
+        scale=[1, 1],
+        grid=earth2mip.grid.equiangular_lat_lon_grid(5, 6),
+        channel_names=["a", "b"],
+    )
+    config = EnsembleRun(
+        weather_model="dummy",
+        simulation_length=1,
+        perturbation_strategy="gaussian",
+        perturbation_channels=["b"],
+    )
+    perturb = get_initializer(model, config)
+    x = torch.zeros([2, 1, 2, 5, 6])
+    out = perturb(x, rank=0, batch_id=0, device="cpu")
+    assert torch.all(out[:, :, 0] == 0)
+    assert torch.all(out[0] == 0)
+    assert torch.all(out[1:, :, 1] != 0)
+
+
+def test_bred_vector_batches_control_with_members():
+    class Counter(torch.nn.Module):
+        def __init__(self):
+            super().__init__()
+            self.batch_sizes = []
+
+        def forward(self, x, time):
+            self.batch_sizes.append(x.shape[0])
+            return 2.5 * torch.abs(x) * (1 - torch.abs(x))
+
+    counter = Counter()
+    model = networks.Inference(
+        counter,
+        center=[0, 0],
+        scale=[1, 1],
+        grid=Grid.grid_720x1440,
+        channel_names=["a", "b"],
+    )
+    x = torch.rand([3, 1, 2, 5, 6])
+    noise = generate_bred_vector(
+        x,
+        model,
+        noise_amplitude=0.01,
+        time=datetime.datetime(2018, 1, 1),
+        integration_steps=5,
+    )
+    assert noise.shape == x.shape
+    assert counter.batch_sizes == [4, 3, 3, 3, 3]
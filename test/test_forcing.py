@@ -0,0 +1,76 @@
+# SPDX-FileCopyrightText: Copyright (c) 2023 NVIDIA CORPORATION & AFFILIATES.
+# SPDX-FileCopyrightText: All rights reserved.
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import datetime
+
+import numpy as np
+import pytest
+from modulus.utils.zenith_angle import (
+    cos_zenith_angle,
+    toa_incident_solar_radiation_accumulated,
+)
+
+from earth2mip.forcing import SolarForcing
+
+LAT = np.linspace(90, -90, 19)
+LON = np.linspace(0, 350, 36)
+
+
+@pytest.mark.parametrize(
+    "time",
+    [
+        datetime.datetime(2018, 1, 1, tzinfo=datetime.timezone.utc),
+        datetime.datetime(2018, 6, 21, 13, tzinfo=datetime.timezone.utc),
+    ],
+)
+def test_solar_forcing_matches_modulus(time):
+    solar = SolarForcing(LAT, LON)
+    lat, lon = LAT[:, None], LON[None, :]
+
+    expected = cos_zenith_angle(time, lon, lat)
+    np.testing.assert_allclose(solar.cos_zenith(time).numpy(), expected, atol=1e-5)
+
+    expected = toa_incident_solar_radiation_accumulated(time.timestamp(), lat, lon)
+    np.testing.assert_allclose(solar.tisr(time).numpy(), expected, atol=1.0)
+
+
+def test_solar_forcing_points():
+    lat, lon = np.meshgrid(LAT, LON, indexing="ij")
+    time = datetime.datetime(2018, 3, 1)
+    regular = SolarForcing(LAT, LON).tisr(time)
+    points = SolarForcing(lat, lon).tisr(time)
+    assert points.shape == lat.shape
+    np.testing.assert_allclose(points.numpy(), regular.numpy())
+
+
+def test_solar_forcing_cache():
+    solar = SolarForcing(LAT, LON, maxsize=2)
+    times = np.array(
+        [["2018-01-01T00", "2018-01-01T06"], ["2018-01-01T06", "2018-01-01T12"]],
+        dtype="datetime64[ns]",
+    )
+    tisr = solar.tisr(times)
+    assert tisr.shape == (2, 2, len(LAT), len(LON))
+    assert (solar.hits, solar.misses) == (1, 3)
+    np.testing.assert_array_equal(tisr[0, 1].numpy(), tisr[1, 0].numpy())
+
+    # the least recently used time was evicted
+    solar.tisr(times[0, 0])
+    assert (solar.hits, solar.misses) == (1, 4)
+
+    # moving the module clears the cache
+    solar.double()
+    solar.tisr(times[0, 0])
+    assert (solar.hits, solar.misses) == (1, 5)
@@ -41,3 +41,48 @@ def test_get_bounds_window():
     lat_sl, _ = geometry.get_bounds_window(domain, lat, lon)
     assert lat[lat_sl].shape == (1,)
     assert lat[lat_sl][0] == 0
+
+
+@pytest.mark.parametrize("lat", [[90.0, 45.0, 0.0, -45.0, -90.0], [-90.0, 0.0, 90.0]])
+def test_bilinear_linear_field(lat):
+    lat = np.array(lat)
+    lon = np.arange(0, 360, 45.0)
+    # linear in lat and, away from the periodic boundary, in lon
+    data = torch.tensor(2 * lat[:, None] + lon[None, :] / 10, dtype=torch.float32)
+    points_lat = [90.0, 10.0, -30.0, lat[1]]
+    points_lon = [0.0, 100.0, 300.5, lon[3]]
+
+    out = geometry.bilinear(
+        data[None],
+        ("lat", "lon"),
+        {"lat": lat, "lon": lon},
+        {"lat": points_lat, "lon": points_lon},
+    )
+
+    expected = 2 * np.array(points_lat) + np.array(points_lon) / 10
+    assert out.shape == (1, 4)
+    np.testing.assert_allclose(out[0].numpy(), expected, rtol=1e-6)
+
+
+def test_bilinear_weights_wrap_longitude():
+    lat = np.array([10.0, 0.0])
+    lon = np.arange(0, 360, 90.0)
+    i, j, w = geometry.bilinear_weights(lat, lon, [0.0, 0.0], [315.0, -45.0])
+    for p in range(2):
+        assert set(j[:, p][w[:, p] > 0]) == {3, 0}
+        np.testing.assert_allclose(w[:, p].sum(), 1)
+        np.testing.assert_allclose(sorted(w[:, p][w[:, p] > 0]), [0.5, 0.5])
+
+
+def test_bilinear_on_nodes_ignores_nan_neighbors():
+    lat = np.array([10.0, 0.0, -10.0])
+    lon = np.arange(0, 360, 90.0)
+    data = torch.arange(12.0).reshape(3, 4)
+    data[2, 2] = float("nan")
+    out = geometry.bilinear(
+        data,
+        ("lat", "lon"),
+        {"lat": lat, "lon": lon},
+        {"lat": [0.0], "lon": [90.0]},
+    )
+    assert out.item() == data[1, 1].item()
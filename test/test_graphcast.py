@@ -13,12 +13,15 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import dataclasses
+
 import jax
 import jax.numpy
 import numpy as np
 import pytest
 from graphcast import xarray_jax
 
+from earth2mip.forcing import SolarForcing
 from earth2mip.model_registry import Package
 from earth2mip.networks import graphcast
 from earth2mip.networks.graphcast import get_channel_names, get_forcings
@@ -54,6 +57,30 @@ def test_get_forcings_jax():
         assert v.device() == lat.device()
 
 
+def test_get_forcings_per_sample_times():
+    time = np.array(["2018-01-01T00", "2018-07-01T12"], dtype="datetime64[ns]")
+    offsets = np.array([-6, 0], dtype="timedelta64[h]").astype("timedelta64[ns]")
+    forcing_time = graphcast._forcing_times(time, offsets)
+    assert forcing_time.shape == (2, 2)
+    assert forcing_time[1, 0] == np.datetime64("2018-07-01T06")
+
+    f = get_forcings(forcing_time, np.arange(-90, 90), np.arange(0, 360))
+    assert f["toa_incident_solar_radiation"].shape == (2, 2, 180, 360)
+
+
+def test_get_forcings_solar():
+    time = np.array([[np.datetime64("2018-01-01T00:00:00")]])
+    lat = np.arange(-90, 90)
+    lon = np.arange(0, 360)
+    expected = get_forcings(time, lat, lon)
+    f = get_forcings(time, lat, lon, solar=SolarForcing(lat, lon))
+    np.testing.assert_allclose(
+        f["toa_incident_solar_radiation"].values,
+        expected["toa_incident_solar_radiation"].values,
+        atol=10,
+    )
+
+
 def test_get_channel_names():
     names = get_channel_names(
         [
@@ -68,6 +95,34 @@ def test_get_channel_names():
     assert names == ["z1", "z2", "z3", "q1", "q2", "q3", "t2m"]
 
 
+def test_graph_cache_key():
+    from graphcast.graphcast import ModelConfig, TaskConfig
+
+    model_config = ModelConfig(
+        resolution=1.0,
+        mesh_size=5,
+        latent_size=512,
+        gnn_msg_steps=16,
+        hidden_layers=1,
+        radius_query_fraction_edge_length=0.6,
+    )
+    task_config = TaskConfig(
+        input_variables=("2m_temperature",),
+        target_variables=("2m_temperature",),
+        forcing_variables=("toa_incident_solar_radiation",),
+        pressure_levels=(500,),
+        input_duration="12h",
+    )
+    lat = np.linspace(-90, 90, 181)
+    lon = np.arange(0, 360, 1.0)
+    key = graphcast.graph_cache_key(model_config, task_config, lat, lon)
+    assert key == graphcast.graph_cache_key(model_config, task_config, lat, lon)
+
+    finer = dataclasses.replace(model_config, resolution=0.25, mesh_size=6)
+    assert key != graphcast.graph_cache_key(finer, task_config, lat, lon)
+    assert key != graphcast.graph_cache_key(model_config, task_config, lat, lon + 1)
+
+
 @pytest.mark.slow
 @pytest.mark.xfail
 @pytest.mark.timeout(60)
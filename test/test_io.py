@@ -14,12 +14,17 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import threading
+import time
+
 import netCDF4 as nc
+import numpy as np
+import pytest
 import torch
 
 import earth2mip.grid
-from earth2mip import netcdf
-from earth2mip.weather_events import Diagnostic, Window
+from earth2mip import geometry, netcdf, regrid
+from earth2mip.weather_events import Diagnostic, MultiPoint, Window
 
 
 def test_initialize_netcdf(tmp_path):
@@ -41,3 +46,107 @@ def test_initialize_netcdf(tmp_path):
             n_ensemble,
             torch.device(type="cpu"),
         )
+
+
+@pytest.mark.parametrize("queue_depth", [0, 1, 3])
+def test_async_writer_preserves_order(queue_depth):
+    written = []
+
+    def write(i):
+        time.sleep(0.001)
+        written.append(i)
+
+    with netcdf.AsyncWriter(queue_depth) as writer:
+        for i in range(10):
+            writer.submit(write, i)
+
+    assert written == list(range(10))
+
+
+def test_async_writer_group():
+    release = threading.Event()
+    written = []
+
+    def write(i):
+        release.wait()
+        written.append(i)
+
+    with netcdf.AsyncWriter(queue_depth=1) as writer:
+        # the writes of a group count as one, so submitting them does not wait
+        with writer.group():
+            for i in range(3):
+                writer.submit(write, i)
+        release.set()
+        writer.submit(write, 3)
+
+    assert written == [0, 1, 2, 3]
+
+
+def test_async_writer_raises_errors():
+    def fail():
+        raise ValueError()
+
+    writer = netcdf.AsyncWriter(queue_depth=2)
+    writer.submit(fail)
+    with pytest.raises(ValueError):
+        writer.close()
+
+
+@pytest.mark.parametrize("queue_depth", [None, 2])
+def test_output_plan_crops_before_regrid(queue_depth):
+    grid = earth2mip.grid.equiangular_lat_lon_grid(9, 16)
+    output_grid = earth2mip.grid.LatLonGrid(lat=grid.lat[::2], lon=grid.lon[1::2])
+    lat = np.array(output_grid.lat)
+    lon = np.array(output_grid.lon)
+    channel_names = ["a", "b", "c"]
+    domains = [
+        Window(
+            name="window",
+            lat_min=-50,
+            lat_max=50,
+            lon_min=60,
+            lon_max=250,
+            diagnostics=[Diagnostic(type="raw", channels=["c", "a"])],
+        ),
+        MultiPoint(
+            type="MultiPoint",
+            name="points",
+            # a grid node, a point between nodes and one across the periodic
+            # boundary
+            lat=[lat[1], 0.5 * (lat[2] + lat[3]), lat[0]],
+            lon=[lon[0], 100.0, 359.0],
+            diagnostics=[Diagnostic(type="raw", channels=["b"])],
+        ),
+    ]
+    data = torch.randn(2, len(channel_names), *grid.shape)
+    regridded = regrid.get_regridder(grid, output_grid)(data)
+
+    with nc.Dataset("inmemory.nc", "w", diskless=True) as ncfile:
+        total_diagnostics = netcdf.initialize_netcdf(
+            ncfile, domains, output_grid, 2, torch.device("cpu")
+        )
+        plan = netcdf.OutputPlan(
+            total_diagnostics,
+            domains,
+            grid,
+            channel_names,
+            output_grid=output_grid,
+            device=data.device,
+        )
+        if queue_depth is None:
+            plan.update(data, batch_id=0, time_count=0)
+        else:
+            with netcdf.AsyncWriter(queue_depth) as writer:
+                plan.update(data, batch_id=0, time_count=0, writer=writer)
+
+        for domain in domains:
+            _, _, expected = geometry.select_space(regridded, lat, lon, domain)
+            channels = domain.diagnostics[0].channels
+            for channel in channels:
+                c = channel_names.index(channel)
+                if domain.type == "MultiPoint":
+                    # stored station-major
+                    actual = ncfile[domain.name][channel][:, :, 0].T
+                else:
+                    actual = ncfile[domain.name][channel][:, 0]
+                np.testing.assert_allclose(actual, expected[:, c].numpy(), rtol=1e-6)
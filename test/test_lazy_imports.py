@@ -0,0 +1,45 @@
+# SPDX-FileCopyrightText: Copyright (c) 2023 NVIDIA CORPORATION & AFFILIATES.
+# SPDX-FileCopyrightText: All rights reserved.
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import subprocess
+import sys
+
+import pytest
+
+OPTIONAL = ["cdsapi", "cfgrib", "eccodes", "onnxruntime", "jax", "torch_harmonics"]
+
+
+def _imported_modules(code):
+    code = f"{code}; import sys; print(' '.join(sys.modules))"
+    args = [sys.executable, "-c", code]
+    proc = subprocess.run(args, capture_output=True, text=True)  # noqa: S603
+    proc.check_returncode()
+    return set(proc.stdout.split())
+
+
+@pytest.mark.parametrize(
+    "module", ["earth2mip.initial_conditions", "earth2mip.inference_ensemble"]
+)
+def test_optional_backends_are_not_imported(module):
+    modules = _imported_modules(f"import {module}")
+    assert not modules & set(OPTIONAL)
+
+
+def test_initial_conditions_lazy_submodule():
+    modules = _imported_modules(
+        "import earth2mip.initial_conditions as ic; ic.ifs.DataSource"
+    )
+    assert "earth2mip.initial_conditions.ifs" in modules
+    assert "earth2mip.initial_conditions.cds" not in modules
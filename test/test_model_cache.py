@@ -0,0 +1,83 @@
+# SPDX-FileCopyrightText: Copyright (c) 2023 NVIDIA CORPORATION & AFFILIATES.
+# SPDX-FileCopyrightText: All rights reserved.
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from types import SimpleNamespace
+
+import torch
+
+from earth2mip.model_cache import ModelCache, model_nbytes
+
+
+def _linear():
+    # 4 * (10 * 10 + 10) bytes
+    return torch.nn.Linear(10, 10)
+
+
+def test_model_nbytes():
+    model = torch.nn.Sequential(_linear(), _linear())
+    assert model_nbytes(model) == 2 * 440
+    # shared parameters are counted once
+    model[1].weight = model[0].weight
+    assert model_nbytes(model) == 440 + 40
+
+    # other models report their size, or are of unknown size
+    assert model_nbytes(SimpleNamespace(nbytes=100)) == 100
+    assert model_nbytes(object()) is None
+    assert model_nbytes(torch.nn.Identity()) is None
+
+
+def test_model_cache_lru():
+    cache = ModelCache(max_bytes=1000)
+    a = cache.get("a", _linear)
+    b = cache.get("b", _linear)
+    assert cache.get("a", _linear) is a
+    # evicts b, the least recently used
+    cache.get("c", _linear)
+    assert cache.get("a", _linear) is a
+    assert cache.get("b", _linear) is not b
+
+    info = cache.info()
+    assert (info.hits, info.misses, info.evictions) == (2, 4, 2)
+    assert info.n_models == 2
+    assert info.nbytes == 880
+
+
+def test_model_cache_budget():
+    cache = ModelCache(max_bytes=100)
+    a = cache.get("a", _linear)
+    assert cache.get("a", _linear) is not a
+    assert cache.info().n_models == 0
+
+    # models of unknown size are not cached
+    a = cache.get("a", object)
+    assert cache.get("a", object) is not a
+    b = cache.get("b", lambda: SimpleNamespace(nbytes=10))
+    assert cache.get("b", object) is b
+
+    # disabled by default
+    cache = ModelCache()
+    a = cache.get("a", object)
+    assert cache.get("a", object) is not a
+
+
+def test_model_cache_release():
+    cache = ModelCache(max_bytes=1000)
+    a = cache.get("a", _linear)
+    cache.get("b", _linear)
+    cache.release(a)
+    assert cache.info().n_models == 1
+    assert cache.get("a", _linear) is not a
+    cache.release()
+    assert cache.info().n_models == 0
@@ -21,7 +21,7 @@ import numpy as np
 import pytest
 import torch
 
-from earth2mip import _cli_utils, model_registry, networks, schema
+from earth2mip import _cli_utils, model_cache, model_registry, networks, schema
 from earth2mip.model_registry import Package
 
 
@@ -80,6 +80,19 @@ def test_get_model_uses_metadata(tmp_path):
     assert isinstance(model, MyTestInference)
 
 
+def test_get_model_cache(tmp_path, monkeypatch):
+    registry = _mock_registry_with_metadata(metadata_with_entrypoint, "model", tmp_path)
+    monkeypatch.setattr(networks, "model_cache", model_cache.ModelCache(2**20))
+    model = networks.get_model("model", registry)
+    assert networks.get_model("model", registry) is model
+    assert networks.get_model("model", registry, cache=False) is not model
+    info = networks.model_cache.info()
+    assert (info.hits, info.misses, info.n_models) == (1, 1, 1)
+
+    networks.model_cache.release(model)
+    assert networks.get_model("model", registry) is not model
+
+
 @pytest.mark.parametrize("required", [True, False])
 def test__cli_utils(tmp_path, required):
     path = tmp_path / "meta.json"
@@ -96,6 +109,9 @@ def test__cli_utils(tmp_path, required):
 
 
 class MyTestInference:
+    # the size reported to networks.model_cache
+    nbytes = 0
+
     def __init__(self, package, device, **kwargs):
         self.kwargs = kwargs
         self.device = device
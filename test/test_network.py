@@ -14,14 +14,16 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import copy
 import datetime
 
 import numpy as np
+import pytest
 import torch
 import torch.nn
 
 import earth2mip.grid
-from earth2mip import networks
+from earth2mip import networks, schema, time_loop
 
 
 class Identity(torch.nn.Module):
@@ -60,3 +62,181 @@ def test_inference_run_with_restart():
             break
 
     np.testing.assert_array_equal(final_state.numpy(), state.numpy())
+
+
+class AddHour(torch.nn.Module):
+    def forward(self, x, time):
+        hours = torch.tensor([t.hour for t in time], dtype=x.dtype)
+        return x + hours[:, None, None, None]
+
+
+def test_inference_per_sample_times():
+    grid = earth2mip.grid.equiangular_lat_lon_grid(5, 6)
+    model = networks.Inference(
+        AddHour(), center=[0, 0], scale=[1, 1], grid=grid, channel_names=["a", "b"]
+    )
+    times = [datetime.datetime(2018, 1, 1, 0), datetime.datetime(2018, 6, 1, 12)]
+    x = torch.zeros([2, 1, 2, *grid.shape])
+
+    iterator = model(np.array(times, dtype="datetime64[ns]"), x)
+    time, _, _ = next(iterator)
+    assert time == times
+    time, out, restart = next(iterator)
+    assert time == [t + model.time_step for t in times]
+    assert torch.all(out[0] == 0)
+    assert torch.all(out[1] == 12)
+
+    # restarts keep the per-sample times
+    time, _, _ = next(model(None, None, restart=restart))
+    assert time == [t + model.time_step for t in times]
+    _, out, _ = next(iterator)
+    assert torch.all(out[1] == 12 + 18)
+
+
+def test_inference_per_sample_times_wrong_length():
+    grid = earth2mip.grid.equiangular_lat_lon_grid(5, 6)
+    model = networks.Inference(
+        AddHour(), center=[0, 0], scale=[1, 1], grid=grid, channel_names=["a", "b"]
+    )
+    x = torch.zeros([2, 1, 2, *grid.shape])
+    with pytest.raises(ValueError):
+        next(model([datetime.datetime(2018, 1, 1)], x))
+
+
+def test_cos_zen_wrapper_per_sample_times():
+    lat = np.linspace(90, -90, 5)
+    lon = np.linspace(0, 360, 8, endpoint=False)
+    wrapper = networks.CosZenWrapper(torch.nn.Identity(), lon, lat)
+    times = [datetime.datetime(2018, 1, 1, 0), datetime.datetime(2018, 1, 1, 12)]
+    x = torch.zeros([2, 1, 5, 8])
+
+    batched = wrapper(x, times)
+    for i, time in enumerate(times):
+        single = wrapper(x[i : i + 1], time)
+        torch.testing.assert_close(batched[i : i + 1], single)
+    assert not torch.allclose(batched[0, 1], batched[1, 1])
+
+
+class Linear(torch.nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.weight = torch.nn.Parameter(torch.tensor(0.5))
+
+    def forward(self, x):
+        return self.weight * x + 1
+
+
+def _linear_inference():
+    grid = earth2mip.grid.equiangular_lat_lon_grid(5, 6)
+    return networks.Inference(
+        Linear(), center=[1, 2], scale=[2, 3], grid=grid, channel_names=["a", "b"]
+    )
+
+
+def _rollout(model, x, n):
+    time = datetime.datetime(2018, 1, 1)
+    return [out for _, (_, out, _) in zip(range(n), model(time, x))]
+
+
+@pytest.mark.slow
+def test_inference_compiled_matches_eager():
+    model = _linear_inference()
+    x = torch.randn([2, 1, 2, 5, 6])
+    expected = _rollout(model, x, 4)
+
+    model.enable_compile()
+    for _ in range(2):
+        torch.testing.assert_close(_rollout(model, x, 4), expected)
+    # compiled once per batch size
+    key = (2, torch.float32, torch.device("cpu"), True)
+    assert list(model._compiled_steps) == [key]
+    assert not model._compiled_steps[key].failed
+
+
+def test_inference_compile_falls_back_to_eager(monkeypatch):
+    def compile(f, **kwargs):
+        def fail(*args):
+            raise RuntimeError("compiler not available")
+
+        return fail
+
+    monkeypatch.setattr(torch, "compile", compile)
+    model = _linear_inference()
+    x = torch.randn([2, 1, 2, 5, 6])
+    expected = _rollout(model, x, 4)
+
+    model.enable_compile()
+    torch.testing.assert_close(_rollout(model, x, 4), expected)
+    (step,) = model._compiled_steps.values()
+    assert step.failed
+
+
+def test_inference_output_frequency():
+    model = _linear_inference()
+    x = torch.randn([2, 1, 2, 5, 6])
+    expected = _rollout(model, x, 7)
+
+    hinted = model.with_output_frequency(3)
+    assert model.output_frequency == 1
+    outputs = _rollout(hinted, x, 7)
+    for k, (out, expected_out) in enumerate(zip(outputs, expected)):
+        if k % 3 == 0:
+            torch.testing.assert_close(out, expected_out)
+        else:
+            assert out is None
+
+
+def test_inference_output_frequency_restart():
+    model = _linear_inference().with_output_frequency(2)
+    x = torch.randn([1, 1, 2, 5, 6])
+    time = datetime.datetime(2018, 1, 1)
+    restarts = [restart for _, (_, _, restart) in zip(range(2), model(time, x))]
+
+    resumed = [out for _, (_, out, _) in zip(range(3), model(time, None, restarts[1]))]
+    assert resumed[0] is None
+    assert resumed[1] is not None
+    assert resumed[2] is None
+
+
+def test_with_output_frequency_unsupported_loop():
+    loop = object()
+    assert time_loop.with_output_frequency(loop, 4) is loop
+
+
+def test_inference_copy():
+    model = _linear_inference()
+    model.enable_compile()
+    model._get_step(torch.zeros([1, 1, 2, 5, 6]))
+
+    copied = copy.copy(model)
+    copied.set_precision(schema.PrecisionPolicy(autocast="bfloat16"))
+    assert model.autocast_dtype == torch.float32
+    assert len(model._compiled_steps) == 1
+    assert copied.model is model.model
+
+
+class OnnxLike:
+    """A model whose weights are not torch tensors"""
+
+    def __init__(self, nbytes=None):
+        self.nbytes = nbytes
+
+    def forward(self, x):
+        return x
+
+
+def test_inference_nbytes():
+    # scale and center, whose reshaped buffers share their memory
+    buffers = 2 * 2 * 4
+    grid = earth2mip.grid.equiangular_lat_lon_grid(5, 6)
+    model = _linear_inference()
+    assert model.nbytes == buffers + sum(p.nbytes for p in model.parameters())
+
+    model = networks.Inference(
+        OnnxLike(100), center=[1, 2], scale=[2, 3], grid=grid, channel_names=["a", "b"]
+    )
+    assert model.nbytes == buffers + 100
+    model = networks.Inference(
+        OnnxLike(), center=[1, 2], scale=[2, 3], grid=grid, channel_names=["a", "b"]
+    )
+    assert model.nbytes is None
@@ -15,9 +15,12 @@
 # limitations under the License.
 
 import datetime
+import os
 
+import pytest
 import torch
 
+from earth2mip.model_registry import Package
 from earth2mip.networks import pangu
 
 
@@ -28,6 +31,10 @@ class MockPangu(pangu.PanguWeather):
     def __call__(self, pl, sl):
         return pl, sl
 
+    def run_batch(self, pl, sl, output, output_sfc):
+        output.copy_(pl)
+        output_sfc.copy_(sl)
+
 
 def test_pangu():
     model_6 = pangu.PanguStacked(MockPangu())
@@ -47,3 +54,167 @@ def test_pangu():
         times.append(time)
 
     assert times == [t0 + k * dt for k in range(n + 1)]
+
+
+def test_pangu_per_sample_time():
+    model_6 = pangu.PanguStacked(MockPangu())
+    model_24 = pangu.PanguStacked(MockPangu())
+    inference = pangu.PanguInference(model_6, model_24)
+    t0 = [datetime.datetime(2018, 1, 1), datetime.datetime(2018, 1, 2)]
+    dt = datetime.timedelta(hours=6)
+    x = torch.ones((2, 1, len(inference.in_channel_names), 2, 3))
+
+    times = [time for _, (time, _, _) in zip(range(6), inference(t0, x))]
+    assert times == [[t + k * dt for t in t0] for k in range(6)]
+
+    with pytest.raises(ValueError):
+        next(inference(t0[:1], x))
+
+
+class CountingPangu(MockPangu):
+    def __init__(self):
+        self.calls = 0
+
+    def run_batch(self, pl, sl, output, output_sfc):
+        self.calls += 1
+        output.copy_(pl + 1)
+        output_sfc.copy_(sl)
+
+
+def _pangu_outputs(inference, x, n):
+    t0 = datetime.datetime(2018, 1, 1)
+    return [y for _, (_, y, _) in zip(range(n + 1), inference(t0, x))]
+
+
+@pytest.mark.parametrize("output_frequency", [2, 4, 8])
+def test_pangu_output_frequency(output_frequency):
+    model_6 = pangu.PanguStacked(CountingPangu())
+    model_24 = pangu.PanguStacked(CountingPangu())
+    inference = pangu.PanguInference(model_6, model_24)
+    x = torch.zeros((1, 1, len(inference.in_channel_names), 2, 3))
+    n = 8
+    expected = _pangu_outputs(inference, x, n)
+    assert model_6.model.calls == 6
+
+    model_6.model.calls = model_24.model.calls = 0
+    hinted = inference.with_output_frequency(output_frequency)
+    outputs = _pangu_outputs(hinted, x, n)
+    for k, (y, expected_y) in enumerate(zip(outputs, expected)):
+        if k % output_frequency == 0:
+            torch.testing.assert_close(y, expected_y)
+        else:
+            assert y is None
+
+    # daily outputs only need the 24 hour model
+    assert model_6.model.calls == (0 if output_frequency % 4 == 0 else 6)
+    assert model_24.model.calls == 2
+
+
+def _synthetic_onnx(path, batched=False):
+    """A model with the inputs and outputs of pangu, returning input + 1 and
+    2 * input_surface"""
+    onnx = pytest.importorskip("onnx")
+    from onnx import TensorProto, helper
+
+    pl = ["variable", "level", "lat", "lon"]
+    sfc = ["variable", "lat", "lon"]
+    if batched:
+        pl, sfc = ["batch", *pl], ["batch", *sfc]
+    graph = helper.make_graph(
+        [
+            helper.make_node("Add", ["input", "one"], ["output"]),
+            helper.make_node("Mul", ["input_surface", "two"], ["output_surface"]),
+        ],
+        "pangu",
+        [
+            helper.make_tensor_value_info("input", TensorProto.FLOAT, pl),
+            helper.make_tensor_value_info("input_surface", TensorProto.FLOAT, sfc),
+        ],
+        [
+            helper.make_tensor_value_info("output", TensorProto.FLOAT, pl),
+            helper.make_tensor_value_info("output_surface", TensorProto.FLOAT, sfc),
+        ],
+        initializer=[
+            helper.make_tensor("one", TensorProto.FLOAT, [], [1.0]),
+            helper.make_tensor("two", TensorProto.FLOAT, [], [2.0]),
+        ],
+    )
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", 17)])
+    model.ir_version = 8
+    onnx.save(model, path)
+    return str(path)
+
+
+def test_pangu_weather_cpu(tmp_path):
+    path = _synthetic_onnx(tmp_path / "pangu.onnx")
+    model = pangu.PanguWeather(path, device="cpu", intra_op_num_threads=2)
+    pl = torch.zeros(5, 13, 4, 8)
+    sfc = torch.ones(4, 4, 8)
+
+    out, out_sfc = model(pl, sfc)
+    assert torch.all(out == 1)
+    assert torch.all(out_sfc == 2)
+
+    # the output buffers are reused
+    pointer = out.data_ptr()
+    out, out_sfc = model(pl + 1, sfc)
+    assert out.data_ptr() == pointer
+    assert torch.all(out == 2)
+
+    # an input in the output buffer gets a new buffer
+    out, _ = model(out, sfc)
+    assert out.data_ptr() != pointer
+    assert torch.all(out == 3)
+
+
+def test_pangu_inference_cpu(tmp_path):
+    path = _synthetic_onnx(tmp_path / "pangu.onnx")
+    package = Package(tmp_path.as_posix(), seperator="/")
+    (tmp_path / "pangu_weather_6.onnx").symlink_to(path)
+    (tmp_path / "pangu_weather_24.onnx").symlink_to(path)
+    inference = pangu.load(package, device="cpu")
+    assert inference.device == torch.device("cpu")
+    # the size of the model cache
+    assert inference.nbytes == 2 * os.path.getsize(path)
+
+    nchan = 5 * 13
+    x = torch.zeros((1, 1, len(inference.in_channel_names), 4, 8))
+    outputs = []
+    for k, (_, y, _) in enumerate(inference(datetime.datetime(2018, 1, 1), x)):
+        outputs.append(y)
+        if k == 4:
+            break
+
+    # 6 hour steps from the initial condition, then a 24 hour step from it
+    for k, n in enumerate([0, 1, 2, 3]):
+        assert torch.all(outputs[k][:, :nchan] == n)
+        assert torch.all(outputs[k][:, nchan:] == 0)
+    assert torch.all(outputs[4][:, :nchan] == 1)
+
+
+@pytest.mark.parametrize("batched", [False, True])
+def test_pangu_stacked_batch(tmp_path, batched):
+    path = _synthetic_onnx(tmp_path / "pangu.onnx", batched=batched)
+    model = pangu.PanguStacked(pangu.PanguWeather(path, device="cpu"))
+    assert model.model.batched == batched
+
+    nchan = 5 * 13
+    x = torch.randn(3, len(model.channel_names()), 4, 8)
+    y = model(x)
+    torch.testing.assert_close(y[:, :nchan], x[:, :nchan] + 1)
+    torch.testing.assert_close(y[:, nchan:], 2 * x[:, nchan:])
+
+    # the outputs are copies, which later calls do not overwrite
+    model(model(y))
+    torch.testing.assert_close(y[:, nchan:], 2 * x[:, nchan:])
+
+    # the model writes into two buffers, which are bound once
+    y = model._forward(x)
+    y2 = model._forward(y)
+    y3 = model._forward(y2)
+    assert y3.data_ptr() == y.data_ptr()
+    assert y2.data_ptr() != y.data_ptr()
+    torch.testing.assert_close(y3[:, nchan:], 8 * x[:, nchan:])
+    n_bindings = len(model.model.bindings)
+    model._forward(y3)
+    assert len(model.model.bindings) == n_bindings
@@ -0,0 +1,124 @@
+# SPDX-FileCopyrightText: Copyright (c) 2023 NVIDIA CORPORATION & AFFILIATES.
+# SPDX-FileCopyrightText: All rights reserved.
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import datetime
+
+import numpy as np
+import torch
+
+import earth2mip.grid
+from earth2mip import networks, precision, schema
+
+
+class Conv(torch.nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.conv = torch.nn.Conv2d(2, 2, 3, padding=1)
+
+    def forward(self, x):
+        return x + 0.1 * self.conv(x)
+
+
+def _initial_condition(batch_size):
+    center = torch.tensor([280.0, 5.0])[:, None, None]
+    scale = torch.tensor([10.0, 2.0])[:, None, None]
+    return center + scale * torch.randn([batch_size, 1, 2, 9, 16])
+
+
+def _model(policy=None):
+    torch.manual_seed(0)
+    grid = earth2mip.grid.equiangular_lat_lon_grid(9, 16)
+    return networks.Inference(
+        Conv(),
+        center=np.array([280.0, 5.0]),
+        scale=np.array([10.0, 2.0]),
+        grid=grid,
+        channel_names=["t", "u"],
+        precision=policy,
+    )
+
+
+def test_inference_bfloat16():
+    policy = schema.PrecisionPolicy(autocast="bfloat16", state="bfloat16")
+    model = _model(policy)
+    reference = _model()
+    x = _initial_condition(2)
+    time = datetime.datetime(2018, 1, 1)
+
+    iterator = model(time, x)
+    _, out, restart = next(iterator)
+    # the initial condition is normalized in float32
+    torch.testing.assert_close(out, x[:, 0])
+    _, out, restart = next(iterator)
+    assert restart["x"].dtype == torch.bfloat16
+    assert out.dtype == torch.float32
+
+    _, expected = list(zip(range(2), reference(time, x)))[-1]
+    torch.testing.assert_close(out, expected[1], rtol=0, atol=0.1)
+
+    # restarts continue in low precision
+    _, out, restart = next(model(None, None, restart=restart))
+    assert restart["x"].dtype == torch.bfloat16
+    assert out.dtype == torch.float32
+
+
+def test_inference_bfloat16_source():
+    def source(x, time):
+        assert x.dtype == torch.float32
+        return torch.full_like(x, 1e-5)
+
+    policy = schema.PrecisionPolicy(state="bfloat16")
+    model = _model(policy)
+    model.source = source
+    x = _initial_condition(2)
+    time = datetime.datetime(2018, 1, 1)
+
+    iterator = model(time, x)
+    _, _, restart = next(iterator)
+    x0 = restart["x"]
+    _, out, restart = next(iterator)
+
+    # the source term is added to the state in float32 and rounded once
+    dx = 1e-5 / model.scale * model.time_step.total_seconds()
+    expected_x, expected = model._step((x0.float() + dx).to(torch.bfloat16), time)
+    assert restart["x"].dtype == torch.bfloat16
+    torch.testing.assert_close(restart["x"], expected_x, rtol=0, atol=0)
+    torch.testing.assert_close(out, expected)
+
+
+def test_precision_report():
+    model = _model()
+    x = _initial_condition(1)
+    policies = [
+        schema.PrecisionPolicy(),
+        schema.PrecisionPolicy(autocast="bfloat16", state="bfloat16"),
+    ]
+    results = precision.precision_report(
+        model, x, datetime.datetime(2018, 1, 1), n_steps=3, policies=policies
+    )
+
+    assert [r.precision for r in results] == policies
+    assert results[0].error == [0, 0, 0]
+    assert 0 < results[1].error[-1] < 0.1
+    assert results[1].state_bytes == results[0].state_bytes // 2
+    assert model.precision == schema.PrecisionPolicy()
+    assert len(precision.format_report(results).splitlines()) == 3
+
+
+def test_model_metadata_precision():
+    metadata = schema.Model.parse_raw('{"precision": {"autocast": "float16"}}')
+    assert metadata.precision.autocast == schema.Precision.float16
+    assert metadata.precision.state == schema.Precision.float32
+    assert schema.Model().precision == schema.PrecisionPolicy()
@@ -31,3 +31,32 @@ def test_get_regridder():
     y = f(x)
     assert y.shape == (1, 1, 181, 360)
     assert torch.allclose(y, torch.ones_like(y))
+
+
+def test_get_regridder_crop_is_view():
+    src = grid.equiangular_lat_lon_grid(721, 1440)
+    dest = grid.equiangular_lat_lon_grid(720, 1440, includes_south_pole=False)
+    f = regrid.get_regridder(src, dest)
+    x = torch.randn(1, 2, 721, 1440)
+    y = f(x)
+    assert y.data_ptr() == x.data_ptr()
+    assert torch.equal(y, x[..., :720, :])
+
+
+def test_regrid_bilinear():
+    src = grid.equiangular_lat_lon_grid(8, 16, includes_south_pole=False)
+    dest = grid.equiangular_lat_lon_grid(17, 32)
+    f = regrid.get_regridder(src, dest)
+    assert isinstance(f, regrid.RegridBilinear)
+
+    lat = torch.tensor(src.lat)[:, None]
+    lon = torch.tensor(src.lon)
+    x = (2 * lat + torch.cos(torch.deg2rad(lon))).expand(1, 1, 8, 16).float()
+    y = f(x)
+    assert y.shape == (1, 1, 17, 32)
+    # nodes of the source grid are reproduced exactly
+    torch.testing.assert_close(y[..., ::2, ::2][..., :8, :], x)
+    # the south pole is not in the source grid and takes its last latitude
+    torch.testing.assert_close(y[..., -1, ::2], x[..., -1, :])
+    # linear in latitude, between the nodes
+    torch.testing.assert_close(y[..., 1, ::2], (x[..., 0, :] + x[..., 1, :]) / 2)
@@ -0,0 +1,84 @@
+# SPDX-FileCopyrightText: Copyright (c) 2023 NVIDIA CORPORATION & AFFILIATES.
+# SPDX-FileCopyrightText: All rights reserved.
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import datetime
+
+import numpy as np
+import pytest
+import torch
+
+import earth2mip.grid
+from earth2mip import networks
+from earth2mip.rollout import rollout
+
+
+class AddOne(torch.nn.Module):
+    def forward(self, x):
+        return x + 1
+
+
+@pytest.fixture()
+def time_loop():
+    grid = earth2mip.grid.equiangular_lat_lon_grid(5, 6)
+    return networks.Inference(
+        AddOne(), center=[0, 0], scale=[1, 1], grid=grid, channel_names=["a", "b"]
+    )
+
+
+TIME = datetime.datetime(2018, 1, 1)
+
+
+def test_rollout(time_loop):
+    x = torch.zeros([2, 1, 2, 5, 6])
+    output = rollout(time_loop, x, 4, time=TIME)
+    assert output.dims == ("time", "batch", "channel", "lat", "lon")
+    assert output.shape == (5, 2, 2, 5, 6)
+    assert list(output.time.values) == [
+        np.datetime64(TIME + k * time_loop.time_step) for k in range(5)
+    ]
+    np.testing.assert_array_equal(
+        output.mean(["batch", "channel", "lat", "lon"]), range(5)
+    )
+
+
+def test_rollout_stride_memmap(time_loop, tmp_path):
+    x = torch.zeros([1, 1, 2, 5, 6])
+    path = tmp_path / "out.npy"
+    output = rollout(time_loop, x, 7, stride=3, time=TIME, out=path)
+
+    assert isinstance(output.data, np.memmap)
+    np.testing.assert_array_equal(output[:, 0, 0, 0, 0], [0, 3, 6])
+    np.testing.assert_array_equal(np.load(path), output.values)
+
+
+def test_rollout_preallocated(time_loop):
+    x = torch.zeros([1, 1, 2, 5, 6])
+    out = torch.full([3, 1, 2, 5, 6], float("nan"))
+    output = rollout(time_loop, x, 2, time=TIME, out=out)
+    # shares the memory of ``out``
+    out[0] = -1
+    assert output[0, 0, 0, 0, 0] == -1
+    assert output[2, 0, 0, 0, 0] == 2
+
+    with pytest.raises(ValueError):
+        rollout(time_loop, x, 4, time=TIME, out=out)
+
+
+def test_rollout_per_sample_times(time_loop):
+    times = [TIME, TIME + datetime.timedelta(days=1)]
+    x = torch.zeros([2, 1, 2, 5, 6])
+    output = rollout(time_loop, x, 2, time=times)
+    assert output.valid_time.dims == ("time", "batch")
+    assert output.valid_time[2, 1] == np.datetime64(times[1] + 2 * time_loop.time_step)
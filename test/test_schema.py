@@ -16,6 +16,9 @@
 
 import json
 
+import pydantic
+import pytest
+
 from earth2mip import schema
 
 
@@ -29,3 +32,10 @@ def test_model():
     )
     loaded = json.loads(obj.json())
     assert loaded
+
+
+def test_ensemble_run_output_frequency():
+    config = schema.EnsembleRun(weather_model="a", simulation_length=4)
+    assert config.output_frequency == 1
+    with pytest.raises(pydantic.ValidationError):
+        schema.EnsembleRun(weather_model="a", simulation_length=4, output_frequency=0)
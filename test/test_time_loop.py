@@ -16,10 +16,12 @@
 # TODO add graphcast license
 import datetime
 
+import numpy as np
+import pytest
 import torch
 
 import earth2mip.grid
-from earth2mip.time_loop import GeoTensorInfo, TimeStepperLoop
+from earth2mip.time_loop import GeoTensorInfo, TimeStepperLoop, batch_times
 
 
 def test_time_stepper_loop():
@@ -78,3 +80,40 @@ def test_time_stepper_loop():
     assert_value_good(next(iterator), 0)
     assert_value_good(next(iterator), 1)
     assert_value_good(next(iterator), 2)
+
+
+def test_time_stepper_loop_per_sample_times():
+    grid = earth2mip.grid.equiangular_lat_lon_grid(4, 8)
+
+    class DummyTimeStepper:
+        input_info = output_info = GeoTensorInfo(["a"], grid=grid)
+        time_step = datetime.timedelta(hours=6)
+
+        def initialize(self, x, time):
+            self.initial_time = time
+            return x
+
+        def step(self, state):
+            return state, state[:, -1]
+
+    stepper = DummyTimeStepper()
+    times = [datetime.datetime(2018, 1, 1), datetime.datetime(2019, 1, 1)]
+    iterator = TimeStepperLoop(stepper)(times, torch.zeros([2, 1, 1, *grid.shape]))
+    assert next(iterator)[0] == times
+    assert stepper.initial_time == times
+    assert next(iterator)[0] == [t + stepper.time_step for t in times]
+
+
+def test_batch_times_shared_time():
+    time = datetime.datetime(2018, 1, 1)
+    assert batch_times(None, 2) == [None, None]
+    assert batch_times(time, 2) == [time, time]
+    assert batch_times(np.datetime64("2018-01-01"), 2) == [time, time]
+
+
+def test_batch_times_per_sample():
+    times = np.array(["2018-01-01", "2019-01-01"], dtype="datetime64[ns]")
+    expected = [datetime.datetime(2018, 1, 1), datetime.datetime(2019, 1, 1)]
+    assert batch_times(times, 2) == expected
+    with pytest.raises(ValueError):
+        batch_times(times, 3)
@@ -16,6 +16,8 @@ model_registry = config.MODEL_REGISTRY_FOLDER
 os.makedirs(model_registry, exist_ok=True)
 os.environ["MODEL_REGISTRY"] = model_registry
 print(f"MODEL_REGISTRY set to: {os.environ['MODEL_REGISTRY']}")
+# Keep loaded models in memory between simulation requests
+os.environ.setdefault("MODEL_CACHE_BYTES", str(8 * 2**30))
 
 # Now import Earth-2 MIP
 from earth2mip import registry, inference_ensemble